@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+
+from src.extensions import db
+from src.models.user import User, Vitals, CareTeamMember
+
+
+# Cohort risk analytics for the doctor dashboard. Vitals for every patient in
+# the cohort are pulled with one column query and reduced per (patient,
+# series) with NumPy segment operations, so the cost is one pass over the
+# rows rather than a Python loop per patient.
+
+# series name -> (vital type, value column)
+SERIES = {
+    'systolic': ('bp', 'value1'),
+    'diastolic': ('bp', 'value2'),
+    'glucose': ('sugar', 'value1'),
+}
+
+# (low, high) normal ranges; readings outside are flagged
+DEFAULT_THRESHOLDS = {
+    'systolic': (90, 140),
+    'diastolic': (60, 90),
+    'glucose': (70, 126),
+}
+
+
+def _to_float(raw):
+    try:
+        return float(raw)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def cohort_risk(patients, window_days=90, rolling=5, thresholds=None):
+    # patients: iterable of (id, username). Returns one dict per patient,
+    # highest risk score first.
+    import numpy as np
+
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+    patients = list(patients)
+    index = {pid: i for i, (pid, _) in enumerate(patients)}
+    results = {pid: {'patient_id': pid, 'username': name, 'score': 0.0, 'flags': [], 'metrics': {}} for pid, name in patients}
+    if not patients:
+        return []
+
+    since = datetime.utcnow() - timedelta(days=window_days)
+    rows = db.session.query(Vitals.patient_id, Vitals.type, Vitals.value1, Vitals.value2, Vitals.timestamp).filter(
+        Vitals.patient_id.in_(list(index)),
+        Vitals.type.in_({t for t, _ in SERIES.values()}),
+        Vitals.timestamp >= since,
+    ).all()
+
+    series_names = list(SERIES)
+    if rows:
+        pid, vtype, v1, v2, ts = zip(*rows)
+        pidx = np.fromiter((index[p] for p in pid), dtype=np.int64, count=len(rows))
+        vtype = np.array(vtype, dtype=object)
+        values = {'value1': np.fromiter((_to_float(v) for v in v1), dtype=float, count=len(rows)),
+                  'value2': np.fromiter((_to_float(v) for v in v2), dtype=float, count=len(rows))}
+        days = np.fromiter(((t - since).total_seconds() / 86400.0 for t in ts), dtype=float, count=len(rows))
+    else:
+        pidx = np.empty(0, dtype=np.int64)
+        vtype = np.empty(0, dtype=object)
+        values = {'value1': np.empty(0), 'value2': np.empty(0)}
+        days = np.empty(0)
+
+    # stack every series into one long array keyed by group = patient * S + series
+    keys, vals, times = [], [], []
+    for s_idx, name in enumerate(series_names):
+        v_type, column = SERIES[name]
+        mask = (vtype == v_type) & ~np.isnan(values[column])
+        keys.append(pidx[mask] * len(series_names) + s_idx)
+        vals.append(values[column][mask])
+        times.append(days[mask])
+    keys = np.concatenate(keys)
+    vals = np.concatenate(vals)
+    times = np.concatenate(times)
+    if keys.size == 0:
+        return sorted(results.values(), key=lambda r: (-r['score'], r['username'] or ''))
+
+    order = np.lexsort((times, keys))
+    keys, vals, times = keys[order], vals[order], times[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], keys.size]
+    counts = ends - starts
+    group = keys[starts]
+
+    # latest value and rolling mean of the last `rolling` readings per group
+    latest = vals[ends - 1]
+    latest_at = times[ends - 1]
+    csum = np.r_[0.0, np.cumsum(vals)]
+    roll_start = np.maximum(starts, ends - rolling)
+    roll_mean = (csum[ends] - csum[roll_start]) / (ends - roll_start)
+
+    # least-squares trend in units/day from segment sums
+    n = counts.astype(float)
+    st = np.add.reduceat(times, starts)
+    sv = np.add.reduceat(vals, starts)
+    stt = np.add.reduceat(times * times, starts)
+    stv = np.add.reduceat(times * vals, starts)
+    denom = n * stt - st * st
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where((counts > 1) & (denom > 0), (n * stv - st * sv) / denom, 0.0)
+
+    # out-of-range readings per group
+    lows = np.array([thresholds[s][0] for s in series_names])
+    highs = np.array([thresholds[s][1] for s in series_names])
+    s_of_row = keys % len(series_names)
+    out_row = (vals < lows[s_of_row]) | (vals > highs[s_of_row])
+    out_count = np.add.reduceat(out_row.astype(np.int64), starts)
+
+    g_patient = group // len(series_names)
+    g_series = group % len(series_names)
+    high_mean = roll_mean > highs[g_series]
+    low_mean = roll_mean < lows[g_series]
+    # score: share of out-of-range readings plus a point per series whose recent mean is out of range
+    score = out_count / n + (high_mean | low_mean)
+
+    for k in range(group.size):
+        pid = patients[g_patient[k]][0]
+        name = series_names[g_series[k]]
+        res = results[pid]
+        res['metrics'][name] = {
+            'latest': round(float(latest[k]), 1),
+            'mean': round(float(roll_mean[k]), 1),
+            'trend_per_day': round(float(slope[k]), 2),
+            'readings': int(counts[k]),
+            'out_of_range': int(out_count[k]),
+            'last_at': (since + timedelta(days=float(latest_at[k]))).isoformat(timespec='minutes'),
+        }
+        res['score'] = round(res['score'] + float(score[k]), 3)
+        if high_mean[k]:
+            res['flags'].append(f'{name} high')
+        elif low_mean[k]:
+            res['flags'].append(f'{name} low')
+
+    return sorted(results.values(), key=lambda r: (-r['score'], r['username'] or ''))
+
+
+def patients_for_doctor(doctor):
+    # the doctor's care team, via the (doctor_id, patient_id) primary key
+    return db.session.query(User.id, User.username).join(
+        CareTeamMember, CareTeamMember.patient_id == User.id
+    ).filter(CareTeamMember.doctor_id == doctor.id).order_by(User.username).all()
@@ -1,11 +1,15 @@
 from flask import Flask, render_template
 from src.config import Config
-from src.extensions import db, login_manager, socketio, csrf
+from src.extensions import db, login_manager, socketio, csrf, cache
 from src.views.main import main as main_blueprint
 from src.views.auth import auth as auth_blueprint
 from src.views.doctor import doctor as doctor_blueprint
 from src.views.appointments import appointments as appointments_blueprint
 from src.views.chat import chat as chat_blueprint
+from src.views.audit import audit_views as audit_blueprint
+from src import assets, importer, summary, conversations, search, archive, audit, images, fragments, fastjson, care_team, reminders, storage, upload_scan
+from src.schema import ensure_schema
+from src import database
 
 
 def create_app(test_config=None):
@@ -16,27 +20,45 @@ def create_app(test_config=None):
     if test_config:
         app.config.update(test_config)
 
-    # initialize extensions
+    # initialize extensions; engine options must be in place before db.init_app
+    database.configure(app)
     db.init_app(app)
+    database.init_app(app)
     login_manager.init_app(app)
     socketio.init_app(app)
     # initialize CSRF protection
     csrf.init_app(app)
+    fastjson.init_app(app)
+    cache.init_app(app)
+    fragments.init_app(app)
+    # fingerprinted/precompressed static files and dynamic response compression
+    assets.init_app(app)
+    importer.init_app(app)
+    summary.init_app(app)
+    conversations.init_app(app)
+    search.init_app(app)
+    archive.init_app(app)
+    audit.init_app(app)
+    images.init_app(app)
+    care_team.init_app(app)
+    reminders.init_app(app)
+    storage.init_app(app)
+    upload_scan.init_app(app)
 
     app.register_blueprint(main_blueprint)
     app.register_blueprint(auth_blueprint)
     app.register_blueprint(doctor_blueprint)
     app.register_blueprint(appointments_blueprint)
     app.register_blueprint(chat_blueprint)
+    app.register_blueprint(audit_blueprint)
 
     # Friendly 403 handler that renders a template
     @app.errorhandler(403)
     def forbidden(e):
         return render_template('403.html'), 403
 
-    # Create database tables on startup
-    with app.app_context():
-        db.create_all()
+    # Create database tables on startup (see SCHEMA_CHECK in config)
+    ensure_schema(app)
 
     return app
 
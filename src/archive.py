@@ -0,0 +1,247 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+from operator import itemgetter
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, func, or_, select
+
+from src.extensions import db, cache
+from src.cache import patient_key, chat_key
+from src.importer import parse_timestamp
+from src.models.user import ArchiveSegment, ChatMessage, Conversation, Vitals
+
+
+# Tiered archival. `flask archive` moves vitals and read chat messages older
+# than ARCHIVE_AFTER_DAYS out of the hot tables into append-only gzip'd JSONL
+# segments (one per patient or user pair per month and chunk of
+# ARCHIVE_BATCH_SIZE rows), committing per chunk so memory stays bounded and
+# an interrupted run simply continues next time. Readers call vitals_for() /
+# messages_between(), so views and exports keep returning the whole history;
+# segments are decoded only when the requested range (since=None being all of
+# it) starts before the newest archived row.
+# Archived messages drop out of chat search; unread messages are never archived.
+
+VITAL_FIELDS = ('id', 'type', 'value1', 'value2', 'timestamp', 'client_key')
+MESSAGE_FIELDS = ('id', 'sender_id', 'receiver_id', 'message_text', 'timestamp', 'read_at')
+_DATETIME_FIELDS = ('timestamp', 'read_at')
+
+
+def encode_rows(rows, level=6):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({k: v.isoformat() if isinstance(v, datetime) else v for k, v in row.items()},
+                                separators=(',', ':')))
+    return gzip.compress('\n'.join(lines).encode('utf-8'), compresslevel=level)
+
+
+def decode_rows(payload):
+    for line in gzip.decompress(payload).decode('utf-8').splitlines():
+        row = json.loads(line)
+        for k in _DATETIME_FIELDS:
+            if row.get(k):
+                row[k] = datetime.fromisoformat(row[k])
+        yield row
+
+
+def _by_month(rows):
+    months = {}
+    for row in rows:
+        months.setdefault(row['timestamp'].strftime('%Y-%m'), []).append(row)
+    return months
+
+
+def _write_segments(kind, subject_id, peer_id, rows):
+    level = current_app.config.get('ARCHIVE_COMPRESS_LEVEL', 6)
+    for month, month_rows in sorted(_by_month(rows).items()):
+        db.session.add(ArchiveSegment(
+            kind=kind, subject_id=subject_id, peer_id=peer_id, month=month, row_count=len(month_rows),
+            first_at=month_rows[0]['timestamp'], last_at=month_rows[-1]['timestamp'],
+            payload=encode_rows(month_rows, level)))
+
+
+def _chunk_filter(model, last_ts, last_id, max_id):
+    # rows up to and including the chunk's last (timestamp, id); ids above the chunk's
+    # highest were inserted after it was read and are left alone
+    return [or_(model.timestamp < last_ts, and_(model.timestamp == last_ts, model.id <= last_id)),
+            model.id <= max_id]
+
+
+def archive_vitals(cutoff, max_groups=None, batch_size=None):
+    # returns (patients processed, rows archived)
+    batch_size = batch_size or current_app.config.get('ARCHIVE_BATCH_SIZE', 5000)
+    patient_ids = [pid for pid, in db.session.query(Vitals.patient_id).filter(
+        Vitals.timestamp < cutoff).distinct().order_by(Vitals.patient_id)]
+    if max_groups:
+        patient_ids = patient_ids[:max_groups]
+    columns = [getattr(Vitals, f) for f in VITAL_FIELDS]
+    moved = 0
+    for pid in patient_ids:
+        old = (Vitals.patient_id == pid, Vitals.timestamp < cutoff)
+        # oldest chunk first; each chunk is written and deleted in one transaction, so the
+        # next query starts where the last one ended without a cursor
+        while True:
+            rows = [dict(zip(VITAL_FIELDS, r)) for r in db.session.query(*columns).filter(*old).order_by(
+                Vitals.timestamp, Vitals.id).limit(batch_size)]
+            if not rows:
+                break
+            _write_segments('vitals', pid, None, rows)
+            Vitals.query.filter(*old, *_chunk_filter(Vitals, rows[-1]['timestamp'], rows[-1]['id'],
+                                                     max(r['id'] for r in rows))).delete(synchronize_session=False)
+            db.session.commit()
+            moved += len(rows)
+        cache.bump(patient_key(pid))
+    return len(patient_ids), moved
+
+
+def archive_messages(cutoff, max_groups=None, batch_size=None):
+    # read messages only: unread ones still drive the conversations' unread counts
+    batch_size = batch_size or current_app.config.get('ARCHIVE_BATCH_SIZE', 5000)
+    old_q = ChatMessage.query.filter(ChatMessage.timestamp < cutoff, ChatMessage.read_at.isnot(None))
+    pairs = sorted({tuple(sorted(p)) for p in old_q.with_entities(ChatMessage.sender_id, ChatMessage.receiver_id).distinct()})
+    if max_groups:
+        pairs = pairs[:max_groups]
+    columns = [getattr(ChatMessage, f) for f in MESSAGE_FIELDS]
+    moved = 0
+    for a, b in pairs:
+        old = (ChatMessage.timestamp < cutoff, ChatMessage.read_at.isnot(None),
+               ((ChatMessage.sender_id == a) & (ChatMessage.receiver_id == b)) |
+               ((ChatMessage.sender_id == b) & (ChatMessage.receiver_id == a)))
+        while True:
+            rows = [dict(zip(MESSAGE_FIELDS, r)) for r in db.session.query(*columns).filter(*old).order_by(
+                ChatMessage.timestamp, ChatMessage.id).limit(batch_size)]
+            if not rows:
+                break
+            _write_segments('chat', a, b, rows)
+            chunk = (*old, *_chunk_filter(ChatMessage, rows[-1]['timestamp'], rows[-1]['id'],
+                                          max(r['id'] for r in rows)))
+            # the preview text and time stay on the conversation row
+            Conversation.query.filter(Conversation.last_message_id.in_(
+                select(ChatMessage.id).where(*chunk).scalar_subquery())).update(
+                {Conversation.last_message_id: None}, synchronize_session=False)
+            ChatMessage.query.filter(*chunk).delete(synchronize_session=False)
+            db.session.commit()
+            moved += len(rows)
+        cache.bump(chat_key(a, b))
+    return len(pairs), moved
+
+
+def _segments(kind, subject_id, peer_id, since=None, until=None):
+    q = ArchiveSegment.query.filter_by(kind=kind, subject_id=subject_id, peer_id=peer_id)
+    if since is not None:
+        q = q.filter(ArchiveSegment.month >= since.strftime('%Y-%m'))
+    if until is not None:
+        q = q.filter(ArchiveSegment.month <= until.strftime('%Y-%m'))
+    return q.order_by(ArchiveSegment.month, ArchiveSegment.id).all()
+
+
+def archived_through(kind, subject_id, peer_id=None):
+    # newest archived timestamp of a patient / user pair, or None; reads no payloads
+    return db.session.query(func.max(ArchiveSegment.last_at)).filter(
+        ArchiveSegment.kind == kind, ArchiveSegment.subject_id == subject_id,
+        ArchiveSegment.peer_id == peer_id if peer_id is not None else ArchiveSegment.peer_id.is_(None)).scalar()
+
+
+def _reaches_archive(kind, subject_id, peer_id, since):
+    if since is None:
+        return True
+    through = archived_through(kind, subject_id, peer_id)
+    return through is not None and since <= through
+
+
+def requested_range(args):
+    """(since, until) as naive UTC from optional ISO ?since= / ?until=; raises ValueError on bad dates.
+
+    A missing bound is None, so by default a view covers the whole history.
+    """
+    since = parse_timestamp(args['since']) if args.get('since') else None
+    until = parse_timestamp(args['until']) if args.get('until') else None
+    return since, until
+
+
+def _in_range(ts, since, until):
+    return (since is None or ts >= since) and (until is None or ts <= until)
+
+
+def archived_vitals(patient_id, since=None, until=None):
+    # archived readings of one patient as plain dicts, oldest first
+    if not _reaches_archive('vitals', patient_id, None, since):
+        return []
+    rows = [row for seg in _segments('vitals', patient_id, None, since, until)
+            for row in decode_rows(seg.payload) if _in_range(row['timestamp'], since, until)]
+    return sorted(rows, key=itemgetter('timestamp'))
+
+
+def archived_messages(user_a, user_b, since=None):
+    # archived messages between two users as plain dicts, oldest first
+    a, b = sorted((int(user_a), int(user_b)))
+    if not _reaches_archive('chat', a, b, since):
+        return []
+    return sorted((row for seg in _segments('chat', a, b, since) for row in decode_rows(seg.payload)
+                   if _in_range(row['timestamp'], since, None)), key=itemgetter('timestamp'))
+
+
+def vitals_for(patient_id, since=None, until=None):
+    """Vitals of one patient, oldest first, hot rows plus archived ones.
+
+    Archived rows come back as transient Vitals instances (never added to
+    the session) with `archived` set, so templates and exports treat both
+    alike. The archive is read only when `since` reaches back into it;
+    since=None means the whole history.
+    """
+    q = Vitals.query.filter(Vitals.patient_id == patient_id)
+    if since is not None:
+        q = q.filter(Vitals.timestamp >= since)
+    if until is not None:
+        q = q.filter(Vitals.timestamp <= until)
+    hot = q.order_by(Vitals.timestamp.asc()).all()
+    archived = [Vitals(patient_id=patient_id, **row) for row in archived_vitals(patient_id, since, until)]
+    if not archived:
+        return hot
+    for v in archived:
+        v.archived = True
+    return sorted(archived + hot, key=lambda v: v.timestamp)
+
+
+def vitals_count(patient_id):
+    # number of readings of one patient, hot plus archived; reads no payloads
+    hot = db.session.query(func.count(Vitals.id)).filter(Vitals.patient_id == patient_id).scalar()
+    archived = db.session.query(func.coalesce(func.sum(ArchiveSegment.row_count), 0)).filter(
+        ArchiveSegment.kind == 'vitals', ArchiveSegment.subject_id == patient_id).scalar()
+    return hot + archived
+
+
+def messages_between(user_a, user_b, since=None):
+    # thread between two users from `since` (None: all of it), oldest first, including archived messages
+    q = ChatMessage.query.filter(
+        ((ChatMessage.sender_id == user_a) & (ChatMessage.receiver_id == user_b)) |
+        ((ChatMessage.sender_id == user_b) & (ChatMessage.receiver_id == user_a)))
+    if since is not None:
+        q = q.filter(ChatMessage.timestamp >= since)
+    hot = q.order_by(ChatMessage.timestamp.asc()).all()
+    archived = [ChatMessage(**row) for row in archived_messages(user_a, user_b, since)]
+    if not archived:
+        return hot
+    return sorted(archived + hot, key=lambda m: m.timestamp)
+
+
+@click.command('archive')
+@click.option('--days', type=int, default=None, help='Archive rows older than this many days (default ARCHIVE_AFTER_DAYS).')
+@click.option('--kind', type=click.Choice(['all', 'vitals', 'chat']), default='all')
+@click.option('--max-groups', type=int, default=None, help='Stop after this many patients / conversations per kind.')
+@with_appcontext
+def archive_command(days, kind, max_groups):
+    days = days if days is not None else current_app.config.get('ARCHIVE_AFTER_DAYS', 365)
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    if kind in ('all', 'vitals'):
+        groups, rows = archive_vitals(cutoff, max_groups)
+        click.echo(f'Archived {rows} vitals for {groups} patients')
+    if kind in ('all', 'chat'):
+        groups, rows = archive_messages(cutoff, max_groups)
+        click.echo(f'Archived {rows} chat messages from {groups} conversations')
+
+
+def init_app(app):
+    app.cli.add_command(archive_command)
@@ -0,0 +1,196 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+import click
+from flask import current_app, request, send_from_directory, session, url_for
+from flask.cli import with_appcontext
+from itsdangerous import URLSafeTimedSerializer
+
+
+# Static asset pipeline. `python -m src.assets` (or `flask build-assets`)
+# copies every file under static/ to static/dist/ with a content hash in its
+# name, writes .gz/.br siblings for text assets and records the mapping in
+# dist/manifest.json. At runtime `asset_url()` resolves names through the
+# manifest and the static view serves the precompressed variant the client
+# accepts, with far-future immutable caching for fingerprinted files only;
+# dist/precache.js and dist/manifest.json keep fixed names and are revalidated.
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+PRECACHE_NAME = 'precache.js'
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.json', '.svg', '.html', '.txt', '.webmanifest', '.map'}
+# do not bother compressing tiny files; the headers cost more than the savings
+MIN_COMPRESS_SIZE = 256
+DYNAMIC_COMPRESS_MIMETYPES = {'application/json', 'text/html'}
+
+
+def _brotli():
+    # brotli is optional; without it only gzip variants are produced/served
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _hashed_name(rel_path, digest):
+    root, ext = os.path.splitext(rel_path)
+    return f'{root}.{digest[:12]}{ext}'
+
+
+def build_assets(static_folder):
+    # returns the manifest dict {original relative path: dist relative path}
+    dist_folder = os.path.join(static_folder, DIST_DIR)
+    if os.path.isdir(dist_folder):
+        shutil.rmtree(dist_folder)
+    brotli = _brotli()
+    manifest = {}
+
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist_folder)
+        for name in sorted(files):
+            src = os.path.join(root, name)
+            rel = os.path.relpath(src, static_folder).replace(os.sep, '/')
+            with open(src, 'rb') as fh:
+                data = fh.read()
+            out_rel = f'{DIST_DIR}/' + _hashed_name(rel, hashlib.sha256(data).hexdigest())
+            out = os.path.join(static_folder, *out_rel.split('/'))
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            with open(out, 'wb') as fh:
+                fh.write(data)
+
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS and len(data) >= MIN_COMPRESS_SIZE:
+                gz = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(gz) < len(data):
+                    with open(out + '.gz', 'wb') as fh:
+                        fh.write(gz)
+                if brotli is not None:
+                    br = brotli.compress(data, quality=11)
+                    if len(br) < len(data):
+                        with open(out + '.br', 'wb') as fh:
+                            fh.write(br)
+            manifest[rel] = out_rel
+
+    with open(os.path.join(dist_folder, MANIFEST_NAME), 'w') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+
+    # precache list for the service worker; the cache name changes whenever any asset does
+    version = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()[:12]
+    urls = ['/static/' + manifest[k] for k in sorted(manifest) if not k.startswith('sw/')]
+    with open(os.path.join(dist_folder, PRECACHE_NAME), 'w') as fh:
+        fh.write(f'self.CARECONNECT_CACHE = {json.dumps("careconnect-" + version)};\n')
+        fh.write(f'self.CARECONNECT_PRECACHE = {json.dumps(urls, indent=2)};\n')
+    return manifest
+
+
+def load_manifest(static_folder):
+    path = os.path.join(static_folder, DIST_DIR, MANIFEST_NAME)
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def set_manifest(app, manifest):
+    app.extensions['asset_manifest'] = manifest
+    # only these carry a content hash in their name; everything else in dist/ (the
+    # manifest, precache.js) keeps its name across builds
+    app.extensions['asset_fingerprinted'] = frozenset(manifest.values())
+
+
+def asset_url(filename, **values):
+    # drop-in for url_for('static', filename=...) that prefers the fingerprinted copy
+    manifest = current_app.extensions.get('asset_manifest') or {}
+    return url_for('static', filename=manifest.get(filename, filename), **values)
+
+
+def serve_static(filename):
+    static_folder = current_app.static_folder
+    built = filename.startswith(f'{DIST_DIR}/')
+    immutable = filename in current_app.extensions.get('asset_fingerprinted', ())
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    encoding = None
+    if built:
+        accepted = request.accept_encodings
+        for enc, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if accepted[enc] and os.path.isfile(os.path.join(static_folder, filename + suffix)):
+                encoding = enc
+                filename = filename + suffix
+                break
+
+    if immutable:
+        resp = send_from_directory(static_folder, filename, mimetype=mimetype, max_age=current_app.config.get('STATIC_IMMUTABLE_MAX_AGE', 31536000))
+        resp.cache_control.immutable = True
+        resp.cache_control.public = True
+        resp.vary.add('Accept-Encoding')
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+        return resp
+    resp = send_from_directory(static_folder, filename, mimetype=mimetype)
+    if built:
+        # fixed names that change content on every build: always revalidate
+        resp.cache_control.no_cache = True
+        resp.cache_control.max_age = None
+        resp.vary.add('Accept-Encoding')
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+    return resp
+
+
+def _embeds_csrf_token(data):
+    # Every signed token generate_csrf() hands out for a session starts with the
+    # same encoding of the session's raw token, so this also finds tokens in
+    # pages served from the response cache.
+    raw = session.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))
+    if not raw:
+        return False
+    return URLSafeTimedSerializer('', salt='wtf-csrf-token').dump_payload(raw) in data
+
+
+def compress_response(response):
+    # gzip dynamic JSON/HTML bodies above COMPRESS_MIN_SIZE. HTML carrying the
+    # CSRF token next to reflected input is left alone (BREACH).
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in DYNAMIC_COMPRESS_MIMETYPES
+            or not request.accept_encodings['gzip']):
+        return response
+    data = response.get_data()
+    if len(data) < current_app.config.get('COMPRESS_MIN_SIZE', 1024):
+        return response
+    if response.mimetype == 'text/html' and _embeds_csrf_token(data):
+        return response
+    response.set_data(gzip.compress(data, compresslevel=current_app.config.get('COMPRESS_LEVEL', 6)))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    # the body changed, so any strong validator computed on it no longer applies
+    if response.headers.get('ETag') and not response.headers['ETag'].startswith('W/'):
+        response.headers['ETag'] = 'W/' + response.headers['ETag']
+    return response
+
+
+def init_app(app):
+    set_manifest(app, load_manifest(app.static_folder))
+    app.view_functions['static'] = serve_static
+    app.jinja_env.globals['asset_url'] = asset_url
+    if app.config.get('COMPRESS_RESPONSES', True):
+        app.after_request(compress_response)
+    app.cli.add_command(build_assets_command)
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    manifest = build_assets(current_app.static_folder)
+    click.echo(f'Built {len(manifest)} assets into {os.path.join(current_app.static_folder, DIST_DIR)}')
+
+
+if __name__ == '__main__':
+    folder = os.path.join(os.path.dirname(__file__), 'static')
+    print(f'Built {len(build_assets(folder))} assets into {os.path.join(folder, DIST_DIR)}')
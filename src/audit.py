@@ -0,0 +1,142 @@
+import atexit
+import threading
+from collections import deque
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, make_response
+from flask_login import current_user
+from sqlalchemy import event
+
+from src.extensions import db
+from src.models.user import AuditEvent
+
+
+# Buffered audit trail of doctor access to patient data. record() only
+# appends to an in-memory ring buffer; a background thread flushes it to the
+# append-only audit_events table in one executemany per batch, every
+# AUDIT_FLUSH_INTERVAL seconds or as soon as AUDIT_BATCH_SIZE events are
+# waiting. When the database cannot keep up the buffer drops its oldest
+# events and counts them in `dropped`. Under TESTING (or AUDIT_ASYNC=False)
+# the buffer is flushed at the end of every request instead.
+
+
+@event.listens_for(AuditEvent, 'before_update')
+@event.listens_for(AuditEvent, 'before_delete')
+def _append_only(mapper, connection, target):
+    raise RuntimeError('audit events are append-only')
+
+
+class AuditBuffer:
+    def __init__(self, app, size, batch_size, interval, background=True):
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self.background = background
+        self.dropped = 0
+        self._events = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._events)
+
+    def append(self, row):
+        with self._lock:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(row)
+            full = len(self._events) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        # returns the number of events written
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._events)
+                self._events.clear()
+            if not rows:
+                return 0
+            try:
+                with self.app.app_context(), db.engine.begin() as conn:
+                    conn.execute(AuditEvent.__table__.insert(), rows)
+            except Exception:
+                self.app.logger.exception('Audit flush failed; %d events re-queued', len(rows))
+                with self._lock:
+                    # older events go back in front; the ring buffer may drop some of them
+                    overflow = max(len(rows) + len(self._events) - self._events.maxlen, 0)
+                    self.dropped += overflow
+                    self._events.extendleft(reversed(rows[overflow:]))
+                return 0
+            return len(rows)
+
+    def start(self):
+        # lazily, so a forked worker starts its own writer on first use
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+
+class AuditLog:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        buf = AuditBuffer(app, size=app.config.get('AUDIT_BUFFER_SIZE', 10000),
+                          batch_size=app.config.get('AUDIT_BATCH_SIZE', 200),
+                          interval=app.config.get('AUDIT_FLUSH_INTERVAL', 2.0),
+                          background=app.config.get('AUDIT_ASYNC', True) and not app.testing)
+        # one buffer per app so separate app instances never mix events
+        app.extensions['audit_buffer'] = buf
+        atexit.register(buf.flush)
+        if not buf.background:
+            app.teardown_request(lambda exc: buf.flush())
+
+    @property
+    def buffer(self):
+        return current_app.extensions['audit_buffer']
+
+    def record(self, action, patient_id, target=None, actor_id=None):
+        if actor_id is None:
+            actor_id = current_user.id
+        buf = self.buffer
+        buf.append({'actor_id': int(actor_id), 'patient_id': int(patient_id), 'action': action,
+                    'target': None if target is None else str(target), 'occurred_at': datetime.utcnow()})
+        if buf.background:
+            buf.start()
+
+    def flush(self):
+        return self.buffer.flush()
+
+    def audited(self, action, patient):
+        # records `action` for doctors once the view succeeded; `patient`
+        # receives the view kwargs and returns the patient id (or None)
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code < 400 and (current_user.role or '').strip().lower() == 'doctor':
+                    patient_id = patient(**kwargs)
+                    if patient_id:
+                        self.record(action, patient_id)
+                return resp
+            return wrapper
+        return decorator
+
+
+audit_log = AuditLog()
+
+
+def init_app(app):
+    audit_log.init_app(app)
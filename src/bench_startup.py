@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+# Cold-start benchmark: runs a fresh interpreter with `-X importtime`, builds
+# the app once and reports cumulative import time per module plus the time
+# spent inside create_app(). Run from the project root:
+#
+#   python -m src.bench_startup [--runs 3] [--top 25] [--fast]
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+CHILD = '''
+import json, sys, time
+t0 = time.perf_counter()
+from src.app import create_app
+t1 = time.perf_counter()
+app = create_app()
+t2 = time.perf_counter()
+sys.stdout.write(json.dumps({"import_s": t1 - t0, "create_app_s": t2 - t1}))
+'''
+
+
+def parse_importtime(stderr):
+    # {module: cumulative microseconds} for every module imported in the run
+    out = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        out[name.strip()] = int(cumulative_us)
+    return out
+
+
+def run_once(env):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1]), parse_importtime(proc.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure CareConnect cold-start time.')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=25, help='number of slowest modules to list')
+    parser.add_argument('--fast', action='store_true', help='run with FAST_STARTUP=1')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    if args.fast:
+        env['FAST_STARTUP'] = '1'
+
+    timings, modules = [], {}
+    for _ in range(args.runs):
+        timing, mods = run_once(env)
+        timings.append(timing)
+        for name, us in mods.items():
+            modules.setdefault(name, []).append(us)
+
+    best = lambda key: min(t[key] for t in timings)
+    print(f'runs: {args.runs}  FAST_STARTUP={"1" if args.fast else env.get("FAST_STARTUP", "0")}')
+    print(f'import src.app : {best("import_s") * 1000:8.1f} ms (best)')
+    print(f'create_app()   : {best("create_app_s") * 1000:8.1f} ms (best)')
+    print()
+    print(f'{"module":50} {"cumulative ms":>14}')
+    ranked = sorted(((min(v), k) for k, v in modules.items()), reverse=True)
+    # modules the app imports directly, then the heaviest overall
+    for us, name in [r for r in ranked if r[1].startswith('src.')] + [r for r in ranked if not r[1].startswith('src.')][:args.top]:
+        print(f'{name:50} {us / 1000:14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+import click
+from flask import current_app, g, request, session, make_response
+from flask_login import current_user
+
+
+# Response cache keyed on (user, route, args, entity versions). Write handlers
+# bump the version of the entity they touched, so a cached entry is never
+# served after the data behind it changed; stale entries simply age out of
+# the store.
+
+def patient_key(patient_id):
+    # profile, medicines, vitals and files of one patient; a malformed id from the
+    # query string keys a version nobody bumps, and the view rejects it
+    pid = str(patient_id).strip()
+    return f'patient:{int(pid)}' if pid.isdigit() else f'patient:{pid}'
+
+
+def chat_key(user_a, user_b):
+    a, b = sorted((int(user_a), int(user_b)))
+    return f'chat:{a}:{b}'
+
+
+def conversations_key(user_id):
+    # one user's conversation list (last message, unread counts)
+    return f'conversations:{int(user_id)}'
+
+
+def care_team_key(user_id):
+    # the patients of a doctor, or the doctors of a patient
+    return f'care-team:{int(user_id)}'
+
+
+def summary_key(doctor_id):
+    # the summary rows of one doctor's care-team patients (dashboard, chat contacts)
+    return f'patient-summaries:{int(doctor_id)}'
+
+
+def medications_key():
+    # prescribed medication names and counts (the autocomplete index of every worker)
+    return 'medications'
+
+
+def users_key(role):
+    # the list of all users with a given role (contact lists, doctor dashboard)
+    return f'users:{(role or "").strip().lower()}'
+
+
+class LRUBackend:
+    # in-process store; enough for the single-worker deployment in render.yaml
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_versions(self, names):
+        with self._lock:
+            return [self._versions.get(n, 0) for n in names]
+
+    def bump(self, names):
+        with self._lock:
+            for n in names:
+                self._versions[n] = self._versions.get(n, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    # shared store in a local SQLite file so several workers on one host see
+    # the same entries and, more importantly, the same version counters
+    def __init__(self, path, max_entries=2048):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, stored_at REAL, '
+                     'status INTEGER, content_type TEXT, body BLOB)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_entries_stored_at ON entries (stored_at)')
+        conn.execute('CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute('SELECT stored_at, status, content_type, body FROM entries WHERE key = ?', (key,)).fetchone()
+        return tuple(row) if row else None
+
+    def set(self, key, entry):
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO entries (key, stored_at, status, content_type, body) VALUES (?, ?, ?, ?, ?)',
+                     (key,) + tuple(entry))
+        self._writes += 1
+        # trim the oldest rows now and then rather than on every write
+        if self._writes % 100 == 0:
+            conn.execute('DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+                         (self.max_entries,))
+
+    def get_versions(self, names):
+        if not names:
+            return []
+        marks = ','.join('?' * len(names))
+        rows = dict(self._conn().execute(f'SELECT name, version FROM versions WHERE name IN ({marks})', list(names)).fetchall())
+        return [rows.get(n, 0) for n in names]
+
+    def bump(self, names):
+        conn = self._conn()
+        conn.executemany('INSERT INTO versions (name, version) VALUES (?, 1) '
+                         'ON CONFLICT(name) DO UPDATE SET version = version + 1', [(n,) for n in names])
+
+    def clear(self):
+        self._conn().execute('DELETE FROM entries')
+
+
+class ResponseCache:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        kind = (app.config.get('CACHE_BACKEND') or 'lru').strip().lower()
+        max_entries = app.config.get('CACHE_MAX_ENTRIES', 2048)
+        if kind == 'sqlite':
+            path = app.config.get('CACHE_PATH') or os.path.join(app.instance_path, 'response_cache.db')
+            backend = SQLiteBackend(path, max_entries)
+        elif kind in ('none', 'off', ''):
+            backend = None
+        else:
+            backend = LRUBackend(max_entries)
+        # one backend per app so separate app instances never share entries
+        app.extensions['response_cache'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions.get('response_cache')
+
+    def bump(self, *entities):
+        backend = self.backend
+        if backend is not None and entities:
+            backend.bump(entities)
+            if isinstance(backend, LRUBackend) and click.get_current_context(silent=True) is not None:
+                # a CLI command's in-process versions never reach the web workers
+                self._warn_unshared()
+
+    def _warn_unshared(self):
+        if current_app.extensions.get('response_cache_warned'):
+            return
+        current_app.extensions['response_cache_warned'] = True
+        current_app.logger.warning('CACHE_BACKEND=lru keeps cache versions per process, so running workers may '
+                                   'serve stale responses until restarted. Use CACHE_BACKEND=sqlite to share '
+                                   'invalidations with them.')
+
+    def _make_key(self, backend, entities, html):
+        names = sorted(set(entities))
+        versions = backend.get_versions(names)
+        parts = [
+            current_user.get_id() if current_user.is_authenticated else 'anon',
+            request.path,
+            '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True))),
+            ','.join(f'{n}@{v}' for n, v in zip(names, versions)),
+        ]
+        if html:
+            # rendered pages embed the session's CSRF token
+            parts.append(session.get('csrf_token') or '')
+        return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+    def cached(self, entities, html=False):
+        # `entities` receives the view kwargs and returns the entity keys the
+        # response depends on. HTML entries are capped at half the CSRF token
+        # lifetime so a cached form never carries an expired token.
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                backend = self.backend
+                # pages may render pending flash messages once, so never serve or store them
+                if backend is None or request.method != 'GET' or (html and session.get('_flashes')):
+                    return view(*args, **kwargs)
+
+                key = self._make_key(backend, entities(**kwargs), html)
+                max_age = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600
+                now = time.time()
+                entry = backend.get(key)
+                if entry is not None and (not html or now - entry[0] < max_age / 2):
+                    backend.hits += 1
+                    resp = current_app.response_class(entry[3], status=entry[1], content_type=entry[2])
+                    resp.headers['X-Cache'] = 'HIT'
+                    return resp
+
+                backend.misses += 1
+                resp = make_response(view(*args, **kwargs))
+                # a replica may lag the entity versions in the key, so its answers are not stored
+                if (resp.status_code == 200 and not resp.is_streamed and not g.get('db_replica_read')
+                        and not (html and session.get('_flashes'))):
+                    backend.set(key, (now, resp.status_code, resp.content_type, resp.get_data()))
+                resp.headers['X-Cache'] = 'MISS'
+                return resp
+            return wrapper
+        return decorator
@@ -0,0 +1,142 @@
+from functools import wraps
+
+import click
+from flask import abort
+from flask.cli import with_appcontext
+from flask_login import current_user
+from sqlalchemy import select
+
+from src.extensions import db, cache
+from src.cache import care_team_key
+from src.models.user import Appointment, CareTeamMember, User
+
+
+# Doctor-patient assignments. Doctor listings (dashboard, chat contacts, risk
+# analytics) join through the care_team table instead of scanning every
+# patient, and doctors may only open the records of their own patients. A
+# patient joins a doctor's team when the doctor confirms an appointment, or
+# by hand with `flask care-team assign`; `flask care-team sync` backfills
+# teams from confirmed appointments already in the database.
+
+
+def is_doctor(user=None):
+    user = user or current_user
+    return (user.role or '').strip().lower() == 'doctor'
+
+
+def assign(doctor_id, patient_id, source='manual'):
+    # idempotent; returns True when the pair is new. The caller commits, then calls changed().
+    if db.session.get(CareTeamMember, (doctor_id, patient_id)) is not None:
+        return False
+    db.session.add(CareTeamMember(doctor_id=doctor_id, patient_id=patient_id, source=source))
+    return True
+
+
+def unassign(doctor_id, patient_id):
+    member = db.session.get(CareTeamMember, (doctor_id, patient_id))
+    if member is None:
+        return False
+    db.session.delete(member)
+    return True
+
+
+def changed(doctor_id, patient_id):
+    # after the commit: invalidates both sides' cached listings
+    cache.bump(care_team_key(doctor_id), care_team_key(patient_id))
+
+
+def is_member(doctor_id, patient_id):
+    return db.session.get(CareTeamMember, (int(doctor_id), int(patient_id))) is not None
+
+
+def patient_ids(doctor_id):
+    # select of one doctor's patient ids, for use in IN (...) or joins
+    return select(CareTeamMember.patient_id).where(CareTeamMember.doctor_id == doctor_id)
+
+
+def doctor_ids(patient_id):
+    return select(CareTeamMember.doctor_id).where(CareTeamMember.patient_id == patient_id)
+
+
+def has_doctors(patient_id):
+    return db.session.query(doctor_ids(patient_id).exists()).scalar()
+
+
+def require_patient(patient_id):
+    # doctors may only act on patients of their own care team
+    if not is_doctor():
+        abort(403)
+    if not is_member(current_user.id, patient_id):
+        abort(403)
+
+
+def requires_patient(patient):
+    # view decorator running require_patient() for the id `patient` returns from the
+    # view kwargs (None: the user's own data). Place it above @cache.cached, so a
+    # cached response is never served without the check.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            patient_id = patient(**kwargs)
+            if patient_id is not None:
+                require_patient(patient_id)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def sync_from_appointments():
+    # returns the number of pairs added
+    pairs = db.session.query(Appointment.doctor_id, Appointment.patient_id).filter(
+        Appointment.status == 'confirmed').distinct().all()
+    added = [(d, p) for d, p in pairs if assign(d, p, source='appointment')]
+    db.session.commit()
+    for doctor_id, patient_id in added:
+        changed(doctor_id, patient_id)
+    return len(added)
+
+
+def _user(username, role):
+    user = User.query.filter_by(username=username).first()
+    if user is None or (user.role or '').strip().lower() != role:
+        raise click.ClickException(f'No {role} named {username!r}')
+    return user
+
+
+@click.group('care-team')
+def care_team_cli():
+    """Manage doctor-patient assignments."""
+
+
+@care_team_cli.command('assign')
+@click.argument('doctor')
+@click.argument('patient')
+@with_appcontext
+def assign_command(doctor, patient):
+    doctor_id, patient_id = _user(doctor, 'doctor').id, _user(patient, 'patient').id
+    added = assign(doctor_id, patient_id)
+    db.session.commit()
+    changed(doctor_id, patient_id)
+    click.echo(f'{patient} assigned to {doctor}' if added else f'{patient} is already on {doctor}\'s team')
+
+
+@care_team_cli.command('remove')
+@click.argument('doctor')
+@click.argument('patient')
+@with_appcontext
+def remove_command(doctor, patient):
+    doctor_id, patient_id = _user(doctor, 'doctor').id, _user(patient, 'patient').id
+    removed = unassign(doctor_id, patient_id)
+    db.session.commit()
+    changed(doctor_id, patient_id)
+    click.echo(f'{patient} removed from {doctor}\'s team' if removed else f'{patient} is not on {doctor}\'s team')
+
+
+@care_team_cli.command('sync')
+@with_appcontext
+def sync_command():
+    click.echo(f'Added {sync_from_appointments()} care-team assignments from confirmed appointments')
+
+
+def init_app(app):
+    app.cli.add_command(care_team_cli)
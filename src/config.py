@@ -7,8 +7,103 @@ class Config:
     if SQLALCHEMY_DATABASE_URI.startswith('postgres://'):
         SQLALCHEMY_DATABASE_URI = SQLALCHEMY_DATABASE_URI.replace('postgres://', 'postgresql://', 1)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite connection pragmas (applied on every new connection to a file database)
+    SQLITE_PRAGMAS_ENABLED = os.environ.get('SQLITE_PRAGMAS_ENABLED', 'True').lower() in ('true', '1')
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -64000))  # negative = KiB
+    # Read replicas: comma-separated URLs; reads in @read_replica views go there, writes
+    # always hit the primary, and a user's own writes pin them to the primary for a while
+    DB_REPLICA_URIS = os.environ.get('DATABASE_REPLICA_URLS', '')
+    DB_REPLICA_STICKY_SECONDS = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+    # Postgres connection pool
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'True').lower() in ('true', '1')
+    # Archival: `flask archive` moves vitals and read chat messages older than this
+    # into compressed per-patient / per-conversation monthly segments
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+    ARCHIVE_COMPRESS_LEVEL = int(os.environ.get('ARCHIVE_COMPRESS_LEVEL', 6))
+    # rows read, written to segments and deleted per transaction
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 5000))
+    # Audit trail: events are buffered in memory and written in batches by a
+    # background thread (flushed per request when AUDIT_ASYNC is off or under TESTING)
+    AUDIT_ASYNC = os.environ.get('AUDIT_ASYNC', 'True').lower() in ('true', '1')
+    AUDIT_BUFFER_SIZE = int(os.environ.get('AUDIT_BUFFER_SIZE', 10000))
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 200))
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 2.0))
     DEBUG = os.environ.get('FLASK_DEBUG', 'False').lower() in ('true', '1')
+    # Fast start-up for sleep-on-idle instances: skip create_all() while the
+    # stored schema fingerprint matches ('always' | 'versioned' | 'skip').
+    # With 'skip', deploy tooling also runs `flask rebuild-search-index`.
+    FAST_STARTUP = os.environ.get('FAST_STARTUP', 'False').lower() in ('true', '1')
+    SCHEMA_CHECK = os.environ.get('SCHEMA_CHECK', 'versioned' if FAST_STARTUP else 'always')
     # File uploads
     BASE_DIR = os.path.dirname(__file__)
     UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB
\ No newline at end of file
+    # Uploaded photos are auto-oriented, stripped of metadata, downscaled and
+    # recompressed by a small worker pool after the upload request returns
+    IMAGE_OPTIMIZE = os.environ.get('IMAGE_OPTIMIZE', 'True').lower() in ('true', '1')
+    IMAGE_OPTIMIZE_ASYNC = os.environ.get('IMAGE_OPTIMIZE_ASYNC', 'True').lower() in ('true', '1')
+    IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', 2048))
+    IMAGE_JPEG_QUALITY = int(os.environ.get('IMAGE_JPEG_QUALITY', 82))
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+    # keep the untouched upload in cold storage (empty = discard originals)
+    IMAGE_ORIGINALS_FOLDER = os.environ.get('IMAGE_ORIGINALS_FOLDER', '')
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB
+    # total upload bytes per user; 0 disables the quota
+    STORAGE_QUOTA_BYTES = int(os.environ.get('STORAGE_QUOTA_BYTES', 500 * 1024 * 1024))
+    # `flask scan-uploads`: files vs medical_files consistency scan. Checkpoint
+    # and quarantine default to the instance folder; files younger than the
+    # grace period are never treated as orphans (their row may not be committed yet)
+    UPLOAD_SCAN_CHECKPOINT = os.environ.get('UPLOAD_SCAN_CHECKPOINT', '')
+    UPLOAD_QUARANTINE_FOLDER = os.environ.get('UPLOAD_QUARANTINE_FOLDER', '')
+    UPLOAD_SCAN_BATCH_SIZE = int(os.environ.get('UPLOAD_SCAN_BATCH_SIZE', 200))
+    UPLOAD_SCAN_PAUSE_SECONDS = float(os.environ.get('UPLOAD_SCAN_PAUSE_SECONDS', 0.5))
+    UPLOAD_SCAN_GRACE_SECONDS = int(os.environ.get('UPLOAD_SCAN_GRACE_SECONDS', 3600))
+    # Appointment scheduling
+    APPOINTMENT_DEFAULT_MINUTES = int(os.environ.get('APPOINTMENT_DEFAULT_MINUTES', 30))
+    APPOINTMENT_MAX_MINUTES = int(os.environ.get('APPOINTMENT_MAX_MINUTES', 240))
+    # doctors' working hours (local clinic time) and weekdays (0=Monday)
+    WORKING_HOURS_START = int(os.environ.get('WORKING_HOURS_START', 9))
+    WORKING_HOURS_END = int(os.environ.get('WORKING_HOURS_END', 17))
+    WORKING_DAYS = (0, 1, 2, 3, 4)
+    FREE_SLOTS_MAX_DAYS = 31
+    # Appointment reminders: minutes before the start, and how far ahead the scheduler loads
+    REMINDER_OFFSETS_MINUTES = (1440, 60)
+    REMINDER_WINDOW_MINUTES = int(os.environ.get('REMINDER_WINDOW_MINUTES', 360))
+    REMINDERS_ASYNC = os.environ.get('REMINDERS_ASYNC', 'True').lower() in ('true', '1')
+    # how far back the iCalendar feed reaches; future appointments are always included
+    ICAL_FEED_PAST_DAYS = int(os.environ.get('ICAL_FEED_PAST_DAYS', 90))
+    # Response cache: 'lru' (in-process), 'sqlite' (shared by workers and CLI commands on one host)
+    # or 'none'. With 'lru', invalidations from `flask ...` commands never reach running workers.
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'lru')
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 2048))
+    CACHE_PATH = os.environ.get('CACHE_PATH')  # defaults to instance/response_cache.db
+    # {% cache %} template fragments (in-process LRU); 0 disables
+    FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 1024))
+    # Static assets / compression
+    STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+    COMPRESS_RESPONSES = os.environ.get('COMPRESS_RESPONSES', 'True').lower() in ('true', '1')
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_LEVEL = 6
+    # rows encoded per chunk by list APIs (get_vitals, get_messages); orjson is used when installed
+    JSON_STREAM_BATCH_SIZE = int(os.environ.get('JSON_STREAM_BATCH_SIZE', 500))
+    # maximum readings accepted by /api/vitals/batch in one request
+    VITALS_BATCH_MAX = int(os.environ.get('VITALS_BATCH_MAX', 500))
+    # rows per transaction for streaming vitals imports
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+    # body size limit of /api/vitals/import in place of MAX_CONTENT_LENGTH; 0 = no limit
+    IMPORT_MAX_CONTENT_LENGTH = int(os.environ.get('IMPORT_MAX_CONTENT_LENGTH', 1024 * 1024 * 1024))
+    # Cohort risk analytics (doctor dashboard)
+    RISK_WINDOW_DAYS = int(os.environ.get('RISK_WINDOW_DAYS', 90))
+    RISK_ROLLING_READINGS = 5
+    RISK_THRESHOLDS = {
+        'systolic': (90, 140),
+        'diastolic': (60, 90),
+        'glucose': (70, 126),
+    }
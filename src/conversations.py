@@ -0,0 +1,140 @@
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError
+
+from src.extensions import db
+from src.models.user import ChatMessage, Conversation, User
+
+
+# Maintenance of the per-user conversations table. handle_private_message
+# calls record_message() before its commit, so both participants' rows change
+# in the same transaction as the message; mark_read() stamps read receipts and
+# clears one side's unread count. A missing row is computed from chat_messages
+# on first touch; `flask rebuild-conversations` repairs drift.
+
+PREVIEW_LENGTH = 200
+
+
+def _preview(text):
+    text = text or ''
+    return text if len(text) <= PREVIEW_LENGTH else text[:PREVIEW_LENGTH - 1] + '…'
+
+
+def _between(a, b):
+    return or_(and_(ChatMessage.sender_id == a, ChatMessage.receiver_id == b),
+               and_(ChatMessage.sender_id == b, ChatMessage.receiver_id == a))
+
+
+def _fill(conv):
+    # recompute every column of one conversation row from chat_messages
+    last = ChatMessage.query.filter(_between(conv.user_id, conv.other_id)).order_by(
+        ChatMessage.timestamp.desc(), ChatMessage.id.desc()).first()
+    conv.last_message_id = last.id if last else None
+    conv.last_sender_id = last.sender_id if last else None
+    conv.last_message_text = _preview(last.message_text) if last else None
+    conv.last_message_at = last.timestamp if last else None
+    conv.unread_count = db.session.query(func.count(ChatMessage.id)).filter(
+        ChatMessage.receiver_id == conv.user_id, ChatMessage.sender_id == conv.other_id,
+        ChatMessage.read_at.is_(None)).scalar()
+    return conv
+
+
+def _load(user_id, other_id):
+    # returns (conversation, fresh); a fresh row already reflects the pending changes
+    conv = db.session.get(Conversation, (user_id, other_id))
+    if conv is not None:
+        return conv, False
+    db.session.flush()
+    conv = _fill(Conversation(user_id=user_id, other_id=other_id))
+    try:
+        # a savepoint, so losing the race for the first insert does not abort the caller's transaction
+        with db.session.begin_nested():
+            db.session.add(conv)
+    except IntegrityError:
+        # a concurrent first message created the row; apply this change on top of it
+        return db.session.get(Conversation, (user_id, other_id)), False
+    return conv, True
+
+
+def record_message(msg):
+    # call after session.add(msg); updates the sender's and the receiver's row
+    db.session.flush()
+    sides = dict.fromkeys([(msg.sender_id, msg.receiver_id), (msg.receiver_id, msg.sender_id)])
+    for user_id, other_id in sides:
+        conv, fresh = _load(user_id, other_id)
+        if fresh:
+            continue
+        conv.last_message_id = msg.id
+        conv.last_sender_id = msg.sender_id
+        conv.last_message_text = _preview(msg.message_text)
+        conv.last_message_at = msg.timestamp
+        if user_id == msg.receiver_id and user_id != msg.sender_id:
+            # SQL-side increment so concurrent senders do not lose updates
+            conv.unread_count = Conversation.unread_count + 1
+
+
+def mark_read(user_id, other_id, now=None):
+    # stamp read_at on everything other_id sent to user_id; returns the number of messages marked
+    now = now or datetime.utcnow()
+    count = ChatMessage.query.filter(
+        ChatMessage.receiver_id == user_id, ChatMessage.sender_id == other_id,
+        ChatMessage.read_at.is_(None)).update({ChatMessage.read_at: now}, synchronize_session=False)
+    conv = db.session.get(Conversation, (user_id, other_id))
+    if conv is not None:
+        conv.unread_count = 0
+    return count
+
+
+def unread_total(user_id):
+    return db.session.query(func.coalesce(func.sum(Conversation.unread_count), 0)).filter(
+        Conversation.user_id == user_id).scalar()
+
+
+def conversation_list(user_id):
+    # (Conversation, other User) pairs, most recent first; one scan of ix_conversations_user_recent
+    return db.session.query(Conversation, User).join(User, User.id == Conversation.other_id).filter(
+        Conversation.user_id == user_id).order_by(Conversation.last_message_at.desc()).all()
+
+
+def conversation_dict(conv, other):
+    return {
+        'other_id': other.id,
+        'username': other.username,
+        'last_message': conv.last_message_text,
+        'last_sender_id': conv.last_sender_id,
+        'last_message_at': conv.last_message_at.isoformat() if conv.last_message_at else None,
+        'unread': conv.unread_count,
+    }
+
+
+def rebuild_conversations(batch_size=500):
+    # recompute both sides of every pair that has exchanged messages, committing per batch
+    pairs = set()
+    for sender_id, receiver_id in db.session.query(ChatMessage.sender_id, ChatMessage.receiver_id).distinct():
+        pairs.add((sender_id, receiver_id))
+        pairs.add((receiver_id, sender_id))
+    pairs = sorted(pairs)
+
+    for i in range(0, len(pairs), batch_size):
+        for user_id, other_id in pairs[i:i + batch_size]:
+            conv = db.session.get(Conversation, (user_id, other_id))
+            if conv is None:
+                conv = Conversation(user_id=user_id, other_id=other_id)
+                db.session.add(conv)
+            _fill(conv)
+        db.session.commit()
+    return len(pairs)
+
+
+@click.command('rebuild-conversations')
+@with_appcontext
+def rebuild_conversations_command():
+    count = rebuild_conversations()
+    click.echo(f'Rebuilt {count} conversation rows')
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_conversations_command)
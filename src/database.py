@@ -0,0 +1,164 @@
+import random
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+
+# Engine tuning and read-replica routing. `configure(app)` runs before
+# `db.init_app(app)` and fills SQLALCHEMY_ENGINE_OPTIONS; `init_app(app)`
+# runs after it, creates the replica engines and installs the per-connection
+# SQLite pragmas. Replicas are plain engines in app.extensions['db_replicas']
+# rather than SQLALCHEMY_BINDS, so create_all() never targets them. Nothing
+# here imports src.extensions, which builds `db` with RoutingSession.
+
+STICKY_SESSION_KEY = '_db_primary_until'
+
+
+def _is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def _is_memory(uri):
+    return make_url(uri).database in (None, '', ':memory:')
+
+
+def engine_options(config, uri=None):
+    uri = uri or config.get('SQLALCHEMY_DATABASE_URI', '')
+    options = {}
+    if _is_sqlite(uri):
+        # pysqlite's own lock wait, in seconds; busy_timeout below covers the same for SQLite itself
+        options['connect_args'] = {'timeout': config.get('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000.0}
+    elif make_url(uri).get_backend_name() == 'postgresql':
+        options.update(
+            pool_size=config.get('DB_POOL_SIZE', 5),
+            max_overflow=config.get('DB_MAX_OVERFLOW', 10),
+            pool_timeout=config.get('DB_POOL_TIMEOUT', 30),
+            pool_recycle=config.get('DB_POOL_RECYCLE', 1800),
+            pool_pre_ping=config.get('DB_POOL_PRE_PING', True),
+        )
+    return options
+
+
+def sqlite_pragmas(config):
+    return [
+        ('journal_mode', config.get('SQLITE_JOURNAL_MODE', 'WAL')),
+        ('synchronous', config.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('busy_timeout', int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))),
+        ('mmap_size', int(config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))),
+        ('cache_size', int(config.get('SQLITE_CACHE_SIZE', -64000))),
+    ]
+
+
+def replica_uris(config):
+    uris = config.get('DB_REPLICA_URIS') or []
+    if isinstance(uris, str):
+        uris = [u.strip() for u in uris.split(',') if u.strip()]
+    return [u.replace('postgres://', 'postgresql://', 1) if u.startswith('postgres://') else u for u in uris]
+
+
+def configure(app):
+    # explicit SQLALCHEMY_ENGINE_OPTIONS entries win over the computed defaults
+    options = engine_options(app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def _install_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_conn, connection_record):
+        cur = dbapi_conn.cursor()
+        try:
+            for name, value in pragmas:
+                cur.execute(f'PRAGMA {name}={value}')
+        finally:
+            cur.close()
+
+
+def init_app(app):
+    replicas = [create_engine(uri, **engine_options(app.config, uri)) for uri in replica_uris(app.config)]
+    app.extensions['db_replicas'] = replicas
+    if not app.config.get('SQLITE_PRAGMAS_ENABLED', True):
+        return
+    pragmas = sqlite_pragmas(app.config)
+    with app.app_context():
+        engines = list(app.extensions['sqlalchemy'].engines.values())
+    for engine in engines + replicas:
+        if engine.dialect.name == 'sqlite' and not _is_memory(str(engine.url)):
+            _install_pragmas(engine, pragmas)
+
+
+def _replicas():
+    return current_app.extensions.get('db_replicas') or []
+
+
+def primary_pinned():
+    # read-your-writes: this browser session wrote recently, so replicas may lag behind it
+    return session.get(STICKY_SESSION_KEY, 0) > time.time()
+
+
+def read_replica(view):
+    """Let a read-only GET view run its queries on a replica.
+
+    Requests that are not GET/HEAD, or that come from a user who wrote within
+    DB_REPLICA_STICKY_SECONDS, keep using the primary.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD') and not primary_pinned():
+            g.db_read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends reads in @read_replica views to a replica.
+
+    Flushes, and every statement after the first write in the session, go to
+    the primary. One replica is picked per session so a request sees a
+    consistent snapshot.
+    """
+
+    def _use_replica(self):
+        return (has_request_context() and g.get('db_read_replica', False)
+                and not self._flushing and not self.info.get('db_wrote'))
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._use_replica():
+            replicas = _replicas()
+            if replicas:
+                index = self.info.setdefault('db_replica', random.randrange(len(replicas)))
+                g.db_replica_read = True
+                return replicas[index]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_flush_write(db_session, flush_context):
+    db_session.info['db_wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_statement_write(state):
+    # bulk insert/update/delete issued through session.execute() bypass flush
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info['db_wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _pin_primary_after_commit(db_session):
+    if not db_session.info.pop('db_wrote', False) or not has_request_context():
+        return
+    # later reads in this request must see the write too
+    g.pop('db_read_replica', None)
+    if _replicas():
+        window = current_app.config.get('DB_REPLICA_STICKY_SECONDS', 5)
+        session[STICKY_SESSION_KEY] = time.time() + window
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_write_mark(db_session):
+    db_session.info.pop('db_wrote', None)
@@ -1,19 +1,24 @@
 import os
+import importlib.util
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_socketio import SocketIO
 from flask_wtf import CSRFProtect
 
+from src.cache import ResponseCache
+from src.database import RoutingSession
+
 # Central extension objects used across the app
-db = SQLAlchemy()
+# RoutingSession sends reads in @read_replica views to DB_REPLICA_URIS (see src/database.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 
 # Use gevent in production (Render), threading locally/tests
-# Try to import gevent to see if it's available
-try:
-    import gevent
+# Check whether gevent is installed without paying for its import here;
+# Flask-SocketIO imports it when the server is created
+if importlib.util.find_spec('gevent') is not None:
     _async_mode = 'gevent'
-except ImportError:
+else:
     _async_mode = 'threading'
 
 # Override: If running pytest, always use threading
@@ -22,6 +27,8 @@ if os.environ.get('PYTEST_CURRENT_TEST') or os.environ.get('FLASK_TESTING'):
 
 socketio = SocketIO(async_mode=_async_mode, cors_allowed_origins='*')
 csrf = CSRFProtect()
+# versioned response cache for read-heavy views (see src/cache.py)
+cache = ResponseCache()
 
 # Recommended: redirect anonymous users to the login view
 login_manager.login_view = 'auth.login'
\ No newline at end of file
@@ -0,0 +1,120 @@
+import heapq
+import json
+from datetime import date, datetime
+from itertools import islice
+from operator import itemgetter
+
+from flask import current_app, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+from src.extensions import db
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder is used without it
+    orjson = None
+
+
+# JSON encoding. JSONProvider is Flask's default provider with orjson doing
+# the encoding when it is installed; both produce equivalent JSON (dates in
+# jsonify() payloads stay HTTP dates). For large list APIs, query_rows()
+# selects plain columns through a server-side cursor and json_array() encodes
+# those dicts in batches, with datetimes as ISO 8601, either into one body or
+# (stream=True) as a chunked response that never holds the whole array.
+
+
+def _orjson_option(sort_keys, indent=False):
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    return option
+
+
+class JSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        # orjson only covers the compact and 2-space forms Flask itself asks for
+        indent = kwargs.pop('indent', None)
+        compact = kwargs.pop('separators', (',', ':')) == (',', ':')
+        if orjson is None or kwargs or not compact or indent not in (None, 2):
+            if indent is not None:
+                kwargs['indent'] = indent
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=_orjson_option(self.sort_keys, indent)).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        cfg = self._app.config
+        # the deprecated JSONIFY_* keys are only honoured by the stdlib path
+        if orjson is None or cfg.get('JSONIFY_PRETTYPRINT_REGULAR') is not None or cfg.get('JSONIFY_MIMETYPE') is not None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default,
+                            option=_orjson_option(self.sort_keys, indent) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def _iso_default(o):
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+def encode_rows(rows):
+    # list of plain dicts -> JSON array bytes; naive datetimes come out as isoformat() would
+    if orjson is not None:
+        return orjson.dumps(rows)
+    return json.dumps(rows, default=_iso_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def query_rows(stmt, batch_size=1000):
+    """Rows of a Core select as dicts, fetched through a server-side cursor.
+
+    Column labels become the keys, so no ORM objects are built.
+    """
+    result = db.session.execute(stmt, execution_options={'stream_results': True})
+    keys = list(result.keys())
+    for chunk in result.partitions(batch_size):
+        for row in chunk:
+            yield dict(zip(keys, row))
+
+
+def merge_rows(*sorted_rows, key='timestamp'):
+    # interleaves several already sorted row iterables (e.g. archived + hot rows)
+    return heapq.merge(*sorted_rows, key=itemgetter(key))
+
+
+def _array_chunks(rows, batch_size):
+    yield b'['
+    first = True
+    it = iter(rows)
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            break
+        # each batch is encoded as an array and spliced in without its brackets
+        yield (b'' if first else b',') + encode_rows(batch)[1:-1]
+        first = False
+    yield b']\n'
+
+
+def json_array(rows, stream=False, batch_size=None):
+    # JSON array response from an iterable of dicts
+    batch_size = batch_size or current_app.config.get('JSON_STREAM_BATCH_SIZE', 500)
+    mimetype = current_app.json.mimetype
+    if stream:
+        # the request context (and with it the DB session) stays open until the last chunk
+        return current_app.response_class(stream_with_context(_array_chunks(rows, batch_size)), mimetype=mimetype)
+    return current_app.response_class(b''.join(_array_chunks(rows, batch_size)), mimetype=mimetype)
+
+
+def init_app(app):
+    app.json = JSONProvider(app)
+    # the Jinja |tojson filter captured the provider the app started with
+    app.jinja_env.policies['json.dumps_function'] = app.json.dumps
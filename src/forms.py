@@ -1,6 +1,7 @@
+from flask import current_app
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SelectField, TextAreaField, DecimalField
-from wtforms.validators import DataRequired, Length, EqualTo, Optional
+from wtforms import StringField, PasswordField, SelectField, TextAreaField, DecimalField, IntegerField
+from wtforms.validators import DataRequired, Length, EqualTo, Optional, NumberRange, ValidationError
 
 
 class LoginForm(FlaskForm):
@@ -30,3 +31,10 @@ class MedicineForm(FlaskForm):
 class AppointmentForm(FlaskForm):
     doctor_id = StringField('doctor_id', validators=[DataRequired()])
     start_time = StringField('start_time', validators=[DataRequired()])
+    duration = IntegerField('duration', validators=[Optional(), NumberRange(min=5)])
+
+    def validate_duration(self, field):
+        # upper bound follows APPOINTMENT_MAX_MINUTES, which find_conflicts relies on
+        max_minutes = current_app.config.get('APPOINTMENT_MAX_MINUTES', 240)
+        if field.data is not None and field.data > max_minutes:
+            raise ValidationError(f'Number must be at most {max_minutes}.')
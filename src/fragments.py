@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict
+
+from flask import current_app, g, has_request_context
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from src.cache import patient_key, chat_key, conversations_key, summary_key, users_key
+
+
+# Template fragment cache. A block written as
+#
+#     {% cache 'patient-vitals', patient_key(patient.id) %} ... {% endcache %}
+#
+# is rendered once per name and version of the listed entities (the same
+# counters the response cache bumps on writes) and served from a bounded
+# in-process LRU afterwards, across users and sessions, so the fragment must
+# depend on nothing but those entities. The session's CSRF token is swapped
+# for a placeholder when a fragment is stored and back on every hit, so
+# forms inside a fragment stay valid. Views pass the data a fragment loops
+# over through deferred() so the queries only run on a miss.
+
+# cannot occur in rendered HTML; stands in for the CSRF token in stored fragments
+_CSRF_MARK = '\x1ecsrf\x1e'
+
+
+class FragmentStore:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return html
+
+    def set(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': round(self.hits / lookups, 4) if lookups else None}
+
+
+class deferred:
+    # list-like wrapper that runs `load` on first use; lets a cached fragment skip its query
+    def __init__(self, load):
+        self._load = load
+        self._rows = None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = list(self._load())
+        return self._rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __bool__(self):
+        return bool(self.rows)
+
+
+def _csrf_token():
+    from flask_wtf.csrf import generate_csrf
+    return generate_csrf() if has_request_context() else None
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(args)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, args, caller):
+        name, entities = args[0], sorted(set(args[1:]))
+        store = current_app.extensions.get('fragment_cache')
+        backend = current_app.extensions.get('response_cache')
+        # without version counters nothing would ever invalidate a stored fragment
+        if store is None or backend is None:
+            return caller()
+
+        versions = backend.get_versions(entities)
+        key = '|'.join([name] + [f'{n}@{v}' for n, v in zip(entities, versions)])
+        html = store.get(key)
+        if html is not None:
+            if _CSRF_MARK in html:
+                html = html.replace(_CSRF_MARK, _csrf_token() or '')
+            return Markup(html)
+
+        html = str(caller())
+        # a replica may lag the versions in the key, so what it returned is not stored
+        if not (has_request_context() and g.get('db_replica_read')):
+            token = _csrf_token()
+            store.set(key, html.replace(token, _CSRF_MARK) if token else html)
+        return Markup(html)
+
+
+def fragment_cache():
+    # the app's FragmentStore, or None when FRAGMENT_CACHE_MAX_ENTRIES is 0
+    return current_app.extensions.get('fragment_cache')
+
+
+def init_app(app):
+    max_entries = app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', 1024)
+    app.extensions['fragment_cache'] = FragmentStore(max_entries) if max_entries else None
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.globals.update(patient_key=patient_key, chat_key=chat_key, conversations_key=conversations_key,
+                                 summary_key=summary_key, users_key=users_key)
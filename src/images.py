@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from src import summary
+from src.extensions import db
+from src.models.user import MedicalFile
+
+
+# Post-upload image normalization. upload_file stores the bytes as received
+# and hands JPEG/PNG files to optimize_upload(), which runs optimize_image()
+# on a small thread pool (Pillow releases the GIL while decoding and
+# encoding): auto-orient from EXIF, drop EXIF/XMP metadata, downscale to
+# IMAGE_MAX_DIMENSION and recompress. The result replaces the stored file
+# atomically when it is smaller, was resized or carried metadata. Under
+# TESTING (or IMAGE_OPTIMIZE_ASYNC=False) the work runs inline. With
+# IMAGE_ORIGINALS_FOLDER set the untouched upload is kept there whenever it
+# gets replaced.
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+
+def optimize_image(path, max_dimension=2048, quality=82, before_replace=None):
+    """Normalize the image at `path` in place; returns (old_size, new_size).
+
+    `before_replace(path)` runs only when the result is about to replace the
+    file. Returns None, leaving nothing behind, if the file was deleted while
+    it was being processed.
+    """
+    from PIL import Image, ImageOps
+
+    old_size = os.path.getsize(path)
+    with Image.open(path) as img:
+        fmt = img.format
+        resized = max(img.size) > max_dimension
+        has_metadata = any(k in img.info for k in ('exif', 'xmp', 'XML:com.adobe.xmp', 'comment'))
+        icc_profile = img.info.get('icc_profile')
+        img = ImageOps.exif_transpose(img)
+        if resized:
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        if fmt == 'JPEG':
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            save_args = {'format': 'JPEG', 'quality': quality, 'optimize': True, 'progressive': True}
+        else:
+            save_args = {'format': 'PNG', 'optimize': True}
+        # the colour profile is kept (it is rendering data, not metadata); EXIF, XMP and comments are not
+        if icc_profile:
+            save_args['icc_profile'] = icc_profile
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            img.save(fh, **save_args)
+
+    new_size = os.path.getsize(tmp)
+    if not os.path.exists(path):
+        # deleted meanwhile; replacing would recreate it as an orphan
+        os.remove(tmp)
+        return None
+    if new_size < old_size or resized or has_metadata:
+        if before_replace is not None:
+            before_replace(path)
+        os.replace(tmp, path)
+        return old_size, new_size
+    os.remove(tmp)
+    return old_size, old_size
+
+
+def _keep_original(path, originals_folder, relpath):
+    dest = os.path.join(originals_folder, relpath)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    shutil.copy2(path, dest)
+
+
+def process_file(app, file_id):
+    # runs on a pool thread (or inline); never raises
+    with app.app_context():
+        try:
+            mf = db.session.get(MedicalFile, file_id)
+            if mf is None:
+                return
+            relpath = os.path.join(f'user_{mf.patient_id}', mf.storage_filename)
+            path = os.path.join(app.config['UPLOAD_FOLDER'], relpath)
+            originals = app.config.get('IMAGE_ORIGINALS_FOLDER')
+            # the untouched upload is only worth keeping if the optimized file replaces it
+            keep = (lambda p: _keep_original(p, originals, relpath)) if originals else None
+            sizes = optimize_image(path, app.config.get('IMAGE_MAX_DIMENSION', 2048),
+                                   app.config.get('IMAGE_JPEG_QUALITY', 82), before_replace=keep)
+            if sizes is None:
+                return
+            old_size, new_size = sizes
+            mf.original_size_bytes = mf.original_size_bytes or old_size
+            delta = new_size - (mf.size_bytes or old_size)
+            mf.size_bytes = new_size
+            # keep the owner's storage total in step with the recompressed file
+            summary.adjust_counts(mf.patient_id, storage_bytes=delta)
+            mf.optimized_at = datetime.utcnow()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Image optimization failed for file %s', file_id)
+        finally:
+            db.session.remove()
+
+
+def optimize_upload(mf):
+    # call after the MedicalFile row is committed
+    app = current_app._get_current_object()
+    if not app.config.get('IMAGE_OPTIMIZE', True):
+        return
+    if os.path.splitext(mf.storage_filename)[1].lower() not in IMAGE_EXTENSIONS:
+        return
+    if not app.config.get('IMAGE_OPTIMIZE_ASYNC', True) or app.testing:
+        process_file(app, mf.id)
+        return
+    pool = app.extensions.get('image_pool')
+    if pool is None:
+        # created on first use, so a forked worker gets its own threads
+        pool = app.extensions['image_pool'] = ThreadPoolExecutor(
+            max_workers=app.config.get('IMAGE_WORKERS', 2), thread_name_prefix='image-opt')
+    pool.submit(process_file, app, mf.id)
+
+
+@click.command('optimize-images')
+@with_appcontext
+def optimize_images_command():
+    # backfill uploads stored before optimization was enabled
+    app = current_app._get_current_object()
+    ids = [fid for fid, name in db.session.query(MedicalFile.id, MedicalFile.storage_filename).filter(
+        MedicalFile.optimized_at.is_(None)) if os.path.splitext(name or '')[1].lower() in IMAGE_EXTENSIONS]
+    db.session.remove()
+    for fid in ids:
+        process_file(app, fid)
+    click.echo(f'Optimized {len(ids)} images')
+
+
+def init_app(app):
+    app.cli.add_command(optimize_images_command)
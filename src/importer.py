@@ -0,0 +1,235 @@
+import csv
+import json
+from datetime import datetime, timezone
+
+import click
+from flask import Request, current_app
+from flask.cli import with_appcontext
+
+from src.extensions import db, cache
+from src.cache import patient_key
+from src.models.user import Vitals, User
+from src.summary import record_vitals
+
+
+# Streaming vitals import for device/wearable exports (NDJSON or CSV with
+# columns type,value1,value2,timestamp). Input is read line by line and
+# written in chunks, each chunk in its own transaction, so memory use and
+# lock time stay bounded regardless of file size. Readings already stored
+# for the same (patient_id, type, timestamp) are skipped. The HTTP endpoint
+# takes bodies up to IMPORT_MAX_CONTENT_LENGTH rather than MAX_CONTENT_LENGTH,
+# so a year of device data fits; `flask import-vitals` has no limit at all.
+
+IMPORT_ENDPOINT = 'main.import_vitals_file'
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+
+def _float_or_none(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_numeric(values):
+    # a column of raw values as floats, None marking a missing or unparseable entry.
+    # NumPy converts the whole column in one call; only a column holding a bad
+    # entry falls back to converting value by value.
+    import numpy as np
+
+    values = list(values)
+    present = [i for i, v in enumerate(values) if v not in (None, '')]
+    try:
+        parsed = np.fromiter((values[i] for i in present), dtype=object, count=len(present)).astype(float).tolist()
+    except (TypeError, ValueError):
+        parsed = [_float_or_none(values[i]) for i in present]
+    out = [None] * len(values)
+    for i, value in zip(present, parsed):
+        out[i] = value
+    return out
+
+
+def parse_timestamp(value):
+    # ISO 8601 as naive UTC; an offset is applied before it is dropped. Raises ValueError.
+    ts = datetime.fromisoformat(str(value or '').replace('Z', '+00:00'))
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+class ImportRequest(Request):
+    # Flask 2.2's max_content_length is a read-only view of MAX_CONTENT_LENGTH;
+    # the import endpoint gets its own, larger limit
+    @property
+    def max_content_length(self):
+        if self.endpoint == IMPORT_ENDPOINT:
+            return current_app.config.get('IMPORT_MAX_CONTENT_LENGTH') or None
+        return super().max_content_length
+
+
+def iter_records(lines, fmt):
+    # yields (line_no, record-or-None, error-or-None) from an iterable of byte or text lines
+    def decoded():
+        for raw in lines:
+            yield raw.decode('utf-8-sig') if isinstance(raw, bytes) else raw
+
+    if fmt == 'csv':
+        reader = csv.DictReader(decoded())
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_no, line in enumerate(decoded(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_no, None, 'Invalid JSON'
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, 'Record must be an object'
+            continue
+        yield line_no, record, None
+
+
+class ImportSummary:
+    def __init__(self):
+        self.processed = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line_no, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_no, 'error': message})
+
+    def as_dict(self):
+        return {
+            'processed': self.processed,
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'errors': self.error_count,
+            'error_details': sorted(self.errors, key=lambda e: e['line']),
+        }
+
+
+def insert_ignoring_duplicates(table):
+    # INSERT that skips rows violating a unique constraint; a plain INSERT on
+    # databases other than SQLite and PostgreSQL
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return table.insert()
+    return insert(table).on_conflict_do_nothing()
+
+
+def _flush(patient_id, chunk, summary):
+    # validate the chunk column-wise, drop duplicates, insert the rest in one transaction
+    value1s = parse_numeric([r.get('value1') for _, r in chunk])
+    value2s = parse_numeric([r.get('value2') for _, r in chunk])
+    rows = []
+    for (line_no, rec), v1, v2 in zip(chunk, value1s, value2s):
+        v_type = rec.get('type')
+        if v_type is not None and not isinstance(v_type, str):
+            summary.error(line_no, 'type must be a string')
+            continue
+        v_type = (v_type or '').strip()
+        if not v_type or v1 is None:
+            summary.error(line_no, 'Missing type or non-numeric value1')
+            continue
+        if rec.get('value2') not in (None, '') and v2 is None:
+            summary.error(line_no, 'Non-numeric value2')
+            continue
+        try:
+            ts = parse_timestamp(rec.get('timestamp'))
+        except ValueError:
+            summary.error(line_no, 'Missing or invalid timestamp')
+            continue
+        rows.append({
+            'patient_id': patient_id,
+            'type': v_type,
+            'value1': str(rec['value1']).strip(),
+            'value2': str(rec.get('value2') or '').strip(),
+            'timestamp': ts,
+        })
+    if not rows:
+        return
+
+    # one range query on uq_vitals_patient_type_ts covers the whole chunk
+    existing = set(db.session.query(Vitals.type, Vitals.timestamp).filter(
+        Vitals.patient_id == patient_id,
+        Vitals.type.in_({r['type'] for r in rows}),
+        Vitals.timestamp.between(min(r['timestamp'] for r in rows), max(r['timestamp'] for r in rows)),
+    ).all())
+    fresh = []
+    for r in rows:
+        key = (r['type'], r['timestamp'])
+        if key in existing:
+            summary.duplicates += 1
+            continue
+        existing.add(key)
+        fresh.append(r)
+    inserted = len(fresh)
+    if fresh:
+        # a concurrent import of the same readings may commit after the check above
+        result = db.session.execute(insert_ignoring_duplicates(Vitals.__table__), fresh)
+        if result.rowcount >= 0 and db.session.get_bind().dialect.supports_sane_multi_rowcount:
+            summary.duplicates += inserted - result.rowcount
+            inserted = result.rowcount
+        record_vitals(patient_id, [(r['type'], r['value1'], r['value2'], r['timestamp']) for r in fresh])
+    db.session.commit()
+    summary.inserted += inserted
+
+
+def import_vitals(patient_id, lines, fmt='ndjson', chunk_size=DEFAULT_CHUNK_SIZE):
+    summary = ImportSummary()
+    chunk = []
+    for line_no, record, error in iter_records(lines, fmt):
+        summary.processed += 1
+        if error:
+            summary.error(line_no, error)
+            continue
+        chunk.append((line_no, record))
+        if len(chunk) >= chunk_size:
+            _flush(patient_id, chunk, summary)
+            chunk = []
+    if chunk:
+        _flush(patient_id, chunk, summary)
+    if summary.inserted:
+        cache.bump(patient_key(patient_id))
+    return summary
+
+
+def detect_format(name, declared=None):
+    declared = (declared or '').strip().lower()
+    if declared in ('csv', 'ndjson'):
+        return declared
+    return 'csv' if (name or '').lower().endswith('.csv') else 'ndjson'
+
+
+@click.command('import-vitals')
+@click.argument('patient_id', type=int)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default=None, help='Defaults to the file extension.')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True)
+@with_appcontext
+def import_vitals_command(patient_id, path, fmt, chunk_size):
+    if User.query.get(patient_id) is None:
+        raise click.ClickException(f'No user with id {patient_id}')
+    with open(path, 'rb') as fh:
+        summary = import_vitals(patient_id, fh, detect_format(path, fmt), chunk_size)
+    click.echo(json.dumps(summary.as_dict(), indent=2))
+
+
+def init_app(app):
+    app.request_class = ImportRequest
+    app.cli.add_command(import_vitals_command)
@@ -0,0 +1,148 @@
+import heapq
+import os
+import threading
+from bisect import bisect_left, insort
+
+from flask import current_app
+from sqlalchemy import func
+
+from src.extensions import db, cache
+from src.cache import medications_key
+from src.models.user import Medicine
+
+
+# Medication-name autocomplete. MedicationIndex keeps the lowercased names in
+# one sorted list, so a prefix lookup is two bisects plus a top-k over the
+# matching slice, ranked by how often the name is prescribed; answers for
+# short prefixes that match many names are memoized until the next change
+# (a generation counter keeps a lookup that raced a change from storing its
+# stale answer). The index for an app is built on its first lookup from the
+# bundled name list and the names already in `medicines`. add/delete paths
+# call note_name()/forget_name(), which update this worker's index and bump
+# medications_key() in the response cache; a worker that sees a newer
+# version there rebuilds its index from the table on the next lookup.
+
+BUNDLED_NAMES = os.path.join(os.path.dirname(__file__), 'data', 'medications.txt')
+# prefixes matching more names than this have their ranked answer memoized
+MEMO_MIN_MATCHES = 256
+
+
+def normalize(name):
+    return ' '.join((name or '').split()).lower()
+
+
+class MedicationIndex:
+    def __init__(self):
+        self._keys = []       # sorted normalized names
+        self._display = {}    # normalized -> name as first seen (bundled spelling wins)
+        self._counts = {}     # normalized -> number of prescriptions
+        self._memo = {}       # (prefix, limit) -> ranked keys, for wide prefixes
+        self._generation = 0  # bumped by every change; memo entries from older generations are dropped
+        self._lock = threading.Lock()
+        self.version = None   # medications_key() version the index was built at
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, name, count=1):
+        key = normalize(name)
+        if not key:
+            return
+        with self._lock:
+            if key not in self._display:
+                self._display[key] = ' '.join(name.split())
+                self._counts[key] = 0
+                insort(self._keys, key)
+            self._counts[key] += count
+            self._changed()
+
+    def remove(self, name, count=1):
+        # a prescription was deleted; the name stays suggestible
+        key = normalize(name)
+        with self._lock:
+            if key in self._counts:
+                self._counts[key] = max(self._counts[key] - count, 0)
+                self._changed()
+
+    def _changed(self):
+        # call with the lock held
+        self._generation += 1
+        if self._memo:
+            self._memo = {}
+
+    def suggest(self, prefix, limit=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        best = self._memo.get((prefix, limit))
+        if best is None:
+            generation = self._generation
+            keys = self._keys
+            lo = bisect_left(keys, prefix)
+            hi = bisect_left(keys, prefix + '\uffff', lo)
+            counts = self._counts
+            # most prescribed first, then alphabetical
+            best = heapq.nsmallest(limit, keys[lo:hi], key=lambda k: (-counts[k], k))
+            if hi - lo > MEMO_MIN_MATCHES:
+                with self._lock:
+                    # an add/remove since we read the counts would make this answer stale
+                    if self._generation == generation:
+                        self._memo[(prefix, limit)] = best
+        counts = self._counts
+        return [{'name': self._display[k], 'count': counts[k]} for k in best]
+
+
+def load_bundled(index, path=BUNDLED_NAMES):
+    with open(path, encoding='utf-8') as fh:
+        for line in fh:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                index.add(line, count=0)
+
+
+def build_index():
+    index = MedicationIndex()
+    load_bundled(index)
+    rows = db.session.query(Medicine.name, func.count(Medicine.id)).group_by(Medicine.name).all()
+    for name, count in rows:
+        index.add(name, count)
+    return index
+
+
+def _shared_version():
+    backend = cache.backend
+    return backend.get_versions([medications_key()])[0] if backend is not None else None
+
+
+def get_index():
+    # rebuilt from the table when another worker changed the names since it was built
+    version = _shared_version()
+    index = current_app.extensions.get('medication_index')
+    if index is None or index.version != version:
+        index = build_index()
+        index.version = version
+        current_app.extensions['medication_index'] = index
+    return index
+
+
+def _bump(index):
+    cache.bump(medications_key())
+    # nobody else changed the names since the build, so this worker's index is still current
+    if index is not None and index.version is not None and _shared_version() == index.version + 1:
+        index.version += 1
+
+
+def note_name(name):
+    # call after a medicine is committed; an index not built yet picks it up from the table
+    index = current_app.extensions.get('medication_index')
+    if index is not None:
+        index.add(name)
+    _bump(index)
+
+
+def forget_name(name):
+    # call after a medicine is deleted, so its prescription count goes down again
+    index = current_app.extensions.get('medication_index')
+    if index is not None:
+        index.remove(name)
+    _bump(index)
@@ -12,6 +12,8 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(200), unique=False)
     password_hash = db.Column(db.String(256), nullable=False)
     role = db.Column(db.String(50), default='patient')
+    # signed into calendar feed URLs; bumping it revokes every URL handed out before
+    feed_nonce = db.Column(db.Integer, nullable=False, default=0)
 
     # relationships
     profile = db.relationship('PatientProfile', back_populates='user', uselist=False)
@@ -67,7 +69,17 @@ class Vitals(db.Model):
     value1 = db.Column(db.String(100))
     value2 = db.Column(db.String(100))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # client-generated idempotency key, so replayed offline submissions are stored once
+    client_key = db.Column(db.String(64))
     patient = db.relationship('User', back_populates='vitals')
+    # True on read-only copies rebuilt from an archive segment (src/archive.py)
+    archived = False
+
+    __table_args__ = (
+        db.UniqueConstraint('patient_id', 'client_key', name='uq_vitals_patient_client_key'),
+        # one reading per patient, type and instant; also serves the per-type range scans
+        db.UniqueConstraint('patient_id', 'type', 'timestamp', name='uq_vitals_patient_type_ts'),
+    )
 
 
 class MedicalFile(db.Model):
@@ -77,16 +89,55 @@ class MedicalFile(db.Model):
     original_filename = db.Column(db.String(300))
     storage_filename = db.Column(db.String(300), unique=True)
     upload_timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # bytes on disk, and as uploaded; they differ once src/images.py recompressed the file
+    size_bytes = db.Column(db.Integer)
+    original_size_bytes = db.Column(db.Integer)
+    optimized_at = db.Column(db.DateTime)
     patient = db.relationship('User', back_populates='files')
 
 
+class PatientSummary(db.Model):
+    # denormalized per-patient counters for list pages; maintained by the
+    # write paths through src/summary.py, repairable with `flask rebuild-summaries`
+    __tablename__ = 'patient_summary'
+    patient_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    latest_bp_value1 = db.Column(db.String(100))
+    latest_bp_value2 = db.Column(db.String(100))
+    latest_bp_at = db.Column(db.DateTime)
+    last_vital_at = db.Column(db.DateTime)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    medicine_count = db.Column(db.Integer, nullable=False, default=0)
+    # sum of medical_files.size_bytes; checked against STORAGE_QUOTA_BYTES on upload
+    storage_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # `flask storage report`
+        db.Index('ix_patient_summary_storage', 'storage_bytes'),
+    )
+
+
 class Appointment(db.Model):
     __tablename__ = 'appointments'
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
+    # end_time is stored alongside the duration so overlap checks can be answered
+    # with a plain range query on (doctor_id, start_time)
+    duration_minutes = db.Column(db.Integer, nullable=False, default=30)
+    end_time = db.Column(db.DateTime)
     status = db.Column(db.String(50), default='pending')
+    # bumped on every change; lets calendar feeds compute an ETag without reading rows
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # when the latest reminder went out (see src/reminders.py)
+    last_reminder_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_appointments_doctor_start', 'doctor_id', 'start_time'),
+        # the reminder scheduler's window query
+        db.Index('ix_appointments_status_start', 'status', 'start_time'),
+    )
 
 
 class ChatMessage(db.Model):
@@ -96,3 +147,74 @@ class ChatMessage(db.Model):
     receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     message_text = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # set when the receiver opens the thread (read receipts)
+    read_at = db.Column(db.DateTime)
+    __table_args__ = (
+        db.Index('ix_chat_messages_receiver_sender_read', 'receiver_id', 'sender_id', 'read_at'),
+    )
+
+
+class Conversation(db.Model):
+    # one row per (user, other participant) holding the thread's latest message
+    # and the user's unread count; maintained by src/conversations.py, repairable
+    # with `flask rebuild-conversations`
+    __tablename__ = 'conversations'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    other_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('chat_messages.id'))
+    last_sender_id = db.Column(db.Integer)
+    last_message_text = db.Column(db.String(200))
+    last_message_at = db.Column(db.DateTime)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (
+        db.Index('ix_conversations_user_recent', 'user_id', 'last_message_at'),
+    )
+
+
+class ArchiveSegment(db.Model):
+    # append-only gzip'd JSONL batch of rows moved out of a hot table by
+    # `flask archive` (see src/archive.py). vitals segments belong to one
+    # patient (subject_id); chat segments to one user pair (subject_id < peer_id).
+    __tablename__ = 'archive_segments'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    subject_id = db.Column(db.Integer, nullable=False)
+    peer_id = db.Column(db.Integer)
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    row_count = db.Column(db.Integer, nullable=False)
+    first_at = db.Column(db.DateTime, nullable=False)
+    last_at = db.Column(db.DateTime, nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_archive_segments_lookup', 'kind', 'subject_id', 'peer_id', 'month'),
+    )
+
+
+class AuditEvent(db.Model):
+    # append-only record of a doctor touching a patient's data; rows are
+    # written in batches by src/audit.py and never updated or deleted
+    __tablename__ = 'audit_events'
+    id = db.Column(db.Integer, primary_key=True)
+    actor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    action = db.Column(db.String(40), nullable=False)
+    target = db.Column(db.String(100))
+    occurred_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_audit_events_patient_time', 'patient_id', 'occurred_at'),
+    )
+
+
+class CareTeamMember(db.Model):
+    # which doctors look after which patients; the primary key serves a
+    # doctor's patient list, the second index a patient's doctors
+    __tablename__ = 'care_team'
+    doctor_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    # 'appointment' (added when the doctor confirmed one) or 'manual'
+    source = db.Column(db.String(20), nullable=False, default='manual')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_care_team_patient_doctor', 'patient_id', 'doctor_id'),
+    )
@@ -0,0 +1,180 @@
+import heapq
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import or_
+
+from src.extensions import db, socketio
+from src.models.user import Appointment
+
+
+# Appointment reminders. The scheduler keeps a heap of the reminders due in
+# the next REMINDER_WINDOW_MINUTES, loaded with one range query on
+# (status, start_time) and refilled when half the window has passed;
+# confirm_appointment / cancel_appointment update it in between. A reminder
+# is sent REMINDER_OFFSETS_MINUTES before the start to the patient's and the
+# doctor's Socket.IO rooms. Appointment.last_reminder_at records what was
+# sent and is claimed with a conditional UPDATE, so after a restart overdue
+# reminders are caught up (only the latest one per appointment) and never
+# sent twice. Under TESTING (or REMINDERS_ASYNC=False) nothing runs in the
+# background; call run_due() or `flask send-reminders` (e.g. from cron).
+
+
+class ReminderScheduler:
+    def __init__(self, app, offsets, window, background=True):
+        self.app = app
+        self.offsets = sorted(offsets, reverse=True)  # earliest reminder first
+        self.window = window
+        self.background = background
+        self._heap = []       # (due, appointment_id, minutes before start)
+        self._queued = {}     # appointment_id -> start_time; heap entries of others are stale
+        self._loaded_until = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _pending(self, start, last_sent, now, until):
+        # reminders of one appointment due by `until` and not sent yet; of the overdue ones only the latest
+        pending = [(start - timedelta(minutes=m), m) for m in self.offsets]
+        pending = [(due, m) for due, m in pending if due <= until and (last_sent is None or last_sent < due)]
+        overdue = [p for p in pending if p[0] <= now]
+        return overdue[-1:] + [p for p in pending if p[0] > now]
+
+    def load(self, now=None):
+        now = now or datetime.utcnow()
+        until = now + self.window
+        rows = db.session.query(Appointment.id, Appointment.start_time, Appointment.last_reminder_at).filter(
+            Appointment.status == 'confirmed',
+            Appointment.start_time > now,
+            Appointment.start_time <= until + timedelta(minutes=self.offsets[0]),
+        ).all()
+        heap, queued = [], {}
+        for appt_id, start, last_sent in rows:
+            queued[appt_id] = start
+            heap.extend((due, appt_id, m) for due, m in self._pending(start, last_sent, now, until))
+        heapq.heapify(heap)
+        with self._lock:
+            self._heap, self._queued, self._loaded_until = heap, queued, until
+        return len(heap)
+
+    def schedule(self, appt):
+        # call after an appointment was confirmed (or moved) and committed
+        if self._loaded_until is None:
+            return  # the first load() picks it up
+        now = datetime.utcnow()
+        with self._lock:
+            self._queued[appt.id] = appt.start_time
+            for due, m in self._pending(appt.start_time, appt.last_reminder_at, now, self._loaded_until):
+                heapq.heappush(self._heap, (due, appt.id, m))
+        self._wake.set()
+
+    def cancel(self, appointment_id):
+        # its heap entries are skipped when they come up
+        with self._lock:
+            self._queued.pop(appointment_id, None)
+
+    def appointment_changed(self, appt):
+        if appt.status == 'confirmed' and appt.start_time > datetime.utcnow():
+            self.schedule(appt)
+        else:
+            self.cancel(appt.id)
+
+    def next_due(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def run_due(self, now=None):
+        """Send every reminder due by `now`; returns the number sent."""
+        now = now or datetime.utcnow()
+        if self._loaded_until is None or now >= self._loaded_until - self.window / 2:
+            self.load(now)
+        sent = 0
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                due, appt_id, minutes = heapq.heappop(self._heap)
+                if appt_id not in self._queued:
+                    continue
+            sent += self._send(appt_id, due, minutes, now)
+        return sent
+
+    def _send(self, appt_id, due, minutes, now):
+        # claim first, so another worker or an earlier pass cannot send the same reminder
+        claimed = Appointment.query.filter(
+            Appointment.id == appt_id,
+            Appointment.status == 'confirmed',
+            or_(Appointment.last_reminder_at.is_(None), Appointment.last_reminder_at < due),
+        ).update({Appointment.last_reminder_at: now, Appointment.updated_at: Appointment.updated_at},
+                 synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return 0
+        appt = db.session.get(Appointment, appt_id)
+        payload = {'appointment_id': appt.id, 'start_time': appt.start_time.isoformat(),
+                   'duration_minutes': appt.duration_minutes, 'doctor_id': appt.doctor_id,
+                   'patient_id': appt.patient_id, 'minutes_before': minutes}
+        for user_id in (appt.patient_id, appt.doctor_id):
+            socketio.emit('appointment_reminder', payload, room=str(user_id))
+        return 1
+
+    def start(self):
+        # no-op while the thread runs; a forked worker has none and starts its own
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='appointment-reminders', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    self.run_due()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Sending appointment reminders failed')
+                finally:
+                    db.session.remove()
+            # sleep until the next reminder, but wake for the window refill and for schedule()
+            timeout = (self.window / 2).total_seconds()
+            nxt = self.next_due()
+            if nxt is not None:
+                timeout = min(timeout, max((nxt - datetime.utcnow()).total_seconds(), 0))
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+
+def scheduler():
+    return current_app.extensions.get('reminders')
+
+
+def appointment_changed(appt):
+    # call after confirm/cancel is committed
+    sched = scheduler()
+    if sched is not None:
+        sched.appointment_changed(appt)
+
+
+@click.command('send-reminders')
+@with_appcontext
+def send_reminders_command():
+    # one catch-up pass, e.g. from cron when the web workers do not run the scheduler
+    click.echo(f'Sent {scheduler().run_due()} appointment reminders')
+
+
+def init_app(app):
+    sched = ReminderScheduler(app, offsets=app.config.get('REMINDER_OFFSETS_MINUTES', (1440, 60)),
+                              window=timedelta(minutes=app.config.get('REMINDER_WINDOW_MINUTES', 360)),
+                              background=app.config.get('REMINDERS_ASYNC', True) and not app.testing)
+    app.extensions['reminders'] = sched
+    app.cli.add_command(send_reminders_command)
+    if sched.background:
+        # started with the worker, so reminders go out even before its first request;
+        # before_request restarts it in a process forked after create_app(). `flask`
+        # commands build the app too but leave sending to the web workers.
+        if click.get_current_context(silent=True) is None:
+            sched.start()
+        app.before_request(sched.start)
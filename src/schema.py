@@ -0,0 +1,187 @@
+import hashlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import (Column, DateTime, Integer, MetaData, String, Table, UniqueConstraint, bindparam, func,
+                        inspect, literal, select, text, update)
+from sqlalchemy.exc import DBAPIError
+
+from src import search
+from src.extensions import db
+
+
+# Start-up schema check. `db.create_all()` inspects every table on every
+# worker boot; with SCHEMA_CHECK='versioned' it only runs when the model
+# fingerprint differs from the one stored in the schema_version table, and 'skip'
+# leaves schema management to deploy tooling entirely.
+#
+# create_all() never alters a table that already exists, so migrate() then
+# adds model columns and indexes an existing table lacks (ALTER TABLE ...
+# ADD COLUMN, with the column's scalar default as a server default so NOT
+# NULL columns can be added to populated tables) and runs the BACKFILLS of
+# the columns it added; PREPARES clean up rows a new unique index would
+# reject. It also installs the chat full-text index (src/search.py), so
+# databases set up with SCHEMA_CHECK='versioned' get it too. Dropped or
+# retyped columns are not handled.
+
+
+def schema_fingerprint(metadata):
+    # stable hash of tables, columns and indexes declared by the models
+    parts = []
+    for table in metadata.sorted_tables:
+        parts.append(f'table {table.name}')
+        for col in table.columns:
+            parts.append(f'  col {col.name} {col.type} {col.nullable} {col.primary_key}')
+        for idx in sorted(table.indexes, key=lambda i: i.name or ''):
+            parts.append(f'  idx {idx.name} {",".join(c.name for c in idx.columns)} {idx.unique}')
+        for cons in sorted(table.constraints, key=lambda c: c.name or ''):
+            if cons.name:
+                parts.append(f'  cons {cons.name}')
+    # objects migrate() installs outside the metadata
+    parts.extend(f'ddl {stmt}' for stmt in search.ddl())
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+
+def _column_ddl(col, dialect):
+    quote = dialect.identifier_preparer.quote
+    ddl = f'{quote(col.name)} {col.type.compile(dialect=dialect)}'
+    default = col.default.arg if col.default is not None and col.default.is_scalar else None
+    if default is not None:
+        ddl += ' DEFAULT ' + str(literal(default).compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+        if not col.nullable:
+            ddl += ' NOT NULL'
+    return ddl
+
+
+def _backfill_end_times(conn, app):
+    # appointments booked before durations existed: default length from their start
+    appts = db.metadata.tables['appointments']
+    default = app.config.get('APPOINTMENT_DEFAULT_MINUTES', 30)
+    rows = conn.execute(select(appts.c.id, appts.c.start_time, appts.c.duration_minutes).where(
+        appts.c.end_time.is_(None))).all()
+    for i in range(0, len(rows), 1000):
+        conn.execute(appts.update().where(appts.c.id == bindparam('row_id')).values(end_time=bindparam('end')), [
+            {'row_id': r.id, 'end': r.start_time + timedelta(minutes=r.duration_minutes or default)}
+            for r in rows[i:i + 1000]])
+
+
+def _backfill_storage_bytes(conn, app):
+    summaries, files = db.metadata.tables['patient_summary'], db.metadata.tables['medical_files']
+    conn.execute(update(summaries).values(storage_bytes=select(func.coalesce(func.sum(files.c.size_bytes), 0)).where(
+        files.c.patient_id == summaries.c.patient_id).scalar_subquery()))
+
+
+def _warn_file_sizes(conn, app):
+    app.logger.warning('medical_files.size_bytes was added; run `flask storage backfill` to record existing sizes')
+
+
+def _dedupe_vitals(conn, app):
+    # readings stored more than once for the same (patient, type, instant); the oldest copy is kept
+    vitals = db.metadata.tables['vitals']
+    first = select(func.min(vitals.c.id)).group_by(vitals.c.patient_id, vitals.c.type, vitals.c.timestamp)
+    removed = conn.execute(vitals.delete().where(
+        vitals.c.type.isnot(None), vitals.c.timestamp.isnot(None), vitals.c.id.notin_(first))).rowcount
+    if removed:
+        app.logger.warning('Removed %d duplicate vitals before adding uq_vitals_patient_type_ts', removed)
+
+
+# run once, in the same transaction, right before the index is created on an existing table
+PREPARES = {
+    'uq_vitals_patient_type_ts': _dedupe_vitals,
+}
+
+# run once, in the same transaction, right after the column was added
+BACKFILLS = {
+    'appointments.end_time': _backfill_end_times,
+    'patient_summary.storage_bytes': _backfill_storage_bytes,
+    'medical_files.size_bytes': _warn_file_sizes,
+}
+
+
+def migrate(app, engine, metadata):
+    """Add missing columns and indexes to existing tables; returns what was added."""
+    insp = inspect(engine)
+    tables = set(insp.get_table_names())
+    quote = engine.dialect.identifier_preparer.quote
+    added = []
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            columns = {c['name'] for c in insp.get_columns(table.name)}
+            new_columns = [c for c in table.columns if c.name not in columns]
+            for col in new_columns:
+                conn.execute(text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {_column_ddl(col, engine.dialect)}'))
+                added.append(f'{table.name}.{col.name}')
+            indexes = {i['name'] for i in insp.get_indexes(table.name)}
+            indexes |= {u['name'] for u in insp.get_unique_constraints(table.name)}
+            for idx in table.indexes:
+                if idx.name not in indexes:
+                    if idx.name in PREPARES:
+                        PREPARES[idx.name](conn, app)
+                    idx.create(conn)
+                    added.append(idx.name)
+            # unique constraints cannot be added to a SQLite table; a unique index does the same job
+            for cons in table.constraints:
+                if isinstance(cons, UniqueConstraint) and cons.name and cons.name not in indexes:
+                    if cons.name in PREPARES:
+                        PREPARES[cons.name](conn, app)
+                    cols = ', '.join(quote(c.name) for c in cons.columns)
+                    conn.execute(text(f'CREATE UNIQUE INDEX {quote(cons.name)} ON {quote(table.name)} ({cols})'))
+                    added.append(cons.name)
+        for name in added:
+            if name in BACKFILLS:
+                BACKFILLS[name](conn, app)
+        # the full-text index is not part of the metadata; filled from existing messages when created
+        if 'chat_messages' in tables and search.install(conn):
+            added.append(search.FTS_TABLE)
+    if added:
+        app.logger.info('Schema migrated: added %s', ', '.join(added))
+    return added
+
+
+# the fingerprint the database was last brought up to; one row, kept outside the
+# models' metadata so it is neither fingerprinted nor touched by create_all()
+_version_metadata = MetaData()
+schema_version = Table(
+    'schema_version', _version_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('fingerprint', String(64), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def stored_fingerprint(engine):
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(schema_version.c.fingerprint).where(schema_version.c.id == 1)).scalar()
+    except DBAPIError:
+        return None  # no schema_version table yet
+
+
+def store_fingerprint(engine, fingerprint):
+    with engine.begin() as conn:
+        schema_version.create(conn, checkfirst=True)
+        conn.execute(schema_version.delete())
+        conn.execute(schema_version.insert().values(id=1, fingerprint=fingerprint, applied_at=datetime.utcnow()))
+
+
+def ensure_schema(app):
+    mode = (app.config.get('SCHEMA_CHECK') or 'always').strip().lower()
+    if mode == 'skip':
+        return False
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+    versioned = mode == 'versioned' and ':memory:' not in uri and uri != 'sqlite://'
+    with app.app_context():
+        # stored in the database itself, so it survives redeploys on an ephemeral
+        # disk and is gone when the database is recreated
+        if versioned:
+            fingerprint = schema_fingerprint(db.metadata)
+            if stored_fingerprint(db.engine) == fingerprint:
+                return False
+
+        db.create_all()
+        migrate(app, db.engine, db.metadata)
+
+        if versioned:
+            store_fingerprint(db.engine, fingerprint)
+    return True
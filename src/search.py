@@ -0,0 +1,142 @@
+import re
+
+import click
+from flask.cli import with_appcontext
+from markupsafe import escape, Markup
+from sqlalchemy import event, text
+
+from src.extensions import db
+
+
+# Full-text search over chat history. SQLite gets an external-content FTS5
+# table kept in sync by triggers; Postgres gets a GIN index on
+# to_tsvector(message_text), which the database maintains on insert itself.
+# The index is installed whenever create_all() runs and by schema.migrate(),
+# which fills it from existing messages on first install; `flask
+# rebuild-search-index` re-indexes.
+
+FTS_TABLE = 'chat_messages_fts'
+PG_CONFIG = 'english'
+# highlight markers that cannot appear in user text; swapped for <mark> after escaping
+_HL_START, _HL_END = '\x02', '\x03'
+
+_SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "message_text, content='chat_messages', content_rowid='id', tokenize='porter unicode61')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON chat_messages BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, message_text) VALUES (new.id, new.message_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON chat_messages BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message_text) VALUES ('delete', old.id, old.message_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF message_text ON chat_messages BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message_text) VALUES ('delete', old.id, old.message_text); "
+    f"INSERT INTO {FTS_TABLE}(rowid, message_text) VALUES (new.id, new.message_text); END",
+]
+
+_PG_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_chat_messages_fts ON chat_messages "
+    f"USING gin (to_tsvector('{PG_CONFIG}', message_text))",
+]
+
+
+def ddl():
+    # every statement install() may run; part of the schema fingerprint
+    return _SQLITE_DDL + _PG_DDL
+
+
+def install(connection, rebuild=False):
+    # idempotent; a newly created FTS5 table is filled from existing messages.
+    # Returns True if the table was created just now.
+    dialect = connection.dialect.name
+    created = False
+    if dialect == 'sqlite':
+        created = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}).first() is None
+        for stmt in _SQLITE_DDL:
+            connection.execute(text(stmt))
+        if rebuild or created:
+            connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    elif dialect == 'postgresql':
+        created = connection.execute(text("SELECT to_regclass('ix_chat_messages_fts')")).scalar() is None
+        for stmt in _PG_DDL:
+            connection.execute(text(stmt))
+        if rebuild:
+            connection.execute(text('REINDEX INDEX ix_chat_messages_fts'))
+    return created
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _install_after_create(target, connection, **kw):
+    install(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _drop_before_drop(target, connection, **kw):
+    # the external-content table would otherwise outlive chat_messages with stale rowids
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text(f'DROP TABLE IF EXISTS {FTS_TABLE}'))
+
+
+def fts5_query(q):
+    # user input -> FTS5 expression: every word must match, the last one as a prefix
+    words = re.findall(r'\w+', q or '')
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def highlight(raw):
+    return Markup(str(escape(raw)).replace(_HL_START, '<mark>').replace(_HL_END, '</mark>'))
+
+
+def search_messages(user_id, q, other_id=None, page=1, per_page=20):
+    """Ranked matches from conversations `user_id` takes part in.
+
+    Returns (rows, has_more); each row has id, sender_id, receiver_id,
+    timestamp and an HTML-safe snippet with the matched terms in <mark>.
+    """
+    params = {'uid': user_id, 'limit': per_page + 1, 'offset': (page - 1) * per_page}
+    scope = '(m.sender_id = :uid OR m.receiver_id = :uid)'
+    if other_id is not None:
+        scope = ('((m.sender_id = :uid AND m.receiver_id = :other) OR '
+                 '(m.sender_id = :other AND m.receiver_id = :uid))')
+        params['other'] = other_id
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        params['q'] = fts5_query(q)
+        if params['q'] is None:
+            return [], False
+        sql = (f"SELECT m.id, m.sender_id, m.receiver_id, m.timestamp, "
+               f"snippet({FTS_TABLE}, 0, '{_HL_START}', '{_HL_END}', '…', 24) AS snippet "
+               f"FROM {FTS_TABLE} JOIN chat_messages m ON m.id = {FTS_TABLE}.rowid "
+               f"WHERE {FTS_TABLE} MATCH :q AND {scope} "
+               f"ORDER BY bm25({FTS_TABLE}), m.timestamp DESC LIMIT :limit OFFSET :offset")
+    elif dialect == 'postgresql':
+        if not re.search(r'\w', q or ''):
+            return [], False
+        params.update(q=q, opts=f'StartSel={_HL_START}, StopSel={_HL_END}, MaxWords=35, MinWords=15')
+        sql = (f"SELECT m.id, m.sender_id, m.receiver_id, m.timestamp, "
+               f"ts_headline('{PG_CONFIG}', m.message_text, query, :opts) AS snippet "
+               f"FROM chat_messages m, websearch_to_tsquery('{PG_CONFIG}', :q) AS query "
+               f"WHERE to_tsvector('{PG_CONFIG}', m.message_text) @@ query AND {scope} "
+               f"ORDER BY ts_rank(to_tsvector('{PG_CONFIG}', m.message_text), query) DESC, m.timestamp DESC "
+               f"LIMIT :limit OFFSET :offset")
+    else:
+        raise RuntimeError(f'Full-text search is not available for the {dialect} backend')
+
+    rows = db.session.execute(text(sql).columns(timestamp=db.DateTime), params).mappings().all()
+    return rows[:per_page], len(rows) > per_page
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    with db.engine.begin() as conn:
+        install(conn, rebuild=True)
+    click.echo('Chat search index rebuilt')
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_search_index_command)
@@ -0,0 +1,34 @@
+// Medication name suggestions for inputs marked with data-med-autocomplete.
+// Suggestions come from /api/medications/suggest and are offered through a
+// <datalist>, so picking one fills in the canonical spelling.
+
+document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('input[data-med-autocomplete]').forEach(function (input, i) {
+        const list = document.createElement('datalist');
+        list.id = 'med-suggestions-' + i;
+        input.setAttribute('list', list.id);
+        input.after(list);
+
+        let timer = null;
+        let lastQuery = '';
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                const q = input.value.trim();
+                if (!q || q === lastQuery) return;
+                lastQuery = q;
+                fetch('/api/medications/suggest?q=' + encodeURIComponent(q))
+                    .then(r => r.json())
+                    .then(function (items) {
+                        list.innerHTML = '';
+                        items.forEach(function (item) {
+                            const opt = document.createElement('option');
+                            opt.value = item.name;
+                            list.appendChild(opt);
+                        });
+                    })
+                    .catch(err => console.error('Medication suggestions failed', err));
+            }, 120);
+        });
+    });
+});
@@ -1,15 +1,23 @@
+// precache.js is generated by `python -m src.assets`; it defines the cache name
+// (derived from the asset hashes) and the fingerprinted URLs to precache.
+try {
+    importScripts('/static/dist/precache.js');
+} catch (e) {
+    // assets not built (local development): fall back to the plain files
+}
+
+const CACHE_NAME = self.CARECONNECT_CACHE || 'careconnect-cache-dev';
+const PRECACHE_URLS = ['/'].concat(self.CARECONNECT_PRECACHE || [
+    '/static/css/tailwind.css',
+    '/static/css/styles.css',
+    '/static/js/app.js',
+    '/static/icons/webmanifest.json',
+]);
+
 self.addEventListener('install', (event) => {
     event.waitUntil(
-        caches.open('careconnect-cache-v1').then((cache) => {
-            return cache.addAll([
-                '/',
-                '/index.html',
-                '/dashboard.html',
-                '/static/css/tailwind.css',
-                '/static/css/styles.css',
-                '/static/js/app.js',
-                '/static/icons/webmanifest.json',
-            ]);
+        caches.open(CACHE_NAME).then((cache) => {
+            return cache.addAll(PRECACHE_URLS);
         })
     );
 });
@@ -23,16 +31,16 @@ self.addEventListener('fetch', (event) => {
 });
 
 self.addEventListener('activate', (event) => {
-    const cacheWhitelist = ['careconnect-cache-v1'];
+    // drop caches from previous deploys
     event.waitUntil(
         caches.keys().then((cacheNames) => {
             return Promise.all(
                 cacheNames.map((cacheName) => {
-                    if (cacheWhitelist.indexOf(cacheName) === -1) {
+                    if (cacheName !== CACHE_NAME) {
                         return caches.delete(cacheName);
                     }
                 })
             );
         })
     );
-});
\ No newline at end of file
+});
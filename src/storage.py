@@ -0,0 +1,134 @@
+import os
+
+import click
+from flask import current_app, request
+from flask.cli import with_appcontext
+from sqlalchemy import func, update
+
+from src.extensions import db
+from src import summary
+from src.models.user import MedicalFile, PatientSummary, User
+
+
+# Per-user storage accounting. MedicalFile.size_bytes holds each file's size
+# on disk and patient_summary.storage_bytes their sum, adjusted in the same
+# transaction as every upload, delete and image recompression (through
+# summary.adjust_counts). upload_file checks STORAGE_QUOTA_BYTES against the
+# declared Content-Length before the body is parsed, then reserve() adds the
+# real size with a conditional UPDATE in the upload's own transaction, so
+# concurrent uploads cannot overshoot the quota together. `flask storage report` lists the top consumers from
+# an index; `flask storage backfill` sizes files stored before accounting.
+
+# multipart framing (boundaries, part headers) counted in Content-Length but not stored
+MULTIPART_OVERHEAD = 4096
+
+
+def usage(user_id):
+    row = db.session.get(PatientSummary, user_id)
+    if row is not None:
+        return row.storage_bytes
+    return db.session.query(func.coalesce(func.sum(MedicalFile.size_bytes), 0)).filter(
+        MedicalFile.patient_id == user_id).scalar()
+
+
+def quota():
+    # bytes per user, or None for no limit
+    return current_app.config.get('STORAGE_QUOTA_BYTES') or None
+
+
+def check_quota(user_id, incoming):
+    # None when `incoming` more bytes fit, else the JSON error body for a 413
+    limit = quota()
+    if limit is None:
+        return None
+    used = usage(user_id)
+    if used + incoming <= limit:
+        return None
+    return {'error': 'Storage quota exceeded', 'used_bytes': used, 'quota_bytes': limit}
+
+
+def reserve(user_id, incoming):
+    # adds `incoming` bytes to the user's total in the current transaction if they
+    # fit; otherwise rolls back and returns the JSON error body for a 413
+    summary.ensure_row(user_id)
+    limit = quota()
+    stmt = update(PatientSummary).where(PatientSummary.patient_id == user_id).values(
+        storage_bytes=PatientSummary.storage_bytes + incoming)
+    if limit is not None:
+        # the database decides, so two uploads racing for the last bytes cannot both win
+        stmt = stmt.where(PatientSummary.storage_bytes + incoming <= limit)
+    if db.session.execute(stmt, execution_options={'synchronize_session': False}).rowcount == 1:
+        return None
+    db.session.rollback()
+    return {'error': 'Storage quota exceeded', 'used_bytes': usage(user_id), 'quota_bytes': limit}
+
+
+def precheck_request(user_id):
+    # call before touching request.files, so an upload that cannot fit is refused unread
+    if request.content_length is None:
+        return None
+    return check_quota(user_id, max(request.content_length - MULTIPART_OVERHEAD, 0))
+
+
+def top_consumers(limit=20):
+    # (user id, username, bytes, files), largest first; walks ix_patient_summary_storage
+    return db.session.query(User.id, User.username, PatientSummary.storage_bytes, PatientSummary.file_count).join(
+        User, User.id == PatientSummary.patient_id).filter(PatientSummary.storage_bytes > 0).order_by(
+        PatientSummary.storage_bytes.desc()).limit(limit).all()
+
+
+def backfill_sizes(batch_size=500):
+    # stat files whose size was never recorded; returns the number sized
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    touched, sized, last_id = set(), 0, 0
+    while True:
+        batch = MedicalFile.query.filter(MedicalFile.size_bytes.is_(None), MedicalFile.id > last_id).order_by(
+            MedicalFile.id).limit(batch_size).all()
+        if not batch:
+            break
+        for mf in batch:
+            last_id = mf.id
+            path = os.path.join(upload_folder, f'user_{mf.patient_id}', mf.storage_filename or '')
+            try:
+                mf.size_bytes = os.path.getsize(path)
+            except OSError:
+                continue  # missing on disk
+            mf.original_size_bytes = mf.original_size_bytes or mf.size_bytes
+            touched.add(mf.patient_id)
+            sized += 1
+        db.session.commit()
+    if touched:
+        summary.rebuild_summaries(sorted(touched))
+    return sized
+
+
+def _human(n):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if n < 1024 or unit == 'GiB':
+            return f'{n:.1f} {unit}' if unit != 'B' else f'{n} B'
+        n /= 1024
+
+
+@click.group('storage')
+def storage_cli():
+    """Upload storage accounting."""
+
+
+@storage_cli.command('report')
+@click.option('--top', type=int, default=20, help='Number of users to list.')
+@with_appcontext
+def report_command(top):
+    limit = quota()
+    for user_id, username, used, files in top_consumers(top):
+        share = f' ({used * 100 / limit:.0f}% of quota)' if limit else ''
+        click.echo(f'{username:<30} {_human(used):>12} in {files} files{share}')
+
+
+@storage_cli.command('backfill')
+@with_appcontext
+def backfill_command():
+    click.echo(f'Recorded sizes of {backfill_sizes()} files')
+
+
+def init_app(app):
+    app.cli.add_command(storage_cli)
@@ -0,0 +1,173 @@
+import click
+from flask import has_app_context
+from flask.cli import with_appcontext
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import IntegrityError
+
+from src.extensions import db, cache
+from src.cache import summary_key
+from src.models.user import User, PatientSummary, Vitals, Medicine, MedicalFile, CareTeamMember
+
+
+# Maintenance of the denormalized patient_summary table. Write paths call
+# these helpers before their own commit, so the summary row changes in the
+# same transaction as the data it describes. A missing row is computed from
+# the base tables on first touch; `flask rebuild-summaries` repairs drift.
+# Only the doctors caring for a changed patient get their cached list pages
+# invalidated.
+
+
+def _mark_dirty(*patient_ids):
+    db.session.info.setdefault('summary_dirty', set()).update(patient_ids)
+
+
+@event.listens_for(Session, 'before_commit')
+def _collect_doctors(session):
+    # whose list pages show the changed rows; looked up while the transaction is still open
+    dirty = session.info.get('summary_dirty')
+    if dirty and has_app_context():
+        session.info['summary_doctors'] = set(session.execute(
+            select(CareTeamMember.doctor_id).where(CareTeamMember.patient_id.in_(dirty)).distinct()).scalars())
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_after_commit(session):
+    # invalidate cached list pages only once the change is visible to readers
+    session.info.pop('summary_dirty', None)
+    doctors = session.info.pop('summary_doctors', None)
+    if doctors and has_app_context():
+        cache.bump(*(summary_key(doctor_id) for doctor_id in sorted(doctors)))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('summary_dirty', None)
+    session.info.pop('summary_doctors', None)
+
+
+def _fill(summary):
+    # recompute every column of one summary row from the base tables
+    pid = summary.patient_id
+    summary.last_vital_at = db.session.query(func.max(Vitals.timestamp)).filter(Vitals.patient_id == pid).scalar()
+    bp = db.session.query(Vitals.value1, Vitals.value2, Vitals.timestamp).filter(
+        Vitals.patient_id == pid, Vitals.type == 'bp').order_by(Vitals.timestamp.desc()).first()
+    summary.latest_bp_value1 = bp.value1 if bp else None
+    summary.latest_bp_value2 = (bp.value2 or None) if bp else None
+    summary.latest_bp_at = bp.timestamp if bp else None
+    summary.file_count, summary.storage_bytes = db.session.query(
+        func.count(MedicalFile.id), func.coalesce(func.sum(MedicalFile.size_bytes), 0)).filter(MedicalFile.patient_id == pid).one()
+    summary.medicine_count = db.session.query(func.count(Medicine.id)).filter(Medicine.patient_id == pid).scalar()
+    return summary
+
+
+def _load(patient_id):
+    # returns (summary, fresh); a fresh row already reflects the pending changes
+    _mark_dirty(patient_id)
+    summary = db.session.get(PatientSummary, patient_id)
+    if summary is not None:
+        return summary, False
+    db.session.flush()
+    summary = _fill(PatientSummary(patient_id=patient_id))
+    try:
+        # a savepoint, so losing the race for the first insert does not abort the caller's transaction
+        with db.session.begin_nested():
+            db.session.add(summary)
+    except IntegrityError:
+        # a concurrent first touch created the row; apply this change on top of it
+        _mark_dirty(patient_id)
+        return db.session.get(PatientSummary, patient_id), False
+    return summary, True
+
+
+def ensure_row(patient_id):
+    # make sure the summary row exists in the database, for SQL-side conditional updates
+    _load(patient_id)
+    db.session.flush()
+
+
+def record_vitals(patient_id, readings):
+    # readings: (type, value1, value2, timestamp) tuples added in this transaction
+    summary, fresh = _load(patient_id)
+    if fresh:
+        return
+    for v_type, value1, value2, ts in readings:
+        if summary.last_vital_at is None or ts > summary.last_vital_at:
+            summary.last_vital_at = ts
+        if v_type == 'bp' and (summary.latest_bp_at is None or ts >= summary.latest_bp_at):
+            summary.latest_bp_value1, summary.latest_bp_value2, summary.latest_bp_at = value1, value2 or None, ts
+
+
+def vital_removed(patient_id, vital):
+    # call after session.delete(vital); only a deleted "latest" reading needs a lookup
+    summary, fresh = _load(patient_id)
+    if fresh:
+        return
+    if vital.timestamp in (summary.last_vital_at, summary.latest_bp_at):
+        db.session.flush()
+        _fill(summary)
+
+
+def adjust_counts(patient_id, files=0, medicines=0, storage_bytes=0):
+    summary, fresh = _load(patient_id)
+    if fresh:
+        return
+    # SQL-side increments so concurrent writers do not lose updates
+    if files:
+        summary.file_count = PatientSummary.file_count + files
+    if medicines:
+        summary.medicine_count = PatientSummary.medicine_count + medicines
+    if storage_bytes:
+        summary.storage_bytes = PatientSummary.storage_bytes + storage_bytes
+
+
+def rebuild_summaries(patient_ids=None, batch_size=500):
+    # recompute summary rows with grouped aggregates, committing per batch
+    q = db.session.query(User.id).filter(User.role.ilike('patient'))
+    if patient_ids:
+        q = q.filter(User.id.in_(patient_ids))
+    all_ids = [pid for pid, in q.order_by(User.id).all()]
+
+    for i in range(0, len(all_ids), batch_size):
+        ids = all_ids[i:i + batch_size]
+        last_vital = dict(db.session.query(Vitals.patient_id, func.max(Vitals.timestamp)).filter(
+            Vitals.patient_id.in_(ids)).group_by(Vitals.patient_id).all())
+        files = {pid: (count, size) for pid, count, size in db.session.query(
+            MedicalFile.patient_id, func.count(MedicalFile.id), func.coalesce(func.sum(MedicalFile.size_bytes), 0)).filter(
+            MedicalFile.patient_id.in_(ids)).group_by(MedicalFile.patient_id).all()}
+        meds = dict(db.session.query(Medicine.patient_id, func.count(Medicine.id)).filter(
+            Medicine.patient_id.in_(ids)).group_by(Medicine.patient_id).all())
+        latest_bp_at = db.session.query(Vitals.patient_id, func.max(Vitals.timestamp).label('ts')).filter(
+            Vitals.patient_id.in_(ids), Vitals.type == 'bp').group_by(Vitals.patient_id).subquery()
+        bp = {row.patient_id: row for row in db.session.query(Vitals.patient_id, Vitals.value1, Vitals.value2, Vitals.timestamp).join(
+            latest_bp_at, (Vitals.patient_id == latest_bp_at.c.patient_id) & (Vitals.timestamp == latest_bp_at.c.ts)).filter(
+            Vitals.type == 'bp').all()}
+        existing = {s.patient_id: s for s in PatientSummary.query.filter(PatientSummary.patient_id.in_(ids)).all()}
+
+        for pid in ids:
+            summary = existing.get(pid)
+            if summary is None:
+                summary = PatientSummary(patient_id=pid)
+                db.session.add(summary)
+            b = bp.get(pid)
+            summary.last_vital_at = last_vital.get(pid)
+            summary.latest_bp_value1 = b.value1 if b else None
+            summary.latest_bp_value2 = (b.value2 or None) if b else None
+            summary.latest_bp_at = b.timestamp if b else None
+            summary.file_count, summary.storage_bytes = files.get(pid, (0, 0))
+            summary.medicine_count = meds.get(pid, 0)
+        _mark_dirty(*ids)
+        db.session.commit()
+    return len(all_ids)
+
+
+@click.command('rebuild-summaries')
+@click.option('--patient-id', 'patient_ids', multiple=True, type=int, help='Limit to these patients (repeatable).')
+@with_appcontext
+def rebuild_summaries_command(patient_ids):
+    count = rebuild_summaries(list(patient_ids) or None)
+    click.echo(f'Rebuilt {count} patient summaries')
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_summaries_command)
@@ -0,0 +1,211 @@
+import bisect
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from src.extensions import db, cache
+from src.cache import patient_key
+from src import summary
+from src.models.user import MedicalFile
+
+
+# Consistency scan between UPLOAD_FOLDER and medical_files. Files are written
+# before their row is committed and deleting a user cascades to the rows but
+# not the bytes, so the two drift apart. `flask scan-uploads` walks the
+# upload tree in path order and then the table in id order, one batch at a
+# time (each batch seeks straight to the cursor's folder instead of re-walking
+# the tree), pausing UPLOAD_SCAN_PAUSE_SECONDS between batches. After every batch
+# it saves a cursor to UPLOAD_SCAN_CHECKPOINT, so a run stopped by
+# --max-batches (or killed) resumes where it left off. A finished pass
+# resets the cursor. It only reports by default. With --quarantine, files
+# without a row move to UPLOAD_QUARANTINE_FOLDER. Rows without a file are
+# deleted, and each deleted row is appended to missing_rows.jsonl there.
+
+MISSING_ROWS_FILE = 'missing_rows.jsonl'
+
+
+def _checkpoint_path(app):
+    return app.config.get('UPLOAD_SCAN_CHECKPOINT') or os.path.join(app.instance_path, 'upload_scan.json')
+
+
+def _quarantine_folder(app):
+    return app.config.get('UPLOAD_QUARANTINE_FOLDER') or os.path.join(app.instance_path, 'upload_quarantine')
+
+
+def load_checkpoint(app):
+    try:
+        with open(_checkpoint_path(app)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {'phase': 'files', 'after': None}
+
+
+def save_checkpoint(app, state):
+    path = _checkpoint_path(app)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(state, fh)
+    os.replace(tmp, path)
+
+
+def list_user_dirs(upload_folder):
+    # sorted names of the user_<id> folders; read once per run and reused by every batch
+    try:
+        names = os.listdir(upload_folder)
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if name.startswith('user_') and name[5:].isdigit())
+
+
+def _user_dirs(upload_folder, names, after_dir=None):
+    # (patient id, dir name) from `after_dir` on, in name order; only the
+    # folders a batch actually reaches are stat'ed
+    for name in names[bisect.bisect_left(names, after_dir):] if after_dir else names:
+        if os.path.isdir(os.path.join(upload_folder, name)):
+            yield int(name[5:]), name
+
+
+def file_batch(upload_folder, after, size, names=None):
+    # the next `size` (patient id, relpath) after the relpath `after`, in path order
+    if names is None:
+        names = list_user_dirs(upload_folder)
+    after_dir, _, after_name = after.partition('/') if after else (None, None, None)
+    batch = []
+    for pid, dirname in _user_dirs(upload_folder, names, after_dir):
+        with os.scandir(os.path.join(upload_folder, dirname)) as it:
+            # compare names before is_file(), which may need a stat
+            files = sorted(e.name for e in it if (dirname != after_dir or e.name > after_name) and e.is_file())
+        for name in files:
+            batch.append((pid, f'{dirname}/{name}'))
+            if len(batch) == size:
+                return batch
+    return batch
+
+
+def scan_files(app, after, size, grace, quarantine, names=None):
+    """One batch of the upload tree; returns (new cursor or None when done, orphaned relpaths)."""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    batch = file_batch(upload_folder, after, size, names)
+    if not batch:
+        return None, []
+    names = [relpath.split('/', 1)[1] for _, relpath in batch]
+    known = set(db.session.query(MedicalFile.patient_id, MedicalFile.storage_filename).filter(
+        MedicalFile.storage_filename.in_(names)).all())
+    orphans = []
+    cutoff = time.time() - grace
+    for pid, relpath in batch:
+        if (pid, relpath.split('/', 1)[1]) in known:
+            continue
+        path = os.path.join(upload_folder, relpath)
+        try:
+            # skip uploads whose row may not be committed yet, and recompression temp files
+            if os.path.getmtime(path) > cutoff:
+                continue
+        except OSError:
+            continue  # removed meanwhile
+        orphans.append(relpath)
+        if quarantine:
+            dest = os.path.join(_quarantine_folder(app), relpath)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.move(path, dest)
+    return batch[-1][1], orphans
+
+
+def scan_rows(app, after, size, quarantine):
+    """One batch of medical_files; returns (new cursor or None when done, ids of rows without a file)."""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    batch = db.session.query(MedicalFile.id, MedicalFile.patient_id, MedicalFile.storage_filename).filter(
+        MedicalFile.id > (after or 0)).order_by(MedicalFile.id).limit(size).all()
+    if not batch:
+        return None, []
+    missing_ids = [file_id for file_id, pid, name in batch
+                   if not os.path.isfile(os.path.join(upload_folder, f'user_{pid}', name or ''))]
+    missing = MedicalFile.query.filter(MedicalFile.id.in_(missing_ids)).all() if quarantine and missing_ids else []
+    if quarantine and missing:
+        folder = _quarantine_folder(app)
+        os.makedirs(folder, exist_ok=True)
+        # keep a record of what was dropped, in case the bytes turn up elsewhere
+        with open(os.path.join(folder, MISSING_ROWS_FILE), 'a') as fh:
+            for mf in missing:
+                fh.write(json.dumps({
+                    'id': mf.id, 'patient_id': mf.patient_id, 'original_filename': mf.original_filename,
+                    'storage_filename': mf.storage_filename, 'size_bytes': mf.size_bytes,
+                    'upload_timestamp': mf.upload_timestamp.isoformat() if mf.upload_timestamp else None,
+                    'dropped_at': datetime.utcnow().isoformat()}) + '\n')
+        for mf in missing:
+            db.session.delete(mf)
+            summary.adjust_counts(mf.patient_id, files=-1, storage_bytes=-(mf.size_bytes or 0))
+        db.session.commit()
+        for pid in {mf.patient_id for mf in missing}:
+            cache.bump(patient_key(pid))
+    return batch[-1].id, missing_ids
+
+
+def run_scan(quarantine=False, max_batches=None, batch_size=None, report=None):
+    """Continue the scan from the checkpoint; returns (orphaned files, rows without a file, pass finished)."""
+    app = current_app._get_current_object()
+    size = batch_size or app.config.get('UPLOAD_SCAN_BATCH_SIZE', 200)
+    pause = app.config.get('UPLOAD_SCAN_PAUSE_SECONDS', 0.5)
+    grace = app.config.get('UPLOAD_SCAN_GRACE_SECONDS', 3600)
+    report = report or (lambda kind, item: None)
+    state = load_checkpoint(app)
+    files = rows = batches = 0
+    names = None  # the upload root is listed once per run, not once per batch
+    while max_batches is None or batches < max_batches:
+        if batches:
+            time.sleep(pause)  # throttle disk and database I/O
+        if state['phase'] == 'files':
+            if names is None:
+                names = list_user_dirs(app.config['UPLOAD_FOLDER'])
+            cursor, found = scan_files(app, state['after'], size, grace, quarantine, names)
+            files += len(found)
+            for relpath in found:
+                report('file', relpath)
+        else:
+            cursor, found = scan_rows(app, state['after'], size, quarantine)
+            rows += len(found)
+            for file_id in found:
+                report('row', file_id)
+        batches += 1
+        if cursor is not None:
+            state['after'] = cursor
+        elif state['phase'] == 'files':
+            state = {'phase': 'rows', 'after': None}
+        else:
+            save_checkpoint(app, {'phase': 'files', 'after': None})
+            return files, rows, True
+        save_checkpoint(app, state)
+    return files, rows, False
+
+
+@click.command('scan-uploads')
+@click.option('--quarantine', is_flag=True, help='Move orphaned files aside and drop rows whose file is missing.')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches; the next run resumes.')
+@click.option('--batch-size', type=int, default=None, help='Files / rows per batch (default UPLOAD_SCAN_BATCH_SIZE).')
+@click.option('--restart', is_flag=True, help='Discard the saved cursor and start a new pass.')
+@with_appcontext
+def scan_uploads_command(quarantine, max_batches, batch_size, restart):
+    app = current_app._get_current_object()
+    if restart:
+        save_checkpoint(app, {'phase': 'files', 'after': None})
+
+    def report(kind, item):
+        if kind == 'file':
+            click.echo(f'{"quarantined" if quarantine else "orphaned"} file {item}')
+        else:
+            click.echo(f'{"dropped" if quarantine else "missing file for"} row {item}')
+
+    files, rows, finished = run_scan(quarantine, max_batches, batch_size, report)
+    click.echo(f'{files} orphaned files, {rows} rows without a file'
+               + ('' if finished else '; scan paused, run again to continue'))
+
+
+def init_app(app):
+    app.cli.add_command(scan_uploads_command)
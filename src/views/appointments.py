@@ -1,13 +1,92 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, jsonify, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
-from datetime import datetime
+from datetime import datetime, timedelta
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import and_, func, or_
+import hashlib
 
 from src.models.user import User, Appointment
 from src.extensions import db
 from src.forms import AppointmentForm
+from src.database import read_replica
+from src import care_team, reminders
 
 appointments = Blueprint('appointments', __name__)
 
+# statuses that occupy a doctor's time
+ACTIVE_STATUSES = ('pending', 'confirmed')
+CALENDAR_VIEWS = ('day', 'week', 'month')
+
+
+def find_conflicts(doctor_id, start, end, statuses=ACTIVE_STATUSES, exclude_id=None):
+    # Anything overlapping [start, end) must start before `end` and, since no
+    # appointment is longer than APPOINTMENT_MAX_MINUTES, no earlier than
+    # start - max. That bounds the scan on the (doctor_id, start_time) index.
+    # Rows written before end_time existed (and not backfilled yet) count as
+    # APPOINTMENT_DEFAULT_MINUTES long.
+    max_minutes = current_app.config.get('APPOINTMENT_MAX_MINUTES', 240)
+    default_minutes = current_app.config.get('APPOINTMENT_DEFAULT_MINUTES', 30)
+    q = Appointment.query.filter(
+        Appointment.doctor_id == doctor_id,
+        Appointment.start_time < end,
+        Appointment.start_time > start - timedelta(minutes=max_minutes),
+        or_(Appointment.end_time > start,
+            and_(Appointment.end_time.is_(None), Appointment.start_time > start - timedelta(minutes=default_minutes))),
+        Appointment.status.in_(statuses),
+    )
+    if exclude_id is not None:
+        q = q.filter(Appointment.id != exclude_id)
+    return q.order_by(Appointment.start_time.asc()).all()
+
+
+def parse_wall_clock(value):
+    # appointment times are floating wall-clock times (see _ics_time); a value with
+    # a UTC offset would compare as an aware datetime, so it is rejected. Raises ValueError.
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        raise ValueError('appointment times take no UTC offset')
+    return dt
+
+
+def lock_doctor(doctor_id):
+    # Serializes bookings per doctor: a no-op UPDATE of the doctor's row holds its
+    # row lock (the database write lock on SQLite) until commit, so a concurrent
+    # booking waits here and then sees this one in find_conflicts. False if there
+    # is no such doctor.
+    return db.session.execute(User.__table__.update().where(
+        User.id == doctor_id, func.lower(func.trim(User.role)) == 'doctor').values(id=User.id)).rowcount == 1
+
+
+def compute_free_slots(booked, range_start, range_end, duration, config):
+    # booked: (start, end) tuples sorted by start. Walks working-hour windows
+    # day by day and the bookings list once, emitting `duration`-long gaps.
+    slots = []
+    step = timedelta(minutes=duration)
+    day = datetime(range_start.year, range_start.month, range_start.day)
+    i = 0
+    n = len(booked)
+    while day < range_end:
+        if day.weekday() in config.get('WORKING_DAYS', (0, 1, 2, 3, 4)):
+            ws = max(day + timedelta(hours=config.get('WORKING_HOURS_START', 9)), range_start)
+            we = min(day + timedelta(hours=config.get('WORKING_HOURS_END', 17)), range_end)
+            # skip bookings that finished before this window opens
+            while i < n and booked[i][1] <= ws:
+                i += 1
+            cursor = ws
+            j = i
+            while j < n and booked[j][0] < we:
+                bs, be = booked[j]
+                while cursor + step <= min(bs, we):
+                    slots.append((cursor, cursor + step))
+                    cursor += step
+                cursor = max(cursor, be)
+                j += 1
+            while cursor + step <= we:
+                slots.append((cursor, cursor + step))
+                cursor += step
+        day += timedelta(days=1)
+    return slots
+
 
 @appointments.route('/appointments')
 @login_required
@@ -30,12 +109,23 @@ def request_appointment():
         doctor_id = form.doctor_id.data
         start_time = form.start_time.data
         try:
-            dt = datetime.fromisoformat(start_time)
+            dt = parse_wall_clock(start_time)
         except Exception:
             flash('Invalid date/time format', 'danger')
             return redirect(url_for('appointments.patient_appointments'))
 
-        app_obj = Appointment(patient_id=current_user.id, doctor_id=int(doctor_id), start_time=dt, status='pending')
+        duration = form.duration.data or current_app.config.get('APPOINTMENT_DEFAULT_MINUTES', 30)
+        end = dt + timedelta(minutes=duration)
+        if not lock_doctor(int(doctor_id)):
+            flash('Unknown doctor', 'danger')
+            return redirect(url_for('appointments.patient_appointments'))
+        if find_conflicts(int(doctor_id), dt, end):
+            db.session.rollback()
+            flash('The doctor already has an appointment at that time. Please pick another slot.', 'danger')
+            return redirect(url_for('appointments.patient_appointments'))
+
+        app_obj = Appointment(patient_id=current_user.id, doctor_id=int(doctor_id), start_time=dt,
+                              duration_minutes=duration, end_time=end, status='pending')
         db.session.add(app_obj)
         db.session.commit()
         flash('Appointment requested', 'success')
@@ -45,6 +135,60 @@ def request_appointment():
     return redirect(url_for('appointments.patient_appointments'))
 
 
+def calendar_window(view, anchor):
+    # [start, end) of the day, ISO week or month containing `anchor`
+    day = datetime(anchor.year, anchor.month, anchor.day)
+    if view == 'day':
+        return day, day + timedelta(days=1)
+    if view == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=7)
+    start = day.replace(day=1)
+    if start.month == 12:
+        return start, start.replace(year=start.year + 1, month=1)
+    return start, start.replace(month=start.month + 1)
+
+
+def parse_calendar_args():
+    view = (request.args.get('view') or 'month').strip().lower()
+    if view not in CALENDAR_VIEWS:
+        view = 'month'
+    date_arg = request.args.get('date')
+    try:
+        anchor = datetime.fromisoformat(date_arg) if date_arg else datetime.utcnow()
+    except ValueError:
+        abort(400)
+    start, end = calendar_window(view, anchor)
+    return view, start, end
+
+
+def doctor_window_query(doctor_id, start, end, status=None):
+    # range scan on ix_appointments_doctor_start
+    q = Appointment.query.filter(
+        Appointment.doctor_id == doctor_id,
+        Appointment.start_time >= start,
+        Appointment.start_time < end,
+    )
+    if status and status != 'all':
+        q = q.filter(Appointment.status == status)
+    return q.order_by(Appointment.start_time.asc())
+
+
+def feed_serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='ical-feed')
+
+
+def feed_token(doctor):
+    return feed_serializer().dumps([doctor.id, doctor.feed_nonce or 0])
+
+
+def load_feed_token(token):
+    # (doctor_id, nonce); tokens signed before nonces existed carry a bare id and count as nonce 0
+    payload = feed_serializer().loads(token)
+    doctor_id, nonce = payload if isinstance(payload, list) else (payload, 0)
+    return int(doctor_id), int(nonce)
+
+
 @appointments.route('/doctor/appointments')
 @login_required
 def doctor_appointments():
@@ -52,10 +196,9 @@ def doctor_appointments():
         abort(403)
     # allow optional status filter via ?status=pending|confirmed|cancelled|all
     status = (request.args.get('status') or '').strip().lower()
-    q = Appointment.query.filter_by(doctor_id=current_user.id)
-    if status and status != 'all':
-        q = q.filter_by(status=status)
-    apps = q.order_by(Appointment.start_time.asc()).all()
+    # only the requested day/week/month is loaded, via ?view=day|week|month&date=YYYY-MM-DD
+    view, start, end = parse_calendar_args()
+    apps = doctor_window_query(current_user.id, start, end, status).all()
 
     # build patient id -> username map to display human-readable names
     patient_ids = list({a.patient_id for a in apps}) if apps else []
@@ -64,7 +207,125 @@ def doctor_appointments():
         patients = User.query.filter(User.id.in_(patient_ids)).all()
         patient_map = {p.id: p.username for p in patients}
 
-    return render_template('doctor_appointments.html', appointments=apps, patient_map=patient_map, current_status=status or 'all')
+    prev_start, _ = calendar_window(view, start - timedelta(days=1))
+    feed_url = url_for('appointments.ical_feed', token=feed_token(current_user), _external=True)
+    return render_template('doctor_appointments.html', appointments=apps, patient_map=patient_map, current_status=status or 'all',
+                           view=view, window_start=start, window_last=end - timedelta(days=1),
+                           prev_date=prev_start.date().isoformat(), next_date=end.date().isoformat(), feed_url=feed_url)
+
+
+@appointments.route('/api/doctor/calendar')
+@login_required
+@read_replica
+def calendar_api():
+    if (current_user.role or '').strip().lower() != 'doctor':
+        abort(403)
+    view, start, end = parse_calendar_args()
+    status = (request.args.get('status') or '').strip().lower()
+    rows = db.session.query(
+        Appointment.id, Appointment.patient_id, User.username, Appointment.start_time,
+        Appointment.end_time, Appointment.duration_minutes, Appointment.status,
+    ).join(User, User.id == Appointment.patient_id).filter(
+        Appointment.doctor_id == current_user.id,
+        Appointment.start_time >= start,
+        Appointment.start_time < end,
+    )
+    if status and status != 'all':
+        rows = rows.filter(Appointment.status == status)
+    rows = rows.order_by(Appointment.start_time.asc()).all()
+
+    data = [
+        {
+            'id': r.id,
+            'patient_id': r.patient_id,
+            'patient': r.username,
+            'start': r.start_time.isoformat(),
+            'end': r.end_time.isoformat() if r.end_time else None,
+            'duration': r.duration_minutes,
+            'status': r.status,
+        }
+        for r in rows
+    ]
+    return jsonify({'view': view, 'start': start.isoformat(), 'end': end.isoformat(), 'appointments': data})
+
+
+ICS_STATUS = {'pending': 'TENTATIVE', 'confirmed': 'CONFIRMED', 'cancelled': 'CANCELLED'}
+
+
+def _ics_escape(text):
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _ics_time(dt):
+    # appointments are entered as local wall-clock times, so emit floating times
+    return dt.strftime('%Y%m%dT%H%M%S')
+
+
+@appointments.route('/calendar/<token>.ics')
+@read_replica
+def ical_feed(token):
+    # calendar clients cannot log in, so the feed is addressed by a signed token
+    try:
+        doctor_id, nonce = load_feed_token(token)
+    except (BadSignature, TypeError, ValueError):
+        abort(404)
+    # a reset bumps the nonce, so older URLs stop resolving
+    if db.session.query(User.feed_nonce).filter(User.id == doctor_id).scalar() != nonce:
+        abort(404)
+
+    since = datetime.utcnow() - timedelta(days=current_app.config.get('ICAL_FEED_PAST_DAYS', 90))
+    since = datetime(since.year, since.month, since.day)
+    window = (Appointment.doctor_id == doctor_id, Appointment.start_time >= since)
+
+    # cheap aggregate for the validator: any insert or status change moves count or max(updated_at)
+    count, last_change = db.session.query(func.count(Appointment.id), func.max(Appointment.updated_at)).filter(*window).one()
+    etag = hashlib.sha1(f'{doctor_id}:{since.date()}:{count}:{last_change}'.encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    rows = db.session.query(
+        Appointment.id, Appointment.start_time, Appointment.end_time, Appointment.duration_minutes,
+        Appointment.status, Appointment.updated_at, User.username,
+    ).join(User, User.id == Appointment.patient_id).filter(*window).order_by(Appointment.start_time.asc())
+    # server-side cursor: rows are fetched in batches while the response is written
+    rows = rows.execution_options(stream_results=True).yield_per(500)
+
+    def generate():
+        yield 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//CareConnect//Appointments//EN\r\nCALSCALE:GREGORIAN\r\n'
+        for r in rows:
+            end = r.end_time or r.start_time + timedelta(minutes=r.duration_minutes or 30)
+            stamp = r.updated_at or r.start_time
+            yield (
+                'BEGIN:VEVENT\r\n'
+                f'UID:appointment-{r.id}@careconnect\r\n'
+                f'DTSTAMP:{_ics_time(stamp)}\r\n'
+                f'DTSTART:{_ics_time(r.start_time)}\r\n'
+                f'DTEND:{_ics_time(end)}\r\n'
+                f'SUMMARY:{_ics_escape("Appointment with " + r.username)}\r\n'
+                f'STATUS:{ICS_STATUS.get(r.status, "TENTATIVE")}\r\n'
+                'END:VEVENT\r\n'
+            )
+        yield 'END:VCALENDAR\r\n'
+
+    resp = Response(stream_with_context(generate()), mimetype='text/calendar')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+
+@appointments.route('/doctor/appointments/reset_feed', methods=['POST'])
+@login_required
+def reset_feed():
+    # revokes the current calendar feed URL, e.g. after it was shared by mistake
+    if (current_user.role or '').strip().lower() != 'doctor':
+        abort(403)
+    db.session.execute(User.__table__.update().where(User.id == current_user.id).values(
+        feed_nonce=User.feed_nonce + 1))
+    db.session.commit()
+    flash('Calendar feed URL reset. Subscribe again with the new URL.', 'success')
+    return redirect(url_for('appointments.doctor_appointments'))
 
 
 @appointments.route('/confirm_appointment/<int:app_id>')
@@ -75,8 +336,20 @@ def confirm_appointment(app_id):
     app_obj = Appointment.query.get_or_404(app_id)
     if app_obj.doctor_id != current_user.id:
         abort(403)
+    end = app_obj.end_time or app_obj.start_time + timedelta(
+        minutes=app_obj.duration_minutes or current_app.config.get('APPOINTMENT_DEFAULT_MINUTES', 30))
+    lock_doctor(app_obj.doctor_id)
+    if find_conflicts(app_obj.doctor_id, app_obj.start_time, end, statuses=('confirmed',), exclude_id=app_obj.id):
+        db.session.rollback()
+        flash('This appointment overlaps another confirmed appointment.', 'danger')
+        return redirect(url_for('appointments.doctor_appointments'))
     app_obj.status = 'confirmed'
+    # confirming makes the patient part of the doctor's care team
+    added = care_team.assign(app_obj.doctor_id, app_obj.patient_id, source='appointment')
     db.session.commit()
+    if added:
+        care_team.changed(app_obj.doctor_id, app_obj.patient_id)
+    reminders.appointment_changed(app_obj)
     flash('Appointment confirmed', 'success')
     return redirect(url_for('appointments.doctor_appointments'))
 
@@ -92,8 +365,49 @@ def cancel_appointment(app_id):
         abort(403)
     app_obj.status = 'cancelled'
     db.session.commit()
+    reminders.appointment_changed(app_obj)
     flash('Appointment cancelled', 'info')
     # redirect appropriately
     if (current_user.role or '').strip().lower() == 'doctor':
         return redirect(url_for('appointments.doctor_appointments'))
     return redirect(url_for('appointments.patient_appointments'))
+
+
+@appointments.route('/api/doctors/<int:doctor_id>/free_slots')
+@login_required
+def free_slots(doctor_id):
+    # ?start=YYYY-MM-DD[THH:MM]&end=...&duration=minutes
+    doc = User.query.get_or_404(doctor_id)
+    if (doc.role or '').strip().lower() != 'doctor':
+        abort(404)
+
+    cfg = current_app.config
+    try:
+        range_start = parse_wall_clock(request.args['start']) if request.args.get('start') else datetime.utcnow()
+        range_end = parse_wall_clock(request.args['end']) if request.args.get('end') else range_start + timedelta(days=7)
+        duration = int(request.args.get('duration') or cfg.get('APPOINTMENT_DEFAULT_MINUTES', 30))
+    except ValueError:
+        return jsonify({'error': 'Invalid start, end or duration'}), 400
+    if range_end <= range_start:
+        return jsonify({'error': 'end must be after start'}), 400
+    if not 5 <= duration <= cfg.get('APPOINTMENT_MAX_MINUTES', 240):
+        return jsonify({'error': 'Invalid duration'}), 400
+    if range_end - range_start > timedelta(days=cfg.get('FREE_SLOTS_MAX_DAYS', 31)):
+        return jsonify({'error': 'Date range too large'}), 400
+
+    # one indexed range query for every booking touching the window
+    max_minutes = cfg.get('APPOINTMENT_MAX_MINUTES', 240)
+    rows = db.session.query(Appointment.start_time, Appointment.end_time).filter(
+        Appointment.doctor_id == doctor_id,
+        Appointment.start_time < range_end,
+        Appointment.start_time > range_start - timedelta(minutes=max_minutes),
+        Appointment.status.in_(ACTIVE_STATUSES),
+    ).order_by(Appointment.start_time.asc()).all()
+    booked = [(s, e or s + timedelta(minutes=cfg.get('APPOINTMENT_DEFAULT_MINUTES', 30))) for s, e in rows]
+
+    slots = compute_free_slots(booked, range_start, range_end, duration, cfg)
+    return jsonify({
+        'doctor_id': doctor_id,
+        'duration': duration,
+        'slots': [{'start': s.isoformat(), 'end': e.isoformat()} for s, e in slots],
+    })
@@ -0,0 +1,36 @@
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+
+from src.audit import audit_log
+from src import care_team
+from src.extensions import db
+from src.models.user import User, AuditEvent
+
+audit_views = Blueprint('audit', __name__)
+
+
+@audit_views.route('/api/patients/<int:patient_id>/access_log')
+@login_required
+def access_log(patient_id):
+    # a patient may review their own access history; doctors that of their care team's patients
+    if current_user.id != patient_id:
+        care_team.require_patient(patient_id)
+    User.query.get_or_404(patient_id)
+    # include events still waiting in the buffer
+    audit_log.flush()
+
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    q = db.session.query(AuditEvent, User.username).join(User, User.id == AuditEvent.actor_id).filter(
+        AuditEvent.patient_id == patient_id)
+    before = request.args.get('before', type=int)
+    if before:
+        q = q.filter(AuditEvent.id < before)
+    rows = q.order_by(AuditEvent.occurred_at.desc(), AuditEvent.id.desc()).limit(limit + 1).all()
+
+    events = [
+        {'id': e.id, 'actor_id': e.actor_id, 'actor': username, 'action': e.action, 'target': e.target,
+         'occurred_at': e.occurred_at.isoformat()}
+        for e, username in rows[:limit]
+    ]
+    # pass next_before as ?before= to fetch the following page
+    return jsonify({'events': events, 'next_before': events[-1]['id'] if len(rows) > limit else None})
@@ -2,7 +2,8 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_user, logout_user, login_required
 
 from src.models.user import User
-from src.extensions import db
+from src.extensions import db, cache
+from src.cache import users_key
 from src.forms import LoginForm, RegisterForm
 
 auth = Blueprint('auth', __name__)
@@ -47,6 +48,7 @@ def register():
         new_user.set_password(password)
         db.session.add(new_user)
         db.session.commit()
+        cache.bump(users_key(role))
         current_app.logger.debug('Registered new user id=%s username=%s', new_user.id, new_user.username)
         flash('Registration successful! You can now log in.', 'success')
         return redirect(url_for('auth.login'))
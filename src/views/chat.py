@@ -1,7 +1,13 @@
 from flask import Blueprint, render_template, request, jsonify, abort, current_app
 from flask_login import login_required, current_user
-from src.extensions import socketio, db
-from src.models.user import User, ChatMessage
+from src.extensions import socketio, db, cache
+from src.cache import chat_key, users_key, summary_key, conversations_key, care_team_key
+from src.database import read_replica
+from src.models.user import User, ChatMessage, PatientSummary, Conversation
+from src import conversations, search, care_team
+from src.archive import archived_messages, requested_range
+from src import fastjson
+from sqlalchemy import select
 from flask_socketio import join_room, leave_room, emit
 from datetime import datetime
 
@@ -10,31 +16,109 @@ chat = Blueprint('chat', __name__)
 
 @chat.route('/chat')
 @login_required
+@cache.cached(lambda: [users_key('doctor'), care_team_key(current_user.id), summary_key(current_user.id),
+                        conversations_key(current_user.id)], html=True)
 def chat_page():
-    # provide a contact list: doctors for patients, patients for doctors
-    if (current_user.role or '').strip().lower() == 'patient':
-        contacts = User.query.filter(User.role.ilike('doctor')).order_by(User.username).all()
+    # provide a contact list: a doctor's care-team patients, a patient's
+    # doctors, most recent conversation first (patients come with their
+    # summary row so doctors see the latest readings)
+    is_patient = (current_user.role or '').strip().lower() == 'patient'
+    q = db.session.query(User, PatientSummary, Conversation).outerjoin(
+        PatientSummary, PatientSummary.patient_id == User.id
+    ).outerjoin(
+        Conversation, (Conversation.user_id == current_user.id) & (Conversation.other_id == User.id)
+    )
+    if not is_patient:
+        q = q.filter(User.id.in_(care_team.patient_ids(current_user.id)))
+    elif care_team.has_doctors(current_user.id):
+        q = q.filter(User.id.in_(care_team.doctor_ids(current_user.id)))
     else:
-        contacts = User.query.filter(User.role.ilike('patient')).order_by(User.username).all()
-    return render_template('chat.html', contacts=contacts)
+        # a patient without a care team yet can still reach any doctor
+        q = q.filter(User.role.ilike('doctor'))
+    contacts = q.order_by(Conversation.last_message_at.is_(None), Conversation.last_message_at.desc(),
+                          User.username).all()
+    return render_template('chat.html', contacts=contacts,
+                           unread_total=sum(c.unread_count for _, _, c in contacts if c))
+
+
+@chat.route('/api/conversations')
+@login_required
+@cache.cached(lambda: [conversations_key(current_user.id)])
+@read_replica
+def list_conversations():
+    rows = conversations.conversation_list(current_user.id)
+    return jsonify({
+        'conversations': [conversations.conversation_dict(conv, other) for conv, other in rows],
+        'unread_total': sum(conv.unread_count for conv, _ in rows),
+    })
+
+
+@chat.route('/api/conversations/<int:other_id>/read', methods=['POST'])
+@login_required
+def mark_conversation_read(other_id):
+    User.query.get_or_404(other_id)
+    read_at = datetime.utcnow()
+    count = conversations.mark_read(current_user.id, other_id, read_at)
+    db.session.commit()
+    if count:
+        cache.bump(chat_key(current_user.id, other_id), conversations_key(current_user.id))
+        # read receipt for the sender, badge reset for the reader's other tabs
+        socketio.emit('messages_read', {'by': current_user.id, 'read_at': read_at.isoformat()}, room=str(other_id))
+    socketio.emit('unread', {'from': other_id, 'count': 0, 'total': conversations.unread_total(current_user.id)},
+                  room=str(current_user.id))
+    return jsonify({'status': 'ok', 'marked': count})
 
 
 @chat.route('/api/get_messages/<int:other_id>')
 @login_required
+@cache.cached(lambda other_id: [chat_key(current_user.id, other_id)])
+@read_replica
 def get_messages(other_id):
     # ensure other user exists
     other = User.query.get_or_404(other_id)
     # authorize: allow chats between any users (application may restrict later)
-    msgs = ChatMessage.query.filter(
+    # the whole thread, archived messages included; an optional ISO ?since= narrows it
+    try:
+        since = requested_range(request.args)[0]
+    except ValueError:
+        return jsonify({'error': 'since must be an ISO date'}), 400
+    stmt = select(ChatMessage.id, ChatMessage.sender_id.label('from'), ChatMessage.receiver_id.label('to'),
+                  ChatMessage.message_text.label('text'), ChatMessage.timestamp, ChatMessage.read_at).where(
         ((ChatMessage.sender_id == current_user.id) & (ChatMessage.receiver_id == other_id)) |
         ((ChatMessage.sender_id == other_id) & (ChatMessage.receiver_id == current_user.id))
-    ).order_by(ChatMessage.timestamp.asc()).all()
+    )
+    if since is not None:
+        stmt = stmt.where(ChatMessage.timestamp >= since)
+    rows = fastjson.query_rows(stmt.order_by(ChatMessage.timestamp, ChatMessage.id))
+    # archived segments are decoded only when the range reaches into them
+    archived = [{'id': m['id'], 'from': m['sender_id'], 'to': m['receiver_id'], 'text': m['message_text'],
+                 'timestamp': m['timestamp'], 'read_at': m['read_at']}
+                for m in archived_messages(current_user.id, other_id, since)]
+    if archived:
+        rows = fastjson.merge_rows(archived, rows)
+    return fastjson.json_array(rows, stream=request.args.get('stream') in ('1', 'true'))
+
+
+@chat.route('/api/messages/search')
+@login_required
+@read_replica
+def search_messages():
+    # ?q=words[&with=<user id>][&page=1&per_page=20]
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({'error': 'Missing search query'}), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 50)
+    other_id = request.args.get('with', type=int)
 
-    data = [
-        {'id': m.id, 'from': m.sender_id, 'to': m.receiver_id, 'text': m.message_text, 'timestamp': m.timestamp.isoformat()}
-        for m in msgs
+    rows, has_more = search.search_messages(current_user.id, q, other_id=other_id, page=page, per_page=per_page)
+    results = [
+        {'id': r['id'], 'from': r['sender_id'], 'to': r['receiver_id'],
+         'other_id': r['receiver_id'] if r['sender_id'] == current_user.id else r['sender_id'],
+         'timestamp': r['timestamp'].isoformat(), 'snippet': str(search.highlight(r['snippet']))}
+        for r in rows
     ]
-    return jsonify(data)
+    return jsonify({'results': results, 'page': page, 'per_page': per_page, 'has_more': has_more})
 
 
 @socketio.on('connect')
@@ -67,10 +151,17 @@ def handle_private_message(data):
     # persist message
     msg = ChatMessage(sender_id=sender.id, receiver_id=int(to_id), message_text=text, timestamp=datetime.utcnow())
     db.session.add(msg)
+    conversations.record_message(msg)
     db.session.commit()
+    cache.bump(chat_key(sender.id, to_id), conversations_key(sender.id), conversations_key(to_id))
 
-    payload = {'id': msg.id, 'from': msg.sender_id, 'to': msg.receiver_id, 'text': msg.message_text, 'timestamp': msg.timestamp.isoformat()}
+    payload = {'id': msg.id, 'from': msg.sender_id, 'to': msg.receiver_id, 'text': msg.message_text,
+               'timestamp': msg.timestamp.isoformat(), 'read_at': None}
 
     # emit to receiver's room and sender (so sender sees it too)
     emit('new_message', payload, room=str(to_id))
     emit('new_message', payload, room=str(sender.id))
+    # unread badge for the receiver
+    unread = db.session.get(Conversation, (msg.receiver_id, msg.sender_id))
+    emit('unread', {'from': sender.id, 'count': unread.unread_count if unread else 0,
+                    'total': conversations.unread_total(msg.receiver_id)}, room=str(to_id))
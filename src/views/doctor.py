@@ -1,9 +1,18 @@
-from flask import Blueprint, render_template, abort, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, abort, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
 from datetime import datetime
-
-from src.models.user import User, PatientProfile, Medicine, Vitals, MedicalFile
-from src.extensions import db
+from functools import partial
+
+from src.models.user import User, PatientProfile, Medicine, Vitals, MedicalFile, PatientSummary, CareTeamMember
+from src.extensions import db, cache
+from src.cache import patient_key, summary_key, care_team_key
+from src.analytics import cohort_risk, patients_for_doctor
+from src import summary, care_team
+from src.archive import vitals_for, vitals_count
+from src.audit import audit_log
+from src import medications
+from src.database import read_replica
+from src.fragments import deferred, fragment_cache
 
 doctor = Blueprint('doctor', __name__)
 
@@ -14,36 +23,80 @@ def is_doctor():
 
 @doctor.route('/doctor')
 @login_required
+@cache.cached(lambda: [care_team_key(current_user.id), summary_key(current_user.id)], html=True)
+@read_replica
 def dashboard():
     # only doctors may access
     if not is_doctor():
         abort(403)
-    patients = User.query.filter(User.role.ilike('patient')).order_by(User.username).all()
+    # one query over the doctor's care team: each patient with its patient_summary row (None until first write)
+    patients = db.session.query(User, PatientSummary).join(
+        CareTeamMember, (CareTeamMember.patient_id == User.id) & (CareTeamMember.doctor_id == current_user.id)
+    ).outerjoin(
+        PatientSummary, PatientSummary.patient_id == User.id
+    ).order_by(User.username).all()
     return render_template('doctor_dashboard.html', patients=patients)
 
 
-@doctor.route('/doctor/view/<int:patient_id>')
+@doctor.route('/api/doctor/risk')
 @login_required
-def view_patient(patient_id):
+@read_replica
+def risk_panel():
+    # data for the "patients at risk" panel on the doctor dashboard
+    if not is_doctor():
+        abort(403)
+    cfg = current_app.config
+    rows = cohort_risk(patients_for_doctor(current_user),
+                       window_days=cfg.get('RISK_WINDOW_DAYS', 90),
+                       rolling=cfg.get('RISK_ROLLING_READINGS', 5),
+                       thresholds=cfg.get('RISK_THRESHOLDS'))
+    if request.args.get('flagged') in ('1', 'true'):
+        rows = [r for r in rows if r['flags']]
+    return jsonify(rows)
+
+
+@doctor.route('/api/doctor/cache_stats')
+@login_required
+def cache_stats():
+    # hit rates of the response and template fragment caches in this worker
     if not is_doctor():
         abort(403)
+    backend, fragments = cache.backend, fragment_cache()
+    responses = None
+    if backend is not None:
+        lookups = backend.hits + backend.misses
+        responses = {'hits': backend.hits, 'misses': backend.misses,
+                     'hit_rate': round(backend.hits / lookups, 4) if lookups else None}
+    return jsonify({'responses': responses, 'fragments': fragments.stats() if fragments else None})
+
+
+@doctor.route('/doctor/view/<int:patient_id>')
+@login_required
+@audit_log.audited('view_record', lambda patient_id: patient_id)
+@care_team.requires_patient(lambda patient_id: patient_id)
+@cache.cached(lambda patient_id: [patient_key(patient_id), care_team_key(current_user.id)], html=True)
+@read_replica
+def view_patient(patient_id):
     patient = User.query.get_or_404(patient_id)
     if (patient.role or '').strip().lower() != 'patient':
         abort(404)
 
     profile = PatientProfile.query.filter_by(user_id=patient.id).first()
-    medicines = Medicine.query.filter_by(patient_id=patient.id).all()
-    vitals = Vitals.query.filter_by(patient_id=patient.id).order_by(Vitals.timestamp.desc()).all()
-    files = MedicalFile.query.filter_by(patient_id=patient.id).all()
+    # loaded only if the {% cache %} fragments that use them are not stored yet
+    medicines = deferred(Medicine.query.filter_by(patient_id=patient.id).all)
+    vitals = deferred(lambda: vitals_for(patient.id)[::-1])
+    files = deferred(MedicalFile.query.filter_by(patient_id=patient.id).all)
+    # the stats fragment counts the whole history itself, whatever range `vitals` covers
 
-    return render_template('patient_view.html', patient=patient, profile=profile, medicines=medicines, vitals=vitals, files=files)
+    return render_template('patient_view.html', patient=patient, profile=profile, medicines=medicines, vitals=vitals,
+                           files=files, vitals_count=partial(vitals_count, patient.id))
 
 
 @doctor.route('/doctor/update_profile/<int:patient_id>', methods=['POST'])
 @login_required
+@audit_log.audited('update_profile', lambda patient_id: patient_id)
 def update_patient_profile(patient_id):
-    if not is_doctor():
-        abort(403)
+    care_team.require_patient(patient_id)
     patient = User.query.get_or_404(patient_id)
     if (patient.role or '').strip().lower() != 'patient':
         abort(404)
@@ -63,6 +116,7 @@ def update_patient_profile(patient_id):
     profile.allergies = allergies
     profile.health_history = health_history
     db.session.commit()
+    cache.bump(patient_key(patient_id))
 
     flash('Patient profile updated.', 'success')
     return redirect(url_for('doctor.view_patient', patient_id=patient_id))
@@ -70,9 +124,9 @@ def update_patient_profile(patient_id):
 
 @doctor.route('/doctor/add_medicine/<int:patient_id>', methods=['POST'])
 @login_required
+@audit_log.audited('add_medicine', lambda patient_id: patient_id)
 def add_patient_medicine(patient_id):
-    if not is_doctor():
-        abort(403)
+    care_team.require_patient(patient_id)
     patient = User.query.get_or_404(patient_id)
 
     name = request.form.get('name', '').strip()
@@ -84,7 +138,10 @@ def add_patient_medicine(patient_id):
 
     med = Medicine(patient_id=patient.id, name=name, dosage=dosage)
     db.session.add(med)
+    summary.adjust_counts(patient.id, medicines=1)
     db.session.commit()
+    cache.bump(patient_key(patient_id))
+    medications.note_name(name)
 
     flash('Medicine added.', 'success')
     return redirect(url_for('doctor.view_patient', patient_id=patient_id))
@@ -96,9 +153,14 @@ def delete_patient_medicine(med_id):
     if not is_doctor():
         abort(403)
     med = Medicine.query.get_or_404(med_id)
-    patient_id = med.patient_id
+    patient_id, name = med.patient_id, med.name
+    care_team.require_patient(patient_id)
     db.session.delete(med)
+    summary.adjust_counts(patient_id, medicines=-1)
     db.session.commit()
+    cache.bump(patient_key(patient_id))
+    medications.forget_name(name)
+    audit_log.record('delete_medicine', patient_id, target=med_id)
 
     flash('Medicine removed.', 'info')
     return redirect(url_for('doctor.view_patient', patient_id=patient_id))
@@ -106,9 +168,9 @@ def delete_patient_medicine(med_id):
 
 @doctor.route('/doctor/add_vital/<int:patient_id>', methods=['POST'])
 @login_required
+@audit_log.audited('add_vital', lambda patient_id: patient_id)
 def add_patient_vital(patient_id):
-    if not is_doctor():
-        abort(403)
+    care_team.require_patient(patient_id)
     patient = User.query.get_or_404(patient_id)
 
     v_type = request.form.get('type', 'bp')
@@ -129,7 +191,9 @@ def add_patient_vital(patient_id):
 
     vital = Vitals(patient_id=patient.id, type=v_type, value1=value1, value2=value2 or None, timestamp=datetime.utcnow())
     db.session.add(vital)
+    summary.record_vitals(patient.id, [(v_type, value1, value2, vital.timestamp)])
     db.session.commit()
+    cache.bump(patient_key(patient_id))
 
     flash('Vital added.', 'success')
     return redirect(url_for('doctor.view_patient', patient_id=patient_id))
@@ -142,8 +206,12 @@ def delete_patient_vital(vital_id):
         abort(403)
     vital = Vitals.query.get_or_404(vital_id)
     patient_id = vital.patient_id
+    care_team.require_patient(patient_id)
     db.session.delete(vital)
+    summary.vital_removed(patient_id, vital)
     db.session.commit()
+    cache.bump(patient_key(patient_id))
+    audit_log.record('delete_vital', patient_id, target=vital_id)
 
     flash('Vital removed.', 'info')
     return redirect(url_for('doctor.view_patient', patient_id=patient_id))
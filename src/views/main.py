@@ -1,22 +1,41 @@
 from flask import Blueprint, render_template, request, jsonify, abort, current_app, send_from_directory, url_for, redirect, flash
 from flask_login import login_required, current_user
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 from uuid import uuid4
 
 from src.models.user import Vitals, MedicalFile, PatientProfile, Medicine, Appointment, User
-from src.extensions import db
+from src.extensions import db, cache
+from sqlalchemy.exc import IntegrityError
+from src.importer import parse_numeric, parse_timestamp, import_vitals, detect_format
+from src import summary
+from src.archive import vitals_for, archived_vitals, requested_range
+from src.audit import audit_log
+from src import medications, images, care_team, storage
+from src.database import read_replica
+from src.cache import patient_key, care_team_key
+from src.fragments import deferred
+from src import fastjson
+from sqlalchemy import select
 from src.forms import ProfileForm, MedicineForm
 from werkzeug.utils import secure_filename
 from src.models.user import User
 import io
 from flask import send_file
-from openpyxl import Workbook
-from reportlab.pdfgen import canvas
 from io import BytesIO as _BytesIO
 
 main = Blueprint('main', __name__)
 
+VITAL_JSON_FIELDS = ('id', 'type', 'value1', 'value2', 'timestamp')
+
+
+def patient_arg(patient_id):
+    # ?patient_id= as an int; anything else is a bad request, not a server error
+    try:
+        return int(patient_id)
+    except (TypeError, ValueError):
+        abort(400)
+
 
 @main.route('/')
 def index():
@@ -31,7 +50,7 @@ def dashboard():
         return redirect(url_for('doctor.dashboard'))
 
     # pass current_user and their files to the template so dashboard can display user info and uploads
-    files = MedicalFile.query.filter_by(patient_id=current_user.id).order_by(MedicalFile.upload_timestamp.desc()).all()
+    files = deferred(MedicalFile.query.filter_by(patient_id=current_user.id).order_by(MedicalFile.upload_timestamp.desc()).all)
     # provide empty forms for CSRF tokens and rendering
     from src.forms import ProfileForm, MedicineForm
     profile_form = ProfileForm()
@@ -62,36 +81,207 @@ def add_vital():
 
     vital = Vitals(patient_id=current_user.id, type=v_type, value1=value1, value2=value2, timestamp=datetime.utcnow())
     db.session.add(vital)
+    summary.record_vitals(current_user.id, [(v_type, value1, value2, vital.timestamp)])
     db.session.commit()
+    cache.bump(patient_key(current_user.id))
 
     return jsonify({'status': 'ok', 'id': vital.id, 'timestamp': vital.timestamp.isoformat()})
 
 
-@main.route('/api/get_vitals')
+def validate_vital_batch(items, now):
+    # returns (rows, results): rows are insert mappings aligned with the
+    # indexes in results that are still pending (status None)
+    results = []
+    rows = []
+    value1s = parse_numeric([i.get('value1') if isinstance(i, dict) else None for i in items])
+    value2s = parse_numeric([i.get('value2') if isinstance(i, dict) else None for i in items])
+    for idx, item in enumerate(items):
+        result = {'index': idx, 'key': None, 'status': None}
+        results.append(result)
+        if not isinstance(item, dict):
+            result.update(status='error', error='Reading must be an object')
+            continue
+        key = item.get('idempotency_key')
+        result['key'] = key
+        if key is not None and (not isinstance(key, str) or not 0 < len(key) <= 64):
+            result.update(status='error', error='idempotency_key must be a string of at most 64 characters')
+            continue
+        if not item.get('type') or item.get('value1') in (None, ''):
+            result.update(status='error', error='Missing required fields')
+            continue
+        if value1s[idx] is None or (item.get('value2') not in (None, '') and value2s[idx] is None):
+            result.update(status='error', error='Vital values must be numeric')
+            continue
+        ts = now
+        if item.get('timestamp'):
+            try:
+                ts = parse_timestamp(item['timestamp'])
+            except ValueError:
+                result.update(status='error', error='Invalid timestamp')
+                continue
+            if ts > now + timedelta(minutes=5):
+                result.update(status='error', error='Timestamp is in the future')
+                continue
+        rows.append({
+            'patient_id': current_user.id,
+            'type': str(item['type']),
+            'value1': str(item['value1']),
+            'value2': str(item.get('value2') or ''),
+            'timestamp': ts,
+            'client_key': key,
+            '_index': idx,
+        })
+    return rows, results
+
+
+def _reading_ids(patient_id, rows):
+    # (type, timestamp) -> id of the patient's stored readings at the rows' timestamps
+    if not rows:
+        return {}
+    return {(v_type, ts): vid for vid, v_type, ts in db.session.query(Vitals.id, Vitals.type, Vitals.timestamp).filter(
+        Vitals.patient_id == patient_id, Vitals.timestamp.in_({r['timestamp'] for r in rows}))}
+
+
+@main.route('/api/vitals/batch', methods=['POST'])
 @login_required
-def get_vitals():
-    # Optional query parameter `patient_id` for doctors to view other patients
+def add_vitals_batch():
+    # Offline sync: the PWA replays everything it recorded in one request.
+    # {"readings": [{"idempotency_key": "...", "type": "bp", "value1": "120", "value2": "80", "timestamp": "..."}]}
+    payload = request.get_json(silent=True)
+    items = payload.get('readings') if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Expected a non-empty list of readings'}), 400
+    if len(items) > current_app.config.get('VITALS_BATCH_MAX', 500):
+        return jsonify({'error': 'Too many readings in one batch'}), 413
+
+    rows, results = validate_vital_batch(items, datetime.utcnow())
+
+    # two attempts: a concurrent replay of the same batch can win a unique
+    # constraint between our duplicate check and the insert
+    for attempt in range(2):
+        keys = [r['client_key'] for r in rows if r['client_key']]
+        by_key = {}
+        if keys:
+            by_key = dict(db.session.query(Vitals.client_key, Vitals.id).filter(
+                Vitals.patient_id == current_user.id, Vitals.client_key.in_(keys)).all())
+        # a reading already stored for the same type and instant is a duplicate as well
+        by_reading = _reading_ids(current_user.id, rows)
+        to_insert = []
+        queued = {}  # idempotency key or (type, timestamp) -> row queued in this batch
+        in_batch = []
+        for r in rows:
+            res = results[r['_index']]
+            key, reading = r['client_key'], (r['type'], r['timestamp'])
+            if (key and key in by_key) or reading in by_reading:
+                res.update(status='duplicate', id=by_key[key] if key in by_key else by_reading[reading])
+                continue
+            first = (queued.get(key) if key else None) or queued.get(reading)
+            if first:
+                res.update(status='duplicate', id=None)
+                in_batch.append((res, first))
+                continue
+            if key:
+                queued[key] = r
+            queued[reading] = r
+            res['status'] = None
+            to_insert.append(r)
+        if not to_insert:
+            break
+        try:
+            # one executemany and a single commit for the whole batch; ids are
+            # looked up by (type, timestamp), which identifies a reading
+            db.session.execute(Vitals.__table__.insert(),
+                               [{k: v for k, v in r.items() if k not in ('_index', 'id')} for r in to_insert])
+            ids = _reading_ids(current_user.id, to_insert)
+            for r in to_insert:
+                r['id'] = ids[(r['type'], r['timestamp'])]
+            summary.record_vitals(current_user.id, [(r['type'], r['value1'], r['value2'], r['timestamp']) for r in to_insert])
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            if attempt:
+                raise
+            continue
+        break
+
+    inserted = [r for r in rows if results[r['_index']]['status'] is None]
+    if inserted:
+        cache.bump(patient_key(current_user.id))
+    for r in inserted:
+        results[r['_index']].update(status='created', id=r['id'], timestamp=r['timestamp'].isoformat())
+    # in-batch duplicates point at the row created for the first copy
+    for res, first in in_batch:
+        res['id'] = first.get('id')
+
+    return jsonify({
+        'created': sum(1 for r in results if r['status'] == 'created'),
+        'duplicates': sum(1 for r in results if r['status'] == 'duplicate'),
+        'errors': sum(1 for r in results if r['status'] == 'error'),
+        'results': results,
+    })
+
+
+@main.route('/api/vitals/import', methods=['POST'])
+@login_required
+def import_vitals_file():
+    # Streaming import of device exports: raw NDJSON/CSV body or a multipart `file`,
+    # up to IMPORT_MAX_CONTENT_LENGTH (see src/importer.py).
+    # Doctors may import for a patient via ?patient_id=
     patient_id = request.args.get('patient_id')
     if patient_id:
-        # only doctors can request other patients
         if (current_user.role or '').strip().lower() != 'doctor':
             abort(403)
-        pid = int(patient_id)
+        patient = User.query.get(patient_arg(patient_id))
+        if not patient or (patient.role or '').strip().lower() != 'patient':
+            abort(404)
+        care_team.require_patient(patient.id)
+        pid = patient.id
     else:
         pid = current_user.id
 
-    vitals = Vitals.query.filter_by(patient_id=pid).order_by(Vitals.timestamp.asc()).all()
-    data = [
-        {
-            'id': v.id,
-            'type': v.type,
-            'value1': v.value1,
-            'value2': v.value2,
-            'timestamp': v.timestamp.isoformat()
-        }
-        for v in vitals
-    ]
-    return jsonify(data)
+    upload = request.files.get('file')
+    if upload:
+        lines, name = upload.stream, upload.filename
+    else:
+        lines, name = request.stream, ''
+        if request.mimetype == 'text/csv':
+            name = 'upload.csv'
+    report = import_vitals(pid, lines, detect_format(name, request.args.get('format')),
+                           current_app.config.get('IMPORT_CHUNK_SIZE', 1000))
+    return jsonify(report.as_dict())
+
+
+@main.route('/api/get_vitals')
+@login_required
+@audit_log.audited('view_vitals', lambda: request.args.get('patient_id'))
+# only doctors can request other patients, and only from their care team
+@care_team.requires_patient(lambda: patient_arg(request.args['patient_id']) if request.args.get('patient_id') else None)
+@cache.cached(lambda: [patient_key(request.args.get('patient_id') or current_user.id), care_team_key(current_user.id)])
+@read_replica
+def get_vitals():
+    # Optional query parameter `patient_id` for doctors to view their patients
+    patient_id = request.args.get('patient_id')
+    pid = patient_arg(patient_id) if patient_id else current_user.id
+
+    # optional ISO ?since= / ?until= range (default: everything); archived readings are
+    # included when it reaches back
+    try:
+        since, until = requested_range(request.args)
+    except ValueError:
+        return jsonify({'error': 'since/until must be ISO dates'}), 400
+
+    # plain columns, oldest first, merged with any archived readings in range
+    stmt = select(Vitals.id, Vitals.type, Vitals.value1, Vitals.value2, Vitals.timestamp).where(Vitals.patient_id == pid)
+    if since is not None:
+        stmt = stmt.where(Vitals.timestamp >= since)
+    if until is not None:
+        stmt = stmt.where(Vitals.timestamp <= until)
+    rows = fastjson.query_rows(stmt.order_by(Vitals.timestamp, Vitals.id))
+    archived = [{k: row[k] for k in VITAL_JSON_FIELDS} for row in archived_vitals(pid, since, until)]
+    if archived:
+        rows = fastjson.merge_rows(archived, rows)
+    # ?stream=1 sends the array in chunks as it is read (never stored in the response cache)
+    return fastjson.json_array(rows, stream=request.args.get('stream') in ('1', 'true'))
 
 
 # ---------------- File upload routes ----------------
@@ -121,6 +311,10 @@ def allowed_file(filename, mimetype):
 @main.route('/upload_file', methods=['POST'])
 @login_required
 def upload_file():
+    # refuse before the body is parsed when the declared size cannot fit the quota
+    over_quota = storage.precheck_request(current_user.id)
+    if over_quota:
+        return jsonify(over_quota), 413
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     file = request.files['file']
@@ -167,16 +361,27 @@ def upload_file():
             except Exception:
                 return jsonify({'error': 'Invalid image file'}), 400
 
+    # claim the space first; the row holding the total stays locked until the commit below
+    over_quota = storage.reserve(current_user.id, len(data))
+    if over_quota:
+        return jsonify(over_quota), 413
+
     # Persist bytes to disk
     try:
         with open(save_path, 'wb') as fh:
             fh.write(data)
     except Exception:
+        db.session.rollback()
         return jsonify({'error': 'Failed to save file'}), 500
 
-    mf = MedicalFile(patient_id=current_user.id, original_filename=filename, storage_filename=storage_name)
+    mf = MedicalFile(patient_id=current_user.id, original_filename=filename, storage_filename=storage_name,
+                     size_bytes=len(data), original_size_bytes=len(data))
     db.session.add(mf)
+    summary.adjust_counts(current_user.id, files=1)
     db.session.commit()
+    cache.bump(patient_key(current_user.id))
+    # photos are normalized and recompressed in the background
+    images.optimize_upload(mf)
 
     return jsonify({'status': 'ok', 'file_id': mf.id, 'original_filename': mf.original_filename})
 
@@ -185,12 +390,48 @@ def upload_file():
 @login_required
 def download_file(file_id):
     mf = MedicalFile.query.get_or_404(file_id)
-    # allow owner or doctor to download
-    if mf.patient_id != current_user.id and (current_user.role or '').strip().lower() != 'doctor':
-        abort(403)
+    # allow owner or one of the patient's doctors to download
+    if mf.patient_id != current_user.id:
+        care_team.require_patient(mf.patient_id)
+    if mf.patient_id != current_user.id:
+        audit_log.record('download_file', mf.patient_id, target=file_id)
 
-    upload_folder = current_app.config.get('UPLOAD_FOLDER')
-    return send_from_directory(upload_folder, mf.storage_filename, as_attachment=True, attachment_filename=mf.original_filename)
+    # uploads are stored per user (see upload_file)
+    user_folder = os.path.join(current_app.config.get('UPLOAD_FOLDER'), f'user_{mf.patient_id}')
+    return send_from_directory(user_folder, mf.storage_filename, as_attachment=True, download_name=mf.original_filename)
+
+
+@main.route('/delete_file/<int:file_id>', methods=['POST'])
+@login_required
+def delete_file(file_id):
+    mf = MedicalFile.query.get_or_404(file_id)
+    # the owner or one of the patient's doctors
+    if mf.patient_id != current_user.id:
+        care_team.require_patient(mf.patient_id)
+    patient_id = mf.patient_id
+    relpath = os.path.join(f'user_{patient_id}', mf.storage_filename)
+    path = os.path.join(current_app.config.get('UPLOAD_FOLDER'), relpath)
+    # the untouched copy kept by image optimization (src/images.py), if any
+    originals = current_app.config.get('IMAGE_ORIGINALS_FOLDER')
+    original = os.path.join(originals, relpath) if originals else None
+    db.session.delete(mf)
+    summary.adjust_counts(patient_id, files=-1, storage_bytes=-(mf.size_bytes or 0))
+    db.session.commit()
+    cache.bump(patient_key(patient_id))
+    if patient_id != current_user.id:
+        audit_log.record('delete_file', patient_id, target=file_id)
+    # bytes go only once the row is gone, so a failed commit never leaves a broken link
+    try:
+        os.remove(path)
+    except OSError:
+        current_app.logger.warning('Could not remove %s', path)
+    if original and os.path.exists(original):
+        try:
+            os.remove(original)
+        except OSError:
+            current_app.logger.warning('Could not remove %s', original)
+    flash('File deleted.', 'info')
+    return redirect(url_for('main.dashboard'))
 
 
 @main.route('/update_profile', methods=['GET', 'POST'])
@@ -214,6 +455,7 @@ def update_profile():
             profile.health_history = health_history
 
         db.session.commit()
+        cache.bump(patient_key(current_user.id))
         flash('Profile updated successfully.', 'success')
         return redirect(url_for('main.dashboard'))
 
@@ -239,46 +481,73 @@ def add_medicine():
         dosage = form.dosage.data.strip() if form.dosage.data else ''
         med = Medicine(patient_id=current_user.id, name=name, dosage=dosage)
         db.session.add(med)
+        summary.adjust_counts(current_user.id, medicines=1)
         db.session.commit()
+        cache.bump(patient_key(current_user.id))
+        medications.note_name(name)
         flash('Medicine added.', 'success')
         return redirect(url_for('main.dashboard'))
     flash('Invalid medicine data.', 'danger')
     return redirect(url_for('main.dashboard'))
 
 
+@main.route('/api/medications/suggest')
+@login_required
+def suggest_medications():
+    # ?q=<prefix>[&limit=10]; answered from the in-memory index, never the database
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 25)
+    resp = jsonify(medications.get_index().suggest(request.args.get('q', ''), limit))
+    resp.headers['Cache-Control'] = 'private, max-age=300'
+    return resp
+
+
 @main.route('/delete_medicine/<int:med_id>', methods=['POST'])
 @login_required
 def delete_medicine(med_id):
     med = Medicine.query.get_or_404(med_id)
-    # Only owner patient or a doctor may delete
-    if med.patient_id != current_user.id and (current_user.role or '').strip().lower() != 'doctor':
-        abort(403)
+    # Only owner patient or one of their doctors may delete
+    if med.patient_id != current_user.id:
+        care_team.require_patient(med.patient_id)
+    patient_id, name = med.patient_id, med.name
     db.session.delete(med)
+    summary.adjust_counts(patient_id, medicines=-1)
     db.session.commit()
+    cache.bump(patient_key(patient_id))
+    medications.forget_name(name)
+    if patient_id != current_user.id:
+        audit_log.record('delete_medicine', patient_id, target=med_id)
     flash('Medicine removed.', 'info')
     return redirect(url_for('main.dashboard'))
 
 
 @main.route('/export_excel')
 @login_required
+@audit_log.audited('export_excel', lambda: request.args.get('patient_id'))
+@read_replica
 def export_excel():
     # allow doctors to export for a given patient via ?patient_id=
     patient_id = request.args.get('patient_id')
     if patient_id:
         if (current_user.role or '').strip().lower() != 'doctor':
             abort(403)
-        pid = int(patient_id)
+        pid = patient_arg(patient_id)
         # verify patient exists and is actually a patient
         patient = User.query.get(pid)
         if not patient or (patient.role or '').strip().lower() != 'patient':
             abort(404)
+        care_team.require_patient(pid)
     else:
         pid = current_user.id
 
     profile = PatientProfile.query.filter_by(user_id=pid).first()
     medicines = Medicine.query.filter_by(patient_id=pid).all()
-    vitals = Vitals.query.filter_by(patient_id=pid).order_by(Vitals.timestamp.asc()).all()
+    try:
+        vitals = vitals_for(pid, *requested_range(request.args))
+    except ValueError:
+        return jsonify({'error': 'since/until must be ISO dates'}), 400
 
+    # imported on first export; openpyxl is slow to import and most workers never need it
+    from openpyxl import Workbook
     wb = Workbook()
     # Profile sheet
     ps = wb.active
@@ -313,23 +582,31 @@ def export_excel():
 
 @main.route('/export_pdf')
 @login_required
+@audit_log.audited('export_pdf', lambda: request.args.get('patient_id'))
+@read_replica
 def export_pdf():
     # allow doctors to export for a given patient via ?patient_id=
     patient_id = request.args.get('patient_id')
     if patient_id:
         if (current_user.role or '').strip().lower() != 'doctor':
             abort(403)
-        pid = int(patient_id)
+        pid = patient_arg(patient_id)
         # verify patient exists and is actually a patient
         patient = User.query.get(pid)
         if not patient or (patient.role or '').strip().lower() != 'patient':
             abort(404)
+        care_team.require_patient(pid)
     else:
         pid = current_user.id
 
     profile = PatientProfile.query.filter_by(user_id=pid).first()
-    vitals = Vitals.query.filter_by(patient_id=pid).order_by(Vitals.timestamp.asc()).all()
+    try:
+        vitals = vitals_for(pid, *requested_range(request.args))
+    except ValueError:
+        return jsonify({'error': 'since/until must be ISO dates'}), 400
 
+    # imported on first export to keep worker start-up fast
+    from reportlab.pdfgen import canvas
     bio = io.BytesIO()
     p = canvas.Canvas(bio)
     user_obj = User.query.get(pid)
@@ -81,4 +81,37 @@ def app():
 
 @pytest.fixture
 def client(app):
-    return app.test_client()
\ No newline at end of file
+    return app.test_client()
+
+
+@pytest.fixture
+def users():
+    # Factory for test accounts, all with the password 'password'. Call it inside
+    # an app context with (username, role) pairs (default: patient1 and doctor1);
+    # it returns their ids in the same order. care_team=True puts every doctor
+    # of the call on every patient's care team.
+    from src.extensions import db
+    from src.models.user import User, CareTeamMember
+
+    def create(*specs, care_team=False):
+        created = []
+        for username, role in specs or (('patient1', 'patient'), ('doctor1', 'doctor')):
+            user = User(username=username, role=role)
+            user.set_password('password')
+            created.append(user)
+        db.session.add_all(created)
+        db.session.commit()
+        if care_team:
+            db.session.add_all([CareTeamMember(doctor_id=d.id, patient_id=p.id)
+                                for d in created if d.role == 'doctor' for p in created if p.role == 'patient'])
+            db.session.commit()
+        return [user.id for user in created]
+    return create
+
+
+@pytest.fixture
+def login():
+    # login(client, username) signs a test client in through the real form
+    def log_in(client, username, password='password'):
+        return client.post('/login', data={'username': username, 'password': password}, follow_redirects=True)
+    return log_in
\ No newline at end of file
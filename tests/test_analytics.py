@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+from src.analytics import cohort_risk
+from src.extensions import db
+from src.models.user import Vitals
+
+
+def add_readings(patient_id, v_type, values, start):
+    for i, v in enumerate(values):
+        v1, v2 = v if isinstance(v, tuple) else (v, None)
+        db.session.add(Vitals(patient_id=patient_id, type=v_type, value1=str(v1), value2=str(v2) if v2 else '',
+                              timestamp=start + timedelta(days=i)))
+    db.session.commit()
+
+
+def test_cohort_risk_flags_and_ranks_patients(app, users):
+    start = datetime.utcnow() - timedelta(days=10)
+    with app.app_context():
+        healthy, hyper, quiet = users(('healthy', 'patient'), ('hyper', 'patient'), ('quiet', 'patient'))
+        add_readings(healthy, 'bp', [(118, 76), (121, 79), (119, 77)], start)
+        add_readings(healthy, 'sugar', [95, 99, 'n/a'], start)
+        add_readings(hyper, 'bp', [(135, 88), (145, 92), (150, 95), (155, 97)], start)
+        # readings outside the window are ignored
+        add_readings(hyper, 'sugar', [300], start - timedelta(days=200))
+
+        rows = cohort_risk([(healthy, 'healthy'), (hyper, 'hyper'), (quiet, 'quiet')], window_days=90, rolling=3)
+
+    assert [r['username'] for r in rows] == ['hyper', 'healthy', 'quiet']
+    top = rows[0]
+    assert top['flags'] == ['systolic high', 'diastolic high']
+    assert top['metrics']['systolic']['latest'] == 155
+    assert top['metrics']['systolic']['mean'] == 150
+    assert top['metrics']['systolic']['out_of_range'] == 3
+    assert top['metrics']['systolic']['trend_per_day'] > 0
+    assert 'glucose' not in top['metrics']
+
+    assert rows[1]['flags'] == [] and rows[1]['score'] == 0
+    assert rows[1]['metrics']['glucose']['readings'] == 2
+    assert rows[2]['metrics'] == {}
+
+
+def test_risk_panel_endpoint_requires_doctor(client, app, users, login):
+    with app.app_context():
+        patient, _ = users(care_team=True)
+        # not on doctor1's care team, so never in the panel
+        users(('patient2', 'patient'))
+        add_readings(patient, 'sugar', [140, 150], datetime.utcnow() - timedelta(days=2))
+
+    login(client, 'patient1')
+    assert client.get('/api/doctor/risk').status_code == 403
+    client.get('/logout')
+
+    login(client, 'doctor1')
+    data = client.get('/api/doctor/risk?flagged=1').get_json()
+    assert [(r['username'], r['flags']) for r in data] == [('patient1', ['glucose high'])]
+    assert [r['username'] for r in client.get('/api/doctor/risk').get_json()] == ['patient1']
@@ -0,0 +1,197 @@
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from src.extensions import db
+from src.models.user import Appointment
+
+
+def test_overlapping_request_is_rejected(client, app, users, login):
+    with app.app_context():
+        patient_id, doctor_id = users()
+
+    login(client, 'patient1')
+    # 2030-01-07 is a Monday
+    client.post('/request_appointment', data={'doctor_id': doctor_id, 'start_time': '2030-01-07T10:00', 'duration': 30})
+    client.post('/request_appointment', data={'doctor_id': doctor_id, 'start_time': '2030-01-07T10:15', 'duration': 30})
+    client.post('/request_appointment', data={'doctor_id': doctor_id, 'start_time': '2030-01-07T10:30', 'duration': 30})
+
+    with app.app_context():
+        apps = Appointment.query.filter_by(doctor_id=doctor_id).order_by(Appointment.start_time).all()
+        assert [a.start_time for a in apps] == [datetime(2030, 1, 7, 10, 0), datetime(2030, 1, 7, 10, 30)]
+        assert apps[0].end_time == datetime(2030, 1, 7, 10, 30)
+
+
+
+def test_duration_limit_and_legacy_rows_without_end_time(client, app, users, login):
+    app.config['APPOINTMENT_MAX_MINUTES'] = 360
+    with app.app_context():
+        patient_id, doctor_id = users()
+        # written before end_time existed
+        db.session.add(Appointment(patient_id=patient_id, doctor_id=doctor_id, start_time=datetime(2030, 1, 7, 9, 0),
+                                   status='confirmed'))
+        db.session.commit()
+        db.session.execute(Appointment.__table__.update().values(end_time=None))
+        db.session.commit()
+
+    login(client, 'patient1')
+    # overlaps the legacy booking's default 30 minutes
+    client.post('/request_appointment', data={'doctor_id': doctor_id, 'start_time': '2030-01-07T09:15', 'duration': 30})
+    # longer than the old hard-coded 240, within APPOINTMENT_MAX_MINUTES
+    client.post('/request_appointment', data={'doctor_id': doctor_id, 'start_time': '2030-01-07T10:00', 'duration': 300})
+    client.post('/request_appointment', data={'doctor_id': doctor_id, 'start_time': '2030-01-08T10:00', 'duration': 400})
+
+    with app.app_context():
+        apps = Appointment.query.filter_by(doctor_id=doctor_id).order_by(Appointment.start_time).all()
+        assert [(a.start_time.hour, a.duration_minutes) for a in apps] == [(9, 30), (10, 300)]
+
+def test_free_slots_skip_booked_intervals(client, app, users, login):
+    with app.app_context():
+        patient_id, doctor_id = users()
+        db.session.add(Appointment(patient_id=patient_id, doctor_id=doctor_id, start_time=datetime(2030, 1, 7, 9, 30),
+                                   duration_minutes=60, end_time=datetime(2030, 1, 7, 10, 30), status='confirmed'))
+        # cancelled appointments do not block the calendar
+        db.session.add(Appointment(patient_id=patient_id, doctor_id=doctor_id, start_time=datetime(2030, 1, 7, 11, 0),
+                                   duration_minutes=30, end_time=datetime(2030, 1, 7, 11, 30), status='cancelled'))
+        db.session.commit()
+
+    login(client, 'patient1')
+    r = client.get(f'/api/doctors/{doctor_id}/free_slots?start=2030-01-07T09:00&end=2030-01-07T12:00&duration=30')
+    assert r.status_code == 200
+    starts = [s['start'][11:16] for s in r.get_json()['slots']]
+    assert starts == ['09:00', '10:30', '11:00', '11:30']
+
+    # weekends are outside working days
+    r = client.get(f'/api/doctors/{doctor_id}/free_slots?start=2030-01-05&end=2030-01-07')
+    assert r.get_json()['slots'] == []
+
+    r = client.get(f'/api/doctors/{doctor_id}/free_slots?start=2030-01-01&end=2030-06-01')
+    assert r.status_code == 400
+
+
+def add_appointment(patient_id, doctor_id, start, status='confirmed'):
+    a = Appointment(patient_id=patient_id, doctor_id=doctor_id, start_time=start, duration_minutes=30,
+                    end_time=start + timedelta(minutes=30), status=status)
+    db.session.add(a)
+    db.session.commit()
+    return a.id
+
+
+def test_calendar_api_returns_only_requested_window(client, app, users, login):
+    with app.app_context():
+        patient_id, doctor_id = users()
+        add_appointment(patient_id, doctor_id, datetime(2030, 1, 7, 10, 0))
+        add_appointment(patient_id, doctor_id, datetime(2030, 1, 9, 10, 0))
+        add_appointment(patient_id, doctor_id, datetime(2030, 2, 1, 10, 0))
+
+    login(client, 'doctor1')
+    r = client.get('/api/doctor/calendar?view=day&date=2030-01-07')
+    assert [a['start'] for a in r.get_json()['appointments']] == ['2030-01-07T10:00:00']
+    r = client.get('/api/doctor/calendar?view=week&date=2030-01-09')
+    assert len(r.get_json()['appointments']) == 2
+    assert r.get_json()['start'] == '2030-01-07T00:00:00'
+    r = client.get('/api/doctor/calendar?view=month&date=2030-01-20')
+    assert len(r.get_json()['appointments']) == 2
+
+    r = client.get('/doctor/appointments?view=month&date=2030-02-01')
+    assert r.status_code == 200
+    assert b'2030-02-01 10:00' in r.data
+    assert b'2030-01-07 10:00' not in r.data
+
+
+def test_ical_feed_streams_events_and_honours_etag(client, app, users):
+    from src.views.appointments import feed_serializer
+    with app.app_context():
+        patient_id, doctor_id = users()
+        add_appointment(patient_id, doctor_id, datetime(2030, 1, 7, 10, 0))
+        app_id = add_appointment(patient_id, doctor_id, datetime(2030, 1, 8, 10, 0), status='pending')
+        with app.test_request_context():
+            token = feed_serializer().dumps(doctor_id)
+
+    r = client.get(f'/calendar/{token}.ics')
+    assert r.status_code == 200
+    assert r.mimetype == 'text/calendar'
+    body = r.get_data(as_text=True)
+    assert body.count('BEGIN:VEVENT') == 2
+    assert 'DTSTART:20300107T100000' in body
+    assert 'SUMMARY:Appointment with patient1' in body
+    etag = r.headers['ETag']
+
+    r = client.get(f'/calendar/{token}.ics', headers={'If-None-Match': etag})
+    assert r.status_code == 304
+
+    with app.app_context():
+        Appointment.query.get(app_id).status = 'cancelled'
+        db.session.commit()
+    r = client.get(f'/calendar/{token}.ics', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert 'STATUS:CANCELLED' in r.get_data(as_text=True)
+
+    assert client.get('/calendar/bogus.ics').status_code == 404
+
+
+def test_times_with_utc_offset_are_rejected(client, app, users, login):
+    with app.app_context():
+        patient_id, doctor_id = users()
+
+    login(client, 'patient1')
+    r = client.get(f'/api/doctors/{doctor_id}/free_slots?start=2030-01-07T09:00%2B02:00&end=2030-01-07T12:00')
+    assert r.status_code == 400
+    client.post('/request_appointment', data={'doctor_id': doctor_id, 'start_time': '2030-01-07T10:00Z', 'duration': 30})
+    with app.app_context():
+        assert Appointment.query.count() == 0
+
+
+def test_concurrent_bookings_for_one_doctor_are_serialized(app, users, login):
+    from src.views.appointments import lock_doctor
+
+    with app.app_context():
+        patient_id, doctor_id = users()
+    other = app.test_client()
+    login(other, 'patient1')
+    results = []
+
+    with app.app_context():
+        # a booking in flight holds the doctor's lock ...
+        assert lock_doctor(doctor_id)
+        add = Appointment(patient_id=patient_id, doctor_id=doctor_id, start_time=datetime(2030, 1, 7, 10, 0),
+                          duration_minutes=30, end_time=datetime(2030, 1, 7, 10, 30), status='pending')
+        db.session.add(add)
+        # ... so a second request for the same slot waits for it instead of passing find_conflicts
+        t = threading.Thread(target=lambda: results.append(other.post('/request_appointment', data={
+            'doctor_id': doctor_id, 'start_time': '2030-01-07T10:15', 'duration': 30})))
+        t.start()
+        time.sleep(0.3)
+        db.session.commit()
+    t.join()
+
+    assert results[0].status_code == 302
+    with app.app_context():
+        assert Appointment.query.filter_by(doctor_id=doctor_id).count() == 1
+
+
+def test_feed_url_reset_revokes_the_old_token(client, app, users, login):
+    from src.views.appointments import feed_serializer
+    with app.app_context():
+        patient_id, doctor_id = users()
+        add_appointment(patient_id, doctor_id, datetime(2030, 1, 7, 10, 0))
+        with app.test_request_context():
+            legacy = feed_serializer().dumps(doctor_id)
+
+    login(client, 'doctor1')
+    page = client.get('/doctor/appointments').get_data(as_text=True)
+    token = re.search(r'/calendar/([^"<\s]+)\.ics', page).group(1)
+    assert client.get(f'/calendar/{token}.ics').status_code == 200
+    # URLs signed before nonces existed keep working until the first reset
+    assert client.get(f'/calendar/{legacy}.ics').status_code == 200
+
+    r = client.post('/doctor/appointments/reset_feed')
+    assert r.status_code == 302
+    assert client.get(f'/calendar/{token}.ics').status_code == 404
+    assert client.get(f'/calendar/{legacy}.ics').status_code == 404
+
+    page = client.get('/doctor/appointments').get_data(as_text=True)
+    new_token = re.search(r'/calendar/([^"<\s]+)\.ics', page).group(1)
+    assert new_token != token
+    assert client.get(f'/calendar/{new_token}.ics').status_code == 200
@@ -0,0 +1,128 @@
+import io
+import re
+from datetime import datetime, timedelta
+
+from openpyxl import load_workbook
+
+from src import archive
+from src.extensions import db
+from src.models.user import Vitals, ChatMessage, ArchiveSegment
+
+
+def test_archive_moves_cold_rows_and_reads_through(client, app, users, login):
+    now = datetime.utcnow()
+    old_a, old_b = now - timedelta(days=500), now - timedelta(days=440)
+    with app.app_context():
+        patient_id, doctor_id = users(care_team=True)
+        db.session.add_all([
+            Vitals(patient_id=patient_id, type='bp', value1='150', value2='95', timestamp=old_a),
+            Vitals(patient_id=patient_id, type='sugar', value1='140', value2='', timestamp=old_b),
+            Vitals(patient_id=patient_id, type='bp', value1='120', value2='80', timestamp=now),
+            ChatMessage(sender_id=doctor_id, receiver_id=patient_id, message_text='Old advice',
+                        timestamp=old_a, read_at=old_a),
+            ChatMessage(sender_id=doctor_id, receiver_id=patient_id, message_text='Never opened', timestamp=old_b),
+        ])
+        db.session.commit()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['archive'])
+    assert result.exit_code == 0, result.output
+    assert 'Archived 2 vitals for 1 patients' in result.output
+    assert 'Archived 1 chat messages from 1 conversations' in result.output
+    # incremental: nothing left to move on the next run
+    assert 'Archived 0 vitals' in runner.invoke(args=['archive']).output
+
+    with app.app_context():
+        assert Vitals.query.count() == 1
+        # unread messages stay hot
+        assert [m.message_text for m in ChatMessage.query.all()] == ['Never opened']
+        assert ArchiveSegment.query.filter_by(kind='vitals').count() == 2
+
+    login(client, 'patient1')
+    data = client.get('/api/get_vitals').get_json()
+    assert [v['value1'] for v in data] == ['150', '140', '120']
+    data = client.get(f'/api/get_vitals?since={(now - timedelta(days=450)).date().isoformat()}').get_json()
+    assert [v['value1'] for v in data] == ['140', '120']
+    data = client.get(f'/api/get_messages/{doctor_id}').get_json()
+    assert [m['text'] for m in data] == ['Old advice', 'Never opened']
+    assert client.get('/api/get_vitals?since=yesterday').status_code == 400
+    client.get('/logout')
+
+    login(client, 'doctor1')
+    r = client.get(f'/doctor/view/{patient_id}')
+    assert r.data.count(b'Archived') == 2
+    r = client.get(f'/export_excel?patient_id={patient_id}')
+    assert r.status_code == 200
+
+
+def test_defaults_read_through_and_later_ranges_skip_the_archive(client, app, monkeypatch, users, login):
+    now = datetime.utcnow()
+    with app.app_context():
+        patient_id, doctor_id = users(care_team=True)
+        db.session.add_all([
+            Vitals(patient_id=patient_id, type='bp', value1='150', value2='95', timestamp=now - timedelta(days=500)),
+            Vitals(patient_id=patient_id, type='bp', value1='130', value2='85', timestamp=now - timedelta(days=200)),
+            Vitals(patient_id=patient_id, type='bp', value1='120', value2='80', timestamp=now),
+            ChatMessage(sender_id=doctor_id, receiver_id=patient_id, message_text='Old advice',
+                        timestamp=now - timedelta(days=500), read_at=now - timedelta(days=500)),
+        ])
+        db.session.commit()
+    assert app.test_cli_runner().invoke(args=['archive']).exit_code == 0
+
+    login(client, 'doctor1')
+    # without a range: the whole history, hot readings not yet due for archival included
+    data = client.get(f'/api/get_vitals?patient_id={patient_id}').get_json()
+    assert [v['value1'] for v in data] == ['150', '130', '120']
+    book = load_workbook(io.BytesIO(client.get(f'/export_excel?patient_id={patient_id}').data))
+    assert [row[1] for row in book['Vitals'].iter_rows(min_row=2, values_only=True)] == ['150', '130', '120']
+    assert [m['text'] for m in client.get(f'/api/get_messages/{patient_id}').get_json()] == ['Old advice']
+
+    def no_decoding(payload):
+        raise AssertionError('archive segment decoded')
+    monkeypatch.setattr(archive, 'decode_rows', no_decoding)
+
+    # a range that starts after the newest archived reading does not open segments
+    since = (now - timedelta(days=300)).date().isoformat()
+    data = client.get(f'/api/get_vitals?patient_id={patient_id}&since={since}').get_json()
+    assert [v['value1'] for v in data] == ['130', '120']
+    assert client.get(f'/export_pdf?patient_id={patient_id}&since={since}').status_code == 200
+    assert client.get(f'/api/get_messages/{patient_id}?since={since}').get_json() == []
+
+
+def test_archive_moves_long_histories_in_chunks(app, users):
+    app.config['ARCHIVE_BATCH_SIZE'] = 3
+    start = datetime(2020, 3, 10)
+    with app.app_context():
+        patient_id, doctor_id = users(care_team=True)
+        db.session.add_all([Vitals(patient_id=patient_id, type='sugar', value1=str(100 + i), value2='',
+                                   timestamp=start + timedelta(hours=i)) for i in range(8)])
+        db.session.add_all([ChatMessage(sender_id=doctor_id, receiver_id=patient_id, message_text=f'm{i}',
+                                        timestamp=start + timedelta(hours=i), read_at=start) for i in range(4)])
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['archive'])
+    assert 'Archived 8 vitals for 1 patients' in result.output
+    assert 'Archived 4 chat messages from 1 conversations' in result.output
+    with app.app_context():
+        assert Vitals.query.count() == 0 and ChatMessage.query.count() == 0
+        assert ArchiveSegment.query.filter_by(kind='vitals').count() == 3
+        assert [v.value1 for v in archive.vitals_for(patient_id)] == [str(100 + i) for i in range(8)]
+        assert [m.message_text for m in archive.messages_between(patient_id, doctor_id)] == [f'm{i}' for i in range(4)]
+
+
+def test_patient_stats_count_archived_vitals(client, app, users, login):
+    now = datetime.utcnow()
+    with app.app_context():
+        patient_id, _ = users(care_team=True)
+        db.session.add_all([
+            Vitals(patient_id=patient_id, type='bp', value1='150', value2='95', timestamp=now - timedelta(days=500)),
+            Vitals(patient_id=patient_id, type='bp', value1='120', value2='80', timestamp=now),
+        ])
+        db.session.commit()
+    assert app.test_cli_runner().invoke(args=['archive']).exit_code == 0
+
+    login(client, 'doctor1')
+    page = client.get(f'/doctor/view/{patient_id}').data.decode()
+    assert re.search(r'Vitals recorded:</span>\s*<span class="font-medium">2</span>', page)
+    with app.app_context():
+        assert archive.vitals_count(patient_id) == 2
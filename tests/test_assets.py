@@ -0,0 +1,95 @@
+import gzip
+import os
+import re
+
+from src.assets import build_assets, set_manifest, _brotli
+from src.extensions import db
+from src.models.user import User, Vitals
+
+
+def make_static(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'js').mkdir()
+    (tmp_path / 'css' / 'site.css').write_text('body { color: #333; }\n' * 200)
+    (tmp_path / 'js' / 'tiny.js').write_text('x=1;')
+    return str(tmp_path)
+
+
+def test_build_assets_hashes_and_precompresses(tmp_path):
+    folder = make_static(tmp_path)
+    manifest = build_assets(folder)
+    assert set(manifest) == {'css/site.css', 'js/tiny.js'}
+    css = manifest['css/site.css']
+    assert css.startswith('dist/css/site.') and css.endswith('.css')
+    assert os.path.exists(os.path.join(folder, css + '.gz'))
+    if _brotli():
+        assert os.path.exists(os.path.join(folder, css + '.br'))
+    # tiny files are only copied
+    assert not os.path.exists(os.path.join(folder, manifest['js/tiny.js'] + '.gz'))
+    assert os.path.exists(os.path.join(folder, 'dist', 'precache.js'))
+
+    # rebuilding unchanged files yields the same fingerprints
+    assert build_assets(folder) == manifest
+
+
+def test_fingerprinted_assets_served_precompressed_and_immutable(client, app, tmp_path):
+    folder = make_static(tmp_path)
+    app.static_folder = folder
+    set_manifest(app, build_assets(folder))
+
+    with app.test_request_context():
+        from src.assets import asset_url
+        url = asset_url('css/site.css')
+        assert url.startswith('/static/dist/css/site.')
+        assert asset_url('css/unknown.css') == '/static/css/unknown.css'
+
+    r = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert r.status_code == 200
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert r.mimetype == 'text/css'
+    assert 'immutable' in r.headers['Cache-Control']
+    assert gzip.decompress(r.data).startswith(b'body {')
+
+    r = client.get(url)
+    assert 'Content-Encoding' not in r.headers
+    assert r.data.startswith(b'body {')
+
+    # the service worker loads precache.js by a fixed name, so it must never be cached as immutable
+    r = client.get('/static/dist/precache.js')
+    assert r.status_code == 200
+    assert 'immutable' not in r.headers['Cache-Control'] and 'no-cache' in r.headers['Cache-Control']
+    assert 'immutable' not in client.get('/static/dist/manifest.json').headers['Cache-Control']
+
+
+def test_large_json_responses_are_gzipped(client, app):
+    with app.app_context():
+        patient = User(username='patient1', role='patient')
+        patient.set_password('password')
+        db.session.add(patient)
+        db.session.commit()
+        db.session.add_all([Vitals(patient_id=patient.id, type='bp', value1='120', value2='80') for _ in range(50)])
+        db.session.commit()
+
+    client.post('/login', data={'username': 'patient1', 'password': 'password'})
+    r = client.get('/api/get_vitals', headers={'Accept-Encoding': 'gzip'})
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert len(gzip.decompress(r.data)) > 1024
+
+    r = client.get('/api/get_vitals')
+    assert 'Content-Encoding' not in r.headers
+    assert len(r.get_json()) == 50
+
+
+def test_html_with_csrf_token_is_not_compressed(client, app, users, login):
+    with app.app_context():
+        patient_id, _ = users(care_team=True)
+    login(client, 'doctor1')
+    # the first page shows the login flash, which bypasses the cache
+    client.get(f'/doctor/view/{patient_id}')
+
+    # rendered, then served from the response cache
+    for status in ('MISS', 'HIT'):
+        r = client.get(f'/doctor/view/{patient_id}', headers={'Accept-Encoding': 'gzip'})
+        assert r.headers['X-Cache'] == status
+        assert 'Content-Encoding' not in r.headers
+        assert re.search(rb'name="csrf_token"\s+value="[^"]+"', r.data)
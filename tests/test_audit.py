@@ -0,0 +1,67 @@
+import pytest
+
+from src.audit import AuditBuffer
+from src.extensions import db
+from src.models.user import Vitals, Medicine, AuditEvent
+
+
+def test_doctor_access_is_audited(client, app, users, login):
+    with app.app_context():
+        patient_id, doctor_id = users(care_team=True)
+
+    login(client, 'doctor1')
+    client.get(f'/doctor/view/{patient_id}')
+    # a cached page is still an access
+    client.get(f'/doctor/view/{patient_id}')
+    client.post(f'/doctor/add_vital/{patient_id}', data={'type': 'bp', 'value1': '130', 'value2': '85'})
+    with app.app_context():
+        vital_id = Vitals.query.one().id
+    client.post(f'/doctor/delete_vital/{vital_id}')
+    with app.app_context():
+        meds = [Medicine(patient_id=patient_id, name='Aspirin'), Medicine(patient_id=patient_id, name='Metformin')]
+        db.session.add_all(meds)
+        db.session.commit()
+        med_id, own_med_id = (m.id for m in meds)
+    # the shared delete route is audited too when a doctor uses it
+    client.post(f'/delete_medicine/{med_id}')
+    client.get(f'/export_pdf?patient_id={patient_id}')
+    client.get('/logout')
+
+    # the patient's own access is not audited
+    login(client, 'patient1')
+    client.get('/export_pdf')
+    client.post(f'/delete_medicine/{own_med_id}')
+    data = client.get(f'/api/patients/{patient_id}/access_log').get_json()
+    actions = [e['action'] for e in data['events']]
+    assert actions == ['export_pdf', 'delete_medicine', 'delete_vital', 'add_vital', 'view_record', 'view_record']
+    assert {e['actor'] for e in data['events']} == {'doctor1'}
+    assert data['events'][1]['target'] == str(med_id)
+    assert data['events'][2]['target'] == str(vital_id)
+
+    page = client.get(f'/api/patients/{patient_id}/access_log?limit=2').get_json()
+    assert len(page['events']) == 2
+    rest = client.get(f'/api/patients/{patient_id}/access_log?before={page["next_before"]}').get_json()
+    assert [e['action'] for e in rest['events']] == actions[2:]
+
+    assert client.get(f'/api/patients/{doctor_id}/access_log').status_code == 403
+
+    with app.app_context():
+        event = AuditEvent.query.first()
+        event.action = 'tampered'
+        with pytest.raises(RuntimeError):
+            db.session.commit()
+        db.session.rollback()
+
+
+def test_buffer_is_a_ring_and_requeues_on_failure(app, users):
+    buf = AuditBuffer(app, size=3, batch_size=100, interval=60, background=False)
+    with app.app_context():
+        patient_id, doctor_id = users(care_team=True)
+    for i in range(5):
+        buf.append({'actor_id': doctor_id, 'patient_id': patient_id, 'action': f'a{i}', 'target': None,
+                    'occurred_at': None})
+    assert len(buf) == 3 and buf.dropped == 2
+
+    # occurred_at is NOT NULL: the insert fails and the events stay buffered
+    assert buf.flush() == 0
+    assert len(buf) == 3
@@ -0,0 +1,115 @@
+from src.app import create_app
+from src.extensions import db
+from src.models.user import User, Vitals, CareTeamMember
+
+
+def test_get_vitals_cached_until_write(client, app, users, login):
+    with app.app_context():
+        patient_id, doctor_id = users(care_team=True)
+
+    login(client, 'patient1')
+    r = client.get('/api/get_vitals')
+    assert r.headers['X-Cache'] == 'MISS'
+    r = client.get('/api/get_vitals')
+    assert r.headers['X-Cache'] == 'HIT'
+    assert r.get_json() == []
+
+    client.post('/add_vital', json={'type': 'bp', 'value1': '120', 'value2': '80'})
+    r = client.get('/api/get_vitals')
+    assert r.headers['X-Cache'] == 'MISS'
+    assert [v['value1'] for v in r.get_json()] == ['120']
+
+
+def test_malformed_patient_id_is_rejected(client, app, users, login):
+    with app.app_context():
+        users(care_team=True)
+
+    # the cache key is built before the view runs, so it must not choke on the id
+    login(client, 'doctor1')
+    assert client.get('/api/get_vitals?patient_id=abc').status_code == 400
+    assert client.get('/export_excel?patient_id=abc').status_code == 400
+    client.get('/logout')
+    login(client, 'patient1')
+    assert client.get('/api/get_vitals?patient_id=abc').status_code == 400
+
+
+def test_authorization_runs_before_cached_responses(client, app, users, login, caplog):
+    with app.app_context():
+        patient_id, doctor_id = users(care_team=True)
+
+    login(client, 'doctor1')
+    client.get(f'/doctor/view/{patient_id}')
+    assert client.get(f'/doctor/view/{patient_id}').status_code == 200
+    client.get(f'/api/get_vitals?patient_id={patient_id}')
+    assert client.get(f'/api/get_vitals?patient_id={patient_id}').headers['X-Cache'] == 'HIT'
+
+    # removed by another process, whose invalidation this worker never saw
+    with app.app_context():
+        db.session.delete(db.session.get(CareTeamMember, (doctor_id, patient_id)))
+        db.session.commit()
+    assert client.get(f'/doctor/view/{patient_id}').status_code == 403
+    assert client.get(f'/api/get_vitals?patient_id={patient_id}').status_code == 403
+
+    # a command run against the in-process cache says its invalidations stay local
+    app.test_cli_runner().invoke(args=['care-team', 'assign', 'doctor1', 'patient1'])
+    assert 'CACHE_BACKEND=sqlite' in caplog.text
+
+
+def test_view_patient_invalidated_by_doctor_edit(client, app, users, login):
+    with app.app_context():
+        patient_id, doctor_id = users(care_team=True)
+
+    login(client, 'doctor1')
+    # the first render consumes the login flash message and is not cached
+    assert 'X-Cache' not in client.get(f'/doctor/view/{patient_id}').headers
+    assert client.get(f'/doctor/view/{patient_id}').headers['X-Cache'] == 'MISS'
+    r = client.get(f'/doctor/view/{patient_id}')
+    assert r.headers['X-Cache'] == 'HIT'
+
+    # the redirect after the edit carries a flash message, which bypasses the cache
+    r = client.post(f'/doctor/add_vital/{patient_id}', data={'type': 'bp', 'value1': '135', 'value2': '85'}, follow_redirects=True)
+    assert b'135' in r.data
+    r = client.get(f'/doctor/view/{patient_id}')
+    assert r.headers['X-Cache'] == 'MISS'
+    assert b'135' in r.data
+
+    # a different user never shares entries
+    with app.app_context():
+        other = User(username='doctor2', role='doctor')
+        other.set_password('password')
+        db.session.add(other)
+        db.session.commit()
+        db.session.add(CareTeamMember(doctor_id=other.id, patient_id=patient_id))
+        db.session.commit()
+    other_client = app.test_client()
+    login(other_client, 'doctor2')
+    other_client.get(f'/doctor/view/{patient_id}')
+    assert other_client.get(f'/doctor/view/{patient_id}').headers['X-Cache'] == 'MISS'
+
+
+def test_sqlite_backend_shares_versions(tmp_path, users, login):
+    config = {
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "app.db"}',
+        'WTF_CSRF_ENABLED': False,
+        'CACHE_BACKEND': 'sqlite',
+        'CACHE_PATH': str(tmp_path / 'cache.db'),
+    }
+    app_a = create_app(test_config=config)
+    app_b = create_app(test_config=config)
+    with app_a.app_context():
+        patient_id, _ = users(care_team=True)
+        db.session.add(Vitals(patient_id=patient_id, type='bp', value1='110', value2='70'))
+        db.session.commit()
+
+    client_a, client_b = app_a.test_client(), app_b.test_client()
+    login(client_a, 'patient1')
+    login(client_b, 'patient1')
+    assert client_a.get('/api/get_vitals').headers['X-Cache'] == 'MISS'
+    # a second "worker" sees the entry stored by the first
+    assert client_b.get('/api/get_vitals').headers['X-Cache'] == 'HIT'
+
+    client_a.post('/add_vital', json={'type': 'bp', 'value1': '125', 'value2': '82'})
+    r = client_b.get('/api/get_vitals')
+    assert r.headers['X-Cache'] == 'MISS'
+    assert len(r.get_json()) == 2
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from src.extensions import db
+from src.models.user import Appointment, CareTeamMember
+
+
+ROLES = (('alice', 'patient'), ('bob', 'patient'), ('doctor1', 'doctor'), ('doctor2', 'doctor'))
+
+
+def test_confirmed_appointment_scopes_doctor_views(client, app, users, login):
+    with app.app_context():
+        ids = dict(zip((name for name, _ in ROLES), users(*ROLES)))
+        appt = Appointment(patient_id=ids['alice'], doctor_id=ids['doctor1'], start_time=datetime(2030, 1, 7, 9, 0),
+                           end_time=datetime(2030, 1, 7, 9, 30), status='pending')
+        db.session.add(appt)
+        db.session.commit()
+        appt_id = appt.id
+
+    login(client, 'doctor1')
+    assert b'alice' not in client.get('/doctor').data
+    assert client.get(f'/doctor/view/{ids["alice"]}').status_code == 403
+
+    client.get(f'/confirm_appointment/{appt_id}')
+    with app.app_context():
+        member = db.session.get(CareTeamMember, (ids['doctor1'], ids['alice']))
+        assert member.source == 'appointment'
+
+    # the cached dashboard and record page follow the new assignment
+    page = client.get('/doctor').data
+    assert b'alice' in page and b'bob' not in page
+    assert client.get(f'/doctor/view/{ids["alice"]}').status_code == 200
+    assert client.get(f'/doctor/view/{ids["bob"]}').status_code == 403
+    assert client.get(f'/api/get_vitals?patient_id={ids["bob"]}').status_code == 403
+    assert client.get(f'/export_pdf?patient_id={ids["bob"]}').status_code == 403
+    chat = client.get('/chat').data
+    assert b'alice' in chat and b'bob' not in chat
+    client.get('/logout')
+
+    # patients see their own doctors once they have any
+    login(client, 'alice')
+    chat = client.get('/chat').data
+    assert b'doctor1' in chat and b'doctor2' not in chat
+    client.get('/logout')
+    login(client, 'bob')
+    chat = client.get('/chat').data
+    assert b'doctor1' in chat and b'doctor2' in chat
+
+
+def test_care_team_cli(app, users):
+    with app.app_context():
+        ids = dict(zip((name for name, _ in ROLES), users(*ROLES)))
+        db.session.add(Appointment(patient_id=ids['bob'], doctor_id=ids['doctor2'], start_time=datetime(2030, 1, 7, 9, 0),
+                                   status='confirmed'))
+        db.session.commit()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['care-team', 'sync'])
+    assert 'Added 1 care-team assignments' in result.output
+    assert 'Added 0' in runner.invoke(args=['care-team', 'sync']).output
+    assert 'alice assigned to doctor1' in runner.invoke(args=['care-team', 'assign', 'doctor1', 'alice']).output
+    assert runner.invoke(args=['care-team', 'assign', 'alice', 'doctor1']).exit_code != 0
+    assert 'removed' in runner.invoke(args=['care-team', 'remove', 'doctor2', 'bob']).output
+
+    with app.app_context():
+        pairs = db.session.query(CareTeamMember.doctor_id, CareTeamMember.patient_id).all()
+        assert pairs == [(ids['doctor1'], ids['alice'])]
@@ -0,0 +1,97 @@
+import pytest
+
+from src import conversations
+from src.extensions import db, socketio
+from src.models.user import ChatMessage, Conversation
+
+
+@pytest.fixture
+def send(app, login):
+    # send(username, to_id, text) over the socket, from a separate client
+    def send_message(username, to_id, text):
+        client = app.test_client()
+        login(client, username)
+        sock = socketio.test_client(app, flask_test_client=client)
+        sock.emit('private_message', {'to_user_id': to_id, 'message': text})
+        sock.disconnect()
+    return send_message
+
+
+def test_conversation_list_and_read_receipts(client, app, users, login, send):
+    with app.app_context():
+        patient_id, doctor1_id, doctor2_id = users(('patient1', 'patient'), ('doctor1', 'doctor'), ('doctor2', 'doctor'))
+
+    send('doctor1', patient_id, 'Take 500mg twice daily')
+    send('doctor2', patient_id, 'Lab results are in')
+    send('doctor2', patient_id, 'All normal')
+
+    login(client, 'patient1')
+    data = client.get('/api/conversations').get_json()
+    assert [c['username'] for c in data['conversations']] == ['doctor2', 'doctor1']
+    assert [c['unread'] for c in data['conversations']] == [2, 1]
+    assert data['conversations'][0]['last_message'] == 'All normal'
+    assert data['unread_total'] == 3
+
+    r = client.post(f'/api/conversations/{doctor2_id}/read')
+    assert r.get_json() == {'status': 'ok', 'marked': 2}
+
+    data = client.get('/api/conversations').get_json()
+    assert [c['unread'] for c in data['conversations']] == [0, 1]
+    msgs = client.get(f'/api/get_messages/{doctor2_id}').get_json()
+    assert all(m['read_at'] for m in msgs)
+
+    # the sender's own row has no unread messages
+    with app.app_context():
+        assert db.session.get(Conversation, (doctor1_id, patient_id)).unread_count == 0
+
+    r = client.get('/chat')
+    assert r.data.index(b'doctor2') < r.data.index(b'doctor1')
+
+
+def test_rebuild_conversations_from_history(app, users):
+    with app.app_context():
+        patient_id, doctor1_id, _ = users(('patient1', 'patient'), ('doctor1', 'doctor'), ('doctor2', 'doctor'))
+        # messages written before the conversations table existed
+        db.session.add_all([
+            ChatMessage(sender_id=patient_id, receiver_id=doctor1_id, message_text='Hello'),
+            ChatMessage(sender_id=patient_id, receiver_id=doctor1_id, message_text='Are you there?'),
+        ])
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['rebuild-conversations'])
+    assert result.exit_code == 0, result.output
+    assert 'Rebuilt 2 conversation rows' in result.output
+
+    with app.app_context():
+        doctor_side = db.session.get(Conversation, (doctor1_id, patient_id))
+        assert doctor_side.unread_count == 2
+        assert doctor_side.last_message_text == 'Are you there?'
+        assert db.session.get(Conversation, (patient_id, doctor1_id)).unread_count == 0
+
+
+def test_first_message_race_keeps_the_transaction(app, monkeypatch, users):
+    with app.app_context():
+        patient_id, doctor_id = users()
+        first = ChatMessage(sender_id=doctor_id, receiver_id=patient_id, message_text='Hello')
+        db.session.add(first)
+        conversations.record_message(first)
+        db.session.commit()
+
+        msg = ChatMessage(sender_id=doctor_id, receiver_id=patient_id, message_text='Any news?')
+        db.session.add(msg)
+        # another worker inserted the patient's row after this one looked for it
+        real_get = db.session.get
+        misses = []
+        def stale_get(model, ident, **kw):
+            if model is Conversation and ident == (patient_id, doctor_id) and not misses:
+                misses.append(ident)
+                return None
+            return real_get(model, ident, **kw)
+        monkeypatch.setattr(db.session, 'get', stale_get)
+
+        conversations.record_message(msg)
+        db.session.commit()
+        assert misses == [(patient_id, doctor_id)]
+        conv = real_get(Conversation, (patient_id, doctor_id))
+        assert (conv.unread_count, conv.last_message_text) == (2, 'Any news?')
+        assert ChatMessage.query.count() == 2
@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+from src.app import create_app
+from src.database import engine_options
+from src.extensions import db
+from src.models.user import User, Vitals
+
+
+def test_sqlite_connections_get_pragmas(app):
+    with app.app_context():
+        conn = db.session.connection()
+        assert conn.execute(text('PRAGMA journal_mode')).scalar().lower() == 'wal'
+        assert conn.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+        assert conn.execute(text('PRAGMA busy_timeout')).scalar() == app.config['SQLITE_BUSY_TIMEOUT_MS']
+        assert conn.execute(text('PRAGMA cache_size')).scalar() == app.config['SQLITE_CACHE_SIZE']
+
+
+def test_postgres_gets_pool_options():
+    config = {'DB_POOL_SIZE': 8, 'DB_MAX_OVERFLOW': 4, 'DB_POOL_RECYCLE': 600}
+    options = engine_options(config, 'postgresql://u:p@localhost/careconnect')
+    assert options['pool_size'] == 8
+    assert options['max_overflow'] == 4
+    assert options['pool_recycle'] == 600
+    assert options['pool_pre_ping'] is True
+    assert 'pool_size' not in engine_options(config, 'sqlite:///site.db')
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "primary.db"}',
+        'DB_REPLICA_URIS': f'sqlite:///{tmp_path / "replica.db"}',
+        'DB_REPLICA_STICKY_SECONDS': 60,
+    })
+    replica = app.extensions['db_replicas'][0]
+    db.metadatas[None].create_all(bind=replica)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in list(db.engines.values()) + [replica]:
+            engine.dispose()
+
+
+def seed(engine, reading):
+    # the same patient on both databases, with a reading that tells them apart
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), {'id': 1, 'username': 'patient1', 'role': 'patient',
+                                               'password_hash': generate_password_hash('password')})
+        conn.execute(Vitals.__table__.insert(), {'patient_id': 1, 'type': 'sugar', 'value1': reading,
+                                                 'value2': '', 'timestamp': datetime(2024, 1, 1)})
+
+
+def test_reads_use_replica_until_own_write(replica_app):
+    with replica_app.app_context():
+        seed(db.engines[None], 'primary')
+        seed(replica_app.extensions['db_replicas'][0], 'replica')
+
+    client = replica_app.test_client()
+    client.post('/login', data={'username': 'patient1', 'password': 'password'})
+
+    r = client.get('/api/get_vitals')
+    assert [v['value1'] for v in r.get_json()] == ['replica']
+    # replica answers are never stored in the response cache
+    assert client.get('/api/get_vitals').headers['X-Cache'] == 'MISS'
+
+    assert client.post('/add_vital', json={'type': 'sugar', 'value1': '101'}).status_code == 200
+    # read-your-writes: the writer is pinned to the primary for the sticky window
+    r = client.get('/api/get_vitals')
+    assert [v['value1'] for v in r.get_json()] == ['primary', '101']
+
+    # the write itself never reached the replica
+    with replica_app.extensions['db_replicas'][0].connect() as conn:
+        assert conn.execute(text('SELECT count(*) FROM vitals')).scalar() == 1
@@ -3,7 +3,7 @@ import pytest
 from flask import url_for
 
 from src.extensions import db, socketio
-from src.models.user import User, PatientProfile, Medicine, Vitals, Appointment, ChatMessage
+from src.models.user import User, PatientProfile, Medicine, Vitals, Appointment, ChatMessage, CareTeamMember
 
 
 @pytest.fixture
@@ -29,6 +29,7 @@ def create_users_and_data(app):
     # appointment linking doctor and patient
     appt = Appointment(patient_id=patient.id, doctor_id=doctor.id, start_time=v.timestamp, status='confirmed')
     db.session.add(appt)
+    db.session.add(CareTeamMember(doctor_id=doctor.id, patient_id=patient.id, source='appointment'))
 
     # chat message history
     cm = ChatMessage(sender_id=patient.id, receiver_id=doctor.id, message_text='Hello Doctor')
@@ -69,9 +70,7 @@ def test_exports_and_chat_rest(client, app):
     r = client.get(f'/export_pdf?patient_id={patient_id}')
     assert r.status_code == 200
 
-    # doctor cannot export unlinked patient (create another patient)
-    # NOTE: Business rule changed - doctors CAN now export any patient data
-    # (removed appointment requirement to allow doctors to view all patients)
+    # doctor cannot export a patient outside their care team (create another patient)
     with app.app_context():
         other = User(username='patient2', role='patient')
         other.set_password('password')
@@ -80,7 +79,7 @@ def test_exports_and_chat_rest(client, app):
         other_id = other.id
 
     r = client.get(f'/export_excel?patient_id={other_id}')
-    assert r.status_code == 200  # doctors can export any patient now
+    assert r.status_code == 403
 
     # test REST chat history
     r = client.get(f'/api/get_messages/{patient_id}')
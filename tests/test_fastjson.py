@@ -0,0 +1,52 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from flask.json.provider import DefaultJSONProvider
+
+from src import fastjson
+from src.extensions import db
+from src.models.user import Vitals, ChatMessage
+
+
+def test_provider_matches_flask_default(app):
+    payload = {'when': datetime(2024, 3, 1, 8, 30), 'dose': Decimal('2.5'), 'name': 'Ibuprofène', 'tags': [1, None]}
+    ours = json.loads(app.json.dumps(payload))
+    assert ours == json.loads(DefaultJSONProvider(app).dumps(payload))
+    assert ours['when'] == 'Fri, 01 Mar 2024 08:30:00 GMT'
+    with app.test_request_context('/'):
+        r = app.json.response(payload)
+    assert r.mimetype == 'application/json' and r.get_json() == ours
+
+
+def test_list_apis_stream_same_array(client, app, users, login):
+    with app.app_context():
+        patient_id, doctor_id = users()
+        db.session.add_all([Vitals(patient_id=patient_id, type='bp', value1=str(100 + i), value2='80',
+                                   timestamp=datetime(2024, 1, 1, 8, i, 0, i * 1000)) for i in range(30)])
+        db.session.add(ChatMessage(sender_id=doctor_id, receiver_id=patient_id, message_text='Hi "there"',
+                                   timestamp=datetime(2024, 1, 2, 9, 0)))
+        db.session.commit()
+    app.config['JSON_STREAM_BATCH_SIZE'] = 7
+
+    login(client, 'patient1')
+    whole = client.get('/api/get_vitals')
+    streamed = client.get('/api/get_vitals?stream=1')
+    assert streamed.is_streamed
+    assert streamed.get_json() == whole.get_json()
+    data = whole.get_json()
+    assert len(data) == 30 and data[0] == {'id': 1, 'type': 'bp', 'value1': '100', 'value2': '80',
+                                           'timestamp': datetime(2024, 1, 1, 8, 0).isoformat()}
+    assert data[5]['timestamp'] == datetime(2024, 1, 1, 8, 5, 0, 5000).isoformat()
+
+    msgs = client.get(f'/api/get_messages/{doctor_id}?stream=1').get_json()
+    assert msgs == [{'id': 1, 'from': doctor_id, 'to': patient_id, 'text': 'Hi "there"',
+                     'timestamp': '2024-01-02T09:00:00', 'read_at': None}]
+
+
+def test_encode_rows_stdlib_fallback(monkeypatch):
+    rows = [{'id': 1, 'timestamp': datetime(2024, 1, 1, 8, 0, 0, 1500), 'text': 'é'}]
+    fast = fastjson.encode_rows(rows)
+    monkeypatch.setattr(fastjson, 'orjson', None)
+    assert json.loads(fastjson.encode_rows(rows)) == json.loads(fast)
+    assert b''.join(fastjson._array_chunks(iter([]), 10)) == b'[]\n'
@@ -0,0 +1,52 @@
+import re
+
+from flask import g
+
+
+def test_patient_fragments_shared_between_doctors_until_write(app, users, login):
+    with app.app_context():
+        patient_id, _, _ = users(('patient1', 'patient'), ('doctor1', 'doctor'), ('doctor2', 'doctor'), care_team=True)
+    store = app.extensions['fragment_cache']
+
+    first, second = app.test_client(), app.test_client()
+    login(first, 'doctor1')
+    first.get(f'/doctor/view/{patient_id}')
+    misses = store.misses
+    assert store.hits == 0 and misses > 0
+
+    # another doctor gets a response cache miss but every fragment from the store
+    login(second, 'doctor2')
+    r = second.get(f'/doctor/view/{patient_id}')
+    assert r.status_code == 200
+    assert store.misses == misses and store.hits == misses
+
+    first.post(f'/doctor/add_vital/{patient_id}', data={'type': 'bp', 'value1': '142', 'value2': '91'})
+    r = second.get(f'/doctor/view/{patient_id}')
+    assert b'142' in r.data
+    assert store.misses == 2 * misses
+
+    stats = second.get('/api/doctor/cache_stats').get_json()
+    assert stats['fragments']['hits'] == misses
+    assert stats['fragments']['hit_rate'] == round(misses / (3 * misses), 4)
+
+
+def test_cached_fragment_carries_current_csrf_token(app, users, login):
+    with app.app_context():
+        users(('patient1', 'patient'), ('doctor1', 'doctor'), ('doctor2', 'doctor'), care_team=True)
+    first, second = app.test_client(), app.test_client()
+    login(first, 'patient1')
+    first.post('/add_medicine', data={'name': 'Metformin', 'dosage': '500mg'})
+    first_page = first.get('/dashboard').data.decode()
+    hits = app.extensions['fragment_cache'].hits
+
+    # pytest-flask keeps one app context for the whole test; forget the first session's token
+    g.pop('csrf_token', None)
+    login(second, 'patient1')
+    second_page = second.get('/dashboard').data.decode()
+    assert app.extensions['fragment_cache'].hits > hits
+    assert 'Metformin' in second_page and '\x1e' not in second_page
+    # every form on each page, cached rows included, carries that session's token
+    first_tokens = set(re.findall(r'name="csrf_token"\s+value="([^"]+)"', first_page))
+    second_tokens = set(re.findall(r'name="csrf_token"\s+value="([^"]+)"', second_page))
+    assert len(first_tokens) == len(second_tokens) == 1
+    assert first_tokens != second_tokens
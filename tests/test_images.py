@@ -0,0 +1,96 @@
+import io
+import os
+
+from PIL import Image
+
+from src import images
+from src.extensions import db
+from src.models.user import MedicalFile
+
+
+def phone_photo():
+    # landscape sensor data with an EXIF "rotate 90° CW" orientation, like a portrait phone shot
+    img = Image.effect_noise((3000, 1500), 60).convert('RGB')
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    exif[0x010F] = 'PhoneMaker'
+    bio = io.BytesIO()
+    img.save(bio, format='JPEG', quality=98, exif=exif)
+    return bio.getvalue()
+
+
+def test_uploaded_photo_is_oriented_stripped_and_downscaled(client, app, tmp_path, users, login):
+    app.config.update(IMAGE_MAX_DIMENSION=1024, IMAGE_ORIGINALS_FOLDER=str(tmp_path))
+    with app.app_context():
+        [patient_id] = users(('patient1', 'patient'))
+    data = phone_photo()
+
+    login(client, 'patient1')
+    r = client.post('/upload_file', data={'file': (io.BytesIO(data), 'prescription.jpg', 'image/jpeg')},
+                    content_type='multipart/form-data')
+    assert r.status_code == 200
+
+    with app.app_context():
+        mf = db.session.get(MedicalFile, r.get_json()['file_id'])
+        assert mf.optimized_at is not None
+        assert mf.original_size_bytes == len(data)
+        assert mf.size_bytes < len(data)
+        stored = os.path.join(app.config['UPLOAD_FOLDER'], f'user_{patient_id}', mf.storage_filename)
+        original = tmp_path / f'user_{patient_id}' / mf.storage_filename
+
+    assert os.path.getsize(stored) == mf.size_bytes
+    with Image.open(stored) as img:
+        assert img.size == (512, 1024)  # rotated upright, longest side capped
+        assert 'exif' not in img.info
+    assert original.read_bytes() == data
+
+    # downloads serve the optimized file
+    r = client.get(f'/download_file/{mf.id}')
+    assert len(r.data) == mf.size_bytes
+
+    # deleting the file removes the kept original as well
+    client.post(f'/delete_file/{mf.id}')
+    assert not os.path.exists(stored)
+    assert not original.exists()
+
+
+def test_pdf_uploads_are_untouched(client, app, users, login):
+    with app.app_context():
+        users(('patient1', 'patient'))
+    login(client, 'patient1')
+    r = client.post('/upload_file', data={'file': (io.BytesIO(b'%PDF-1.4 test'), 'lab.pdf', 'application/pdf')},
+                    content_type='multipart/form-data')
+    with app.app_context():
+        mf = db.session.get(MedicalFile, r.get_json()['file_id'])
+        assert mf.optimized_at is None and mf.size_bytes == 13
+
+
+def test_original_kept_only_when_replaced(client, app, tmp_path, users, login):
+    app.config.update(IMAGE_ORIGINALS_FOLDER=str(tmp_path))
+    with app.app_context():
+        [patient_id] = users(('patient1', 'patient'))
+    # a tiny optimized PNG without metadata is left as uploaded
+    bio = io.BytesIO()
+    Image.new('L', (8, 8)).save(bio, format='PNG', optimize=True)
+
+    login(client, 'patient1')
+    r = client.post('/upload_file', data={'file': (io.BytesIO(bio.getvalue()), 'scan.png', 'image/png')},
+                    content_type='multipart/form-data')
+    with app.app_context():
+        mf = db.session.get(MedicalFile, r.get_json()['file_id'])
+        assert mf.optimized_at is not None and mf.size_bytes == len(bio.getvalue())
+        assert not (tmp_path / f'user_{patient_id}' / mf.storage_filename).exists()
+
+
+def test_file_deleted_during_optimization_is_not_recreated(tmp_path, monkeypatch):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(phone_photo())
+    real_save = Image.Image.save
+
+    def save_then_delete(self, fp, *args, **kwargs):
+        real_save(self, fp, *args, **kwargs)
+        os.remove(path)  # delete_file ran meanwhile
+    monkeypatch.setattr(Image.Image, 'save', save_then_delete)
+
+    assert images.optimize_image(str(path), max_dimension=1024) is None
+    assert os.listdir(tmp_path) == []
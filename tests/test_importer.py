@@ -0,0 +1,111 @@
+import io
+import json
+from datetime import datetime
+
+from src import importer
+from src.extensions import db
+from src.importer import import_vitals
+from src.models.user import Vitals
+
+
+def test_ndjson_import_endpoint_dedupes_and_reports_errors(client, app, users):
+    with app.app_context():
+        [patient_id] = users(('patient1', 'patient'))
+
+    lines = [
+        {'type': 'sugar', 'value1': '101', 'timestamp': '2024-01-01T08:00:00'},
+        {'type': 'sugar', 'value1': '102', 'timestamp': '2024-01-01T08:01:00'},
+        {'type': 'sugar', 'value1': 'high', 'timestamp': '2024-01-01T08:02:00'},
+        {'type': 'sugar', 'value1': '101', 'timestamp': '2024-01-01T08:00:00'},
+        {'type': 'bp', 'value1': '120', 'value2': '80'},
+    ]
+    body = '\n'.join(json.dumps(line) for line in lines) + '\nnot json\n'
+
+    client.post('/login', data={'username': 'patient1', 'password': 'password'})
+    r = client.post('/api/vitals/import', data=body, content_type='application/x-ndjson')
+    assert r.status_code == 200
+    summary = r.get_json()
+    assert summary['processed'] == 6
+    assert summary['inserted'] == 2
+    assert summary['duplicates'] == 1
+    assert summary['errors'] == 3
+    assert [e['line'] for e in summary['error_details']] == [3, 5, 6]
+
+    # re-importing the same export inserts nothing
+    r = client.post('/api/vitals/import', data=body, content_type='application/x-ndjson')
+    assert r.get_json()['inserted'] == 0
+    with app.app_context():
+        assert Vitals.query.filter_by(patient_id=patient_id).count() == 2
+
+
+def test_import_commits_in_chunks(app, users):
+    with app.app_context():
+        [patient_id] = users(('patient1', 'patient'))
+        lines = (json.dumps({'type': 'sugar', 'value1': str(90 + i % 10), 'timestamp': f'2024-01-01T{i // 60:02d}:{i % 60:02d}:00'}).encode()
+                 for i in range(250))
+        summary = import_vitals(patient_id, lines, 'ndjson', chunk_size=40)
+        assert summary.inserted == 250
+        assert Vitals.query.filter_by(patient_id=patient_id).count() == 250
+
+
+def test_csv_import_cli(app, tmp_path, users):
+    with app.app_context():
+        [patient_id] = users(('patient1', 'patient'))
+    path = tmp_path / 'cuff.csv'
+    path.write_text('type,value1,value2,timestamp\nbp,130,85,2024-02-01T07:30:00\nbp,128,84,2024-02-02T07:30:00\nbp,,84,2024-02-03T07:30:00\n')
+
+    result = app.test_cli_runner().invoke(args=['import-vitals', str(patient_id), str(path)])
+    assert result.exit_code == 0, result.output
+    summary = json.loads(result.output)
+    assert summary['inserted'] == 2
+    assert summary['error_details'] == [{'line': 4, 'error': 'Missing type or non-numeric value1'}]
+
+
+def test_import_converts_offsets_and_rejects_odd_types(client, app, users):
+    app.config.update(MAX_CONTENT_LENGTH=200, IMPORT_MAX_CONTENT_LENGTH=10000)
+    with app.app_context():
+        [patient_id] = users(('patient1', 'patient'))
+
+    lines = [
+        {'type': 'sugar', 'value1': '101', 'timestamp': '2024-05-01T08:00:00+02:00'},
+        {'type': 7, 'value1': '102', 'timestamp': '2024-05-01T08:01:00'},
+        {'type': ['bp'], 'value1': '120', 'timestamp': '2024-05-01T08:02:00'},
+    ]
+    body = '\n'.join(json.dumps(line) for line in lines) + '\n'
+    # bigger than MAX_CONTENT_LENGTH: the import endpoint has its own limit
+    body += '\n' * (400 - len(body))
+    client.post('/login', data={'username': 'patient1', 'password': 'password'})
+    r = client.post('/api/vitals/import', data={'file': (io.BytesIO(body.encode()), 'export.ndjson')},
+                    content_type='multipart/form-data')
+    assert r.status_code == 200
+    summary = r.get_json()
+    assert summary['inserted'] == 1
+    assert summary['error_details'] == [{'line': 2, 'error': 'type must be a string'},
+                                        {'line': 3, 'error': 'type must be a string'}]
+    with app.app_context():
+        assert [v.timestamp for v in Vitals.query.filter_by(patient_id=patient_id)] == [datetime(2024, 5, 1, 6, 0)]
+
+    # other routes keep MAX_CONTENT_LENGTH
+    r = client.post('/upload_file', data={'file': (io.BytesIO(b'%PDF' + b'x' * 400), 'big.pdf', 'application/pdf')},
+                    content_type='multipart/form-data')
+    assert r.status_code == 413
+
+
+def test_import_skips_readings_a_concurrent_import_stored(app, users, monkeypatch):
+    with app.app_context():
+        [patient_id] = users(('patient1', 'patient'))
+        real_insert = importer.insert_ignoring_duplicates
+
+        def racing_insert(table):
+            # another import commits the first reading after this chunk's duplicate check
+            with db.engine.begin() as conn:
+                conn.execute(table.insert(), {'patient_id': patient_id, 'type': 'sugar', 'value1': '101', 'value2': '',
+                                              'timestamp': datetime(2024, 1, 1, 8, 0)})
+            return real_insert(table)
+        monkeypatch.setattr(importer, 'insert_ignoring_duplicates', racing_insert)
+
+        lines = [json.dumps({'type': 'sugar', 'value1': v, 'timestamp': ts}).encode()
+                 for v, ts in (('101', '2024-01-01T08:00:00'), ('102', '2024-01-01T08:01:00'))]
+        summary = import_vitals(patient_id, lines, 'ndjson')
+        assert (summary.inserted, summary.duplicates) == (1, 1)
+        assert Vitals.query.filter_by(patient_id=patient_id).count() == 2
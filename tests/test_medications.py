@@ -0,0 +1,79 @@
+import time
+
+from src.extensions import db, cache
+from src.cache import medications_key
+from src import medications
+from src.medications import MedicationIndex, load_bundled
+from src.models.user import Medicine
+
+
+def test_suggestions_rank_by_prescriptions_and_learn_new_names(client, app, users, login):
+    with app.app_context():
+        patient_id, doctor_id = users(care_team=True)
+        db.session.add_all([Medicine(patient_id=patient_id, name='Metoprolol'),
+                            Medicine(patient_id=patient_id, name='metoprolol ')])
+        db.session.commit()
+
+    login(client, 'doctor1')
+    names = [s['name'] for s in client.get('/api/medications/suggest?q=MET').get_json()]
+    # prescribed twice (under two spellings) beats the bundled-only names
+    assert names[0] == 'Metoprolol'
+    assert 'Metformin' in names and 'Methotrexate' in names
+    assert client.get('/api/medications/suggest?q=zz').get_json() == []
+
+    client.post(f'/doctor/add_medicine/{patient_id}', data={'name': 'Zuranolone', 'dosage': '50mg'})
+    r = client.get('/api/medications/suggest?q=zur&limit=1')
+    assert r.get_json() == [{'name': 'Zuranolone', 'count': 1}]
+    index = app.extensions['medication_index']
+
+    # deleting the prescription takes its count back down, without a rebuild
+    with app.app_context():
+        med_id = Medicine.query.filter_by(name='Zuranolone').one().id
+    client.post(f'/doctor/delete_medicine/{med_id}')
+    r = client.get('/api/medications/suggest?q=zur&limit=1')
+    assert r.get_json() == [{'name': 'Zuranolone', 'count': 0}]
+    assert app.extensions['medication_index'] is index
+
+
+def test_other_workers_changes_trigger_a_rebuild(client, app, users, login):
+    with app.app_context():
+        patient_id, _ = users(care_team=True)
+    login(client, 'doctor1')
+    assert client.get('/api/medications/suggest?q=zur').get_json() == []
+
+    # another worker committed a prescription and bumped the shared version
+    with app.app_context():
+        db.session.add(Medicine(patient_id=patient_id, name='Zuranolone'))
+        db.session.commit()
+        cache.bump(medications_key())
+    assert client.get('/api/medications/suggest?q=zur').get_json() == [{'name': 'Zuranolone', 'count': 1}]
+
+
+def test_stale_lookup_does_not_overwrite_the_memo(monkeypatch):
+    index = MedicationIndex()
+    for i in range(medications.MEMO_MIN_MATCHES + 10):
+        index.add(f'compound {i:05d}', count=0)
+    real_nsmallest = medications.heapq.nsmallest
+
+    def racing_nsmallest(*args, **kwargs):
+        # an add lands while this lookup is ranking the old counts
+        result = real_nsmallest(*args, **kwargs)
+        index.add('compound 00200', count=5)
+        return result
+    monkeypatch.setattr(medications.heapq, 'nsmallest', racing_nsmallest)
+    index.suggest('compound', limit=1)
+    monkeypatch.setattr(medications.heapq, 'nsmallest', real_nsmallest)
+    assert index.suggest('compound', limit=1) == [{'name': 'compound 00200', 'count': 5}]
+
+
+def test_lookup_is_fast_on_a_large_index():
+    index = MedicationIndex()
+    load_bundled(index)
+    for i in range(50000):
+        index.add(f'compound {i:05d}', count=i % 7)
+    start = time.perf_counter()
+    for _ in range(100):
+        results = index.suggest('compound 1', limit=10)
+    per_lookup = (time.perf_counter() - start) / 100
+    assert len(results) == 10 and results[0]['count'] == 6
+    assert per_lookup < 0.001
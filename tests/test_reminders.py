@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import click
+
+from src import reminders
+from src.app import create_app
+from src.extensions import db
+from src.models.user import Appointment
+
+
+def capture_emits(monkeypatch):
+    sent = []
+    monkeypatch.setattr(reminders.socketio, 'emit', lambda event, data, room=None: sent.append((event, data, room)))
+    return sent
+
+
+def test_catch_up_sends_latest_overdue_reminder_once(app, monkeypatch, users):
+    sent = capture_emits(monkeypatch)
+    now = datetime.utcnow()
+    with app.app_context():
+        patient_id, doctor_id = users()
+        soon = Appointment(patient_id=patient_id, doctor_id=doctor_id, start_time=now + timedelta(minutes=30),
+                           status='confirmed')
+        pending = Appointment(patient_id=patient_id, doctor_id=doctor_id, start_time=now + timedelta(minutes=40),
+                              status='pending')
+        later = Appointment(patient_id=patient_id, doctor_id=doctor_id, start_time=now + timedelta(days=3),
+                            status='confirmed')
+        db.session.add_all([soon, pending, later])
+        db.session.commit()
+
+        sched = reminders.scheduler()
+        # both the 24h and the 1h reminder of `soon` are overdue; only the 1h one goes out
+        assert sched.run_due(now) == 1
+        assert [(e, d['appointment_id'], d['minutes_before'], r) for e, d, r in sent] == [
+            ('appointment_reminder', soon.id, 60, str(patient_id)),
+            ('appointment_reminder', soon.id, 60, str(doctor_id)),
+        ]
+        assert db.session.get(Appointment, soon.id).last_reminder_at is not None
+        assert sched.run_due(now) == 0
+
+        # a restarted worker finds nothing left to send for `soon`
+        fresh = reminders.ReminderScheduler(app, offsets=(1440, 60), window=timedelta(hours=6), background=False)
+        assert fresh.run_due(now) == 0
+        # `later` enters the window once its day-before reminder is near
+        assert sched.run_due(later.start_time - timedelta(hours=23)) == 1
+
+
+def test_confirm_and_cancel_update_the_schedule(client, app, monkeypatch, users, login):
+    sent = capture_emits(monkeypatch)
+    start = datetime.utcnow() + timedelta(hours=2)
+    with app.app_context():
+        patient_id, doctor_id = users()
+        kept = Appointment(patient_id=patient_id, doctor_id=doctor_id, start_time=start,
+                           end_time=start + timedelta(minutes=30), status='pending')
+        dropped = Appointment(patient_id=patient_id, doctor_id=doctor_id, start_time=start + timedelta(hours=1),
+                              end_time=start + timedelta(hours=1, minutes=30), status='confirmed')
+        db.session.add_all([kept, dropped])
+        db.session.commit()
+        kept_id, dropped_id = kept.id, dropped.id
+        sched = reminders.scheduler()
+        sched.load()
+        assert {appt_id for _, appt_id, _ in sched._heap} == {dropped_id}
+
+    login(client, 'doctor1')
+    client.get(f'/confirm_appointment/{kept_id}')
+    client.get(f'/cancel_appointment/{dropped_id}')
+
+    with app.app_context():
+        assert sched.run_due(start - timedelta(minutes=55)) == 1
+    assert {d['appointment_id'] for _, d, _ in sent} == {kept_id}
+
+
+def test_scheduler_starts_with_the_worker_but_not_in_cli_commands(tmp_path, monkeypatch):
+    started = []
+    monkeypatch.setattr(reminders.ReminderScheduler, 'start', lambda self: started.append(self))
+    config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "reminders.db"}', 'REMINDERS_ASYNC': True}
+
+    app = create_app(config)
+    assert started == [app.extensions['reminders']]
+
+    with click.Context(click.Command('send-reminders')):
+        create_app(config)
+    assert len(started) == 1
+    assert create_app(dict(config, TESTING=True)).extensions['reminders'].background is False
@@ -0,0 +1,59 @@
+from sqlalchemy import text
+
+from src import search
+from src.extensions import db
+from src.models.user import ChatMessage
+from src.schema import migrate
+
+
+def test_search_is_ranked_highlighted_and_scoped(client, app, users, login):
+    with app.app_context():
+        p1, p2, doc = users(('patient1', 'patient'), ('patient2', 'patient'), ('doctor1', 'doctor'))
+        db.session.add_all([
+            ChatMessage(sender_id=doc, receiver_id=p1, message_text='Take metformin 500mg with dinner'),
+            ChatMessage(sender_id=p1, receiver_id=doc, message_text='Is <b>metformin</b> safe? metformin again'),
+            ChatMessage(sender_id=doc, receiver_id=p2, message_text='Your metformin dose is 850mg'),
+            ChatMessage(sender_id=doc, receiver_id=p1, message_text='See you next week'),
+        ])
+        db.session.commit()
+
+    login(client, 'patient1')
+    data = client.get('/api/messages/search?q=metformin').get_json()
+    # patient2's thread is not visible; the message mentioning it twice ranks first
+    assert len(data['results']) == 2
+    assert data['results'][0]['from'] == p1
+    snippet = data['results'][0]['snippet']
+    assert '<mark>metformin</mark>' in snippet
+    assert '&lt;b&gt;' in snippet and '<b>' not in snippet
+
+    # prefix match on the last word, pagination
+    data = client.get('/api/messages/search?q=metf&per_page=1').get_json()
+    assert len(data['results']) == 1 and data['has_more'] is True
+    data = client.get('/api/messages/search?q=metf&per_page=1&page=2').get_json()
+    assert len(data['results']) == 1 and data['has_more'] is False
+
+    # new messages are indexed on insert; query syntax characters are harmless
+    with app.app_context():
+        db.session.add(ChatMessage(sender_id=doc, receiver_id=p1, message_text='Dosage changed to 1000mg'))
+        db.session.commit()
+    data = client.get('/api/messages/search?q=dosage ("*').get_json()
+    assert [r['other_id'] for r in data['results']] == [doc]
+    assert client.get('/api/messages/search').status_code == 400
+
+
+def test_migrate_installs_and_fills_a_missing_index(client, app, users, login):
+    with app.app_context():
+        p1, doc = users(('patient1', 'patient'), ('doctor1', 'doctor'))
+        # a database set up before search existed: no FTS table or triggers, messages already stored
+        db.session.execute(text(f'DROP TABLE {search.FTS_TABLE}'))
+        for trigger in ('ai', 'ad', 'au'):
+            db.session.execute(text(f'DROP TRIGGER {search.FTS_TABLE}_{trigger}'))
+        db.session.add(ChatMessage(sender_id=doc, receiver_id=p1, message_text='Take metformin with dinner'))
+        db.session.commit()
+
+        assert search.FTS_TABLE in migrate(app, db.engine, db.metadata)
+        assert migrate(app, db.engine, db.metadata) == []
+
+    login(client, 'patient1')
+    data = client.get('/api/messages/search?q=metformin').get_json()
+    assert [r['other_id'] for r in data['results']] == [doc]
@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime
+
+from sqlalchemy import inspect
+
+from src.app import create_app
+from src.extensions import db
+from src.models.user import Appointment, Vitals
+from src.schema import (ensure_schema, migrate, schema_fingerprint, schema_version, store_fingerprint,
+                        stored_fingerprint)
+from src.views.appointments import find_conflicts
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def test_heavy_libraries_not_imported_at_startup():
+    code = ('import sys; from src.app import create_app; create_app({"SCHEMA_CHECK": "skip"}); '
+            'print(sorted(m for m in ("openpyxl", "reportlab.pdfgen.canvas", "numpy") if m in sys.modules))')
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == '[]'
+
+
+def test_versioned_schema_check_runs_create_all_once(app):
+    app.config['SCHEMA_CHECK'] = 'versioned'
+    with app.app_context():
+        # test.db outlives single tests; start without a stored fingerprint
+        schema_version.drop(db.engine, checkfirst=True)
+    assert ensure_schema(app) is True
+    with app.app_context():
+        assert stored_fingerprint(db.engine) == schema_fingerprint(db.metadata)
+    # fingerprint matches the models: nothing to do on the next boot
+    assert ensure_schema(app) is False
+
+    with app.app_context():
+        store_fingerprint(db.engine, 'outdated')
+    assert ensure_schema(app) is True
+
+    # a recreated database has no fingerprint and is set up again
+    with app.app_context():
+        schema_version.drop(db.engine)
+    assert ensure_schema(app) is True
+
+    app.config['SCHEMA_CHECK'] = 'skip'
+    assert ensure_schema(app) is False
+
+
+LEGACY_SCHEMA = [
+    # tables as the first release created them
+    'CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(150) NOT NULL UNIQUE, email VARCHAR(200), '
+    'password_hash VARCHAR(256) NOT NULL, role VARCHAR(50))',
+    'CREATE TABLE appointments (id INTEGER PRIMARY KEY, patient_id INTEGER NOT NULL, doctor_id INTEGER NOT NULL, '
+    'start_time DATETIME NOT NULL, status VARCHAR(50))',
+    'CREATE TABLE vitals (id INTEGER PRIMARY KEY, patient_id INTEGER NOT NULL, type VARCHAR(50), '
+    'value1 VARCHAR(100), value2 VARCHAR(100), timestamp DATETIME)',
+    "INSERT INTO users (id, username, password_hash, role) VALUES (1, 'doc', 'x', 'doctor'), (2, 'pat', 'x', 'patient')",
+    "INSERT INTO appointments (patient_id, doctor_id, start_time, status) VALUES (2, 1, '2030-01-07 09:00:00.000000', 'confirmed')",
+    # the same reading stored twice, and two without a timestamp
+    "INSERT INTO vitals (patient_id, type, value1, timestamp) VALUES (2, 'bp', '120', '2024-05-01 08:00:00.000000'), "
+    "(2, 'bp', '121', '2024-05-01 08:00:00.000000'), (2, 'bp', '130', NULL), (2, 'bp', '131', NULL)",
+]
+
+
+def test_existing_tables_get_new_columns(tmp_path):
+    path = tmp_path / 'legacy.db'
+    conn = sqlite3.connect(path)
+    for stmt in LEGACY_SCHEMA:
+        conn.execute(stmt)
+    conn.commit()
+    conn.close()
+
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        insp = inspect(db.engine)
+        columns = {c['name'] for c in insp.get_columns('appointments')}
+        assert {'duration_minutes', 'end_time', 'updated_at', 'last_reminder_at'} <= columns
+        assert {'uq_vitals_patient_client_key', 'uq_vitals_patient_type_ts'} <= {i['name'] for i in insp.get_indexes('vitals')}
+        # duplicates were removed before the unique index went on; the oldest copy stays
+        assert sorted(v.value1 for v in Vitals.query) == ['120', '130', '131']
+        appt = Appointment.query.one()
+        # backfilled, so the legacy booking still blocks its slot
+        assert (appt.duration_minutes, appt.end_time) == (30, datetime(2030, 1, 7, 9, 30))
+        assert find_conflicts(1, datetime(2030, 1, 7, 9, 15), datetime(2030, 1, 7, 9, 45)) == [appt]
+        # nothing left to add on the next boot
+        assert migrate(app, db.engine, db.metadata) == []
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,84 @@
+import io
+import os
+
+from sqlalchemy import update
+
+from src.extensions import db
+from src import storage
+from src.models.user import MedicalFile, PatientSummary
+
+
+def upload(client, size, name='lab.pdf'):
+    body = b'%PDF-1.4 ' + b'x' * (size - 9)
+    return client.post('/upload_file', data={'file': (io.BytesIO(body), name, 'application/pdf')},
+                       content_type='multipart/form-data')
+
+
+def test_usage_tracked_on_upload_and_delete(client, app, users, login):
+    app.config['STORAGE_QUOTA_BYTES'] = 10000
+    with app.app_context():
+        patient_id, _ = users(('patient1', 'patient'), ('patient2', 'patient'))
+
+    login(client, 'patient1')
+    first = upload(client, 3000).get_json()['file_id']
+    assert upload(client, 4000).status_code == 200
+    with app.app_context():
+        assert db.session.get(PatientSummary, patient_id).storage_bytes == 7000
+
+    # 4000 more would pass the declared-length check but not the real one
+    r = upload(client, 4000)
+    assert r.status_code == 413
+    assert r.get_json() == {'error': 'Storage quota exceeded', 'used_bytes': 7000, 'quota_bytes': 10000}
+    # far too large: refused on Content-Length alone, before the body is parsed
+    assert upload(client, 9000).status_code == 413
+
+    with app.app_context():
+        mf = db.session.get(MedicalFile, first)
+        path = os.path.join(app.config['UPLOAD_FOLDER'], f'user_{patient_id}', mf.storage_filename)
+    assert os.path.exists(path)
+    client.post(f'/delete_file/{first}')
+    assert not os.path.exists(path)
+    with app.app_context():
+        summary = db.session.get(PatientSummary, patient_id)
+        assert (summary.file_count, summary.storage_bytes) == (1, 4000)
+    assert upload(client, 4000).status_code == 200
+
+
+def test_report_and_backfill(client, app, users, login):
+    with app.app_context():
+        patient_id, other_id = users(('patient1', 'patient'), ('patient2', 'patient'))
+    login(client, 'patient1')
+    upload(client, 2048)
+    client.get('/logout')
+    login(client, 'patient2')
+    file_id = upload(client, 5000).get_json()['file_id']
+
+    with app.app_context():
+        # a row from before sizes were recorded
+        mf = db.session.get(MedicalFile, file_id)
+        mf.size_bytes = None
+        db.session.get(PatientSummary, other_id).storage_bytes = 0
+        db.session.commit()
+
+    runner = app.test_cli_runner()
+    assert 'Recorded sizes of 1 files' in runner.invoke(args=['storage', 'backfill']).output
+    lines = runner.invoke(args=['storage', 'report']).output.splitlines()
+    assert [line.split()[0] for line in lines] == ['patient2', 'patient1']
+    assert '2.0 KiB in 1 files' in lines[1]
+
+
+def test_reserve_checks_the_stored_total(client, app, users):
+    app.config['STORAGE_QUOTA_BYTES'] = 10000
+    with app.app_context():
+        patient_id, _ = users(('patient1', 'patient'), ('patient2', 'patient'))
+        assert storage.reserve(patient_id, 6000) is None
+        db.session.commit()
+        # the session still sees 6000, but another upload committed meanwhile
+        assert db.session.get(PatientSummary, patient_id).storage_bytes == 6000
+        with db.engine.begin() as conn:
+            conn.execute(update(PatientSummary).where(PatientSummary.patient_id == patient_id).values(storage_bytes=9000))
+        assert storage.reserve(patient_id, 2000) == {
+            'error': 'Storage quota exceeded', 'used_bytes': 9000, 'quota_bytes': 10000}
+        assert storage.reserve(patient_id, 1000) is None
+        db.session.commit()
+        assert db.session.get(PatientSummary, patient_id).storage_bytes == 10000
@@ -0,0 +1,102 @@
+from src.extensions import db, cache
+from src.cache import summary_key
+from src import summary
+from src.models.user import User, Vitals, Medicine, PatientSummary
+
+
+def test_write_paths_maintain_summary(client, app, users, login):
+    with app.app_context():
+        patient_id, doctor_id = users(care_team=True)
+
+    login(client, 'patient1')
+    client.post('/add_vital', json={'type': 'bp', 'value1': '120', 'value2': '80'})
+    client.post('/add_vital', json={'type': 'sugar', 'value1': '99'})
+    client.post('/add_medicine', data={'name': 'Metformin', 'dosage': '500mg'})
+    client.get('/logout')
+
+    login(client, 'doctor1')
+    client.post(f'/doctor/add_vital/{patient_id}', data={'type': 'bp', 'value1': '142', 'value2': '91'})
+    client.post(f'/doctor/add_medicine/{patient_id}', data={'name': 'Lisinopril', 'dosage': '10mg'})
+
+    with app.app_context():
+        s = db.session.get(PatientSummary, patient_id)
+        assert (s.latest_bp_value1, s.latest_bp_value2) == ('142', '91')
+        assert s.medicine_count == 2 and s.file_count == 0
+        latest = Vitals.query.filter_by(patient_id=patient_id, value1='142').one()
+        latest_id = latest.id
+        assert s.last_vital_at == latest.timestamp
+        med_id = Medicine.query.filter_by(name='Metformin').one().id
+
+    # deleting the latest reading falls back to the previous one
+    client.post(f'/doctor/delete_vital/{latest_id}')
+    client.post(f'/doctor/delete_medicine/{med_id}')
+    with app.app_context():
+        s = db.session.get(PatientSummary, patient_id)
+        assert (s.latest_bp_value1, s.latest_bp_value2) == ('120', '80')
+        assert s.medicine_count == 1
+
+    r = client.get('/doctor')
+    assert b'BP 120/80' in r.data
+    assert b'1 medicines' in r.data
+
+
+def test_rebuild_command_repairs_drift(app, users):
+    with app.app_context():
+        patient_id, doctor_id = users(care_team=True)
+        # rows written behind the summary's back
+        db.session.add(Vitals(patient_id=patient_id, type='bp', value1='150', value2='95'))
+        db.session.add(Medicine(patient_id=patient_id, name='Aspirin'))
+        db.session.add(PatientSummary(patient_id=patient_id, medicine_count=7, file_count=3))
+        db.session.commit()
+
+        before = cache.backend.get_versions([summary_key(doctor_id)])[0]
+
+    result = app.test_cli_runner().invoke(args=['rebuild-summaries'])
+    assert result.exit_code == 0, result.output
+    assert 'Rebuilt 1 patient summaries' in result.output
+
+    with app.app_context():
+        # the caring doctor's cached list pages are invalidated
+        assert cache.backend.get_versions([summary_key(doctor_id)])[0] == before + 1
+        s = db.session.get(PatientSummary, patient_id)
+        assert (s.medicine_count, s.file_count) == (1, 0)
+        assert s.latest_bp_value1 == '150'
+
+
+def test_only_the_care_team_dashboards_are_invalidated(client, app, users, login):
+    with app.app_context():
+        patient_id, doctor_id = users(care_team=True)
+        other = User(username='doctor2', role='doctor')
+        other.set_password('password')
+        db.session.add(other)
+        db.session.commit()
+        before = {d: cache.backend.get_versions([summary_key(d)])[0] for d in (doctor_id, other.id)}
+
+    login(client, 'patient1')
+    client.post('/add_vital', json={'type': 'bp', 'value1': '120', 'value2': '80'})
+    with app.app_context():
+        assert cache.backend.get_versions([summary_key(doctor_id)])[0] == before[doctor_id] + 1
+        assert cache.backend.get_versions([summary_key(other.id)])[0] == before[other.id]
+
+
+def test_first_touch_race_keeps_the_transaction(app, monkeypatch, users):
+    with app.app_context():
+        patient_id, _ = users(care_team=True)
+        summary.rebuild_summaries([patient_id])
+        db.session.add(Medicine(patient_id=patient_id, name='Aspirin'))
+
+        # another worker inserted the row after this one looked for it
+        real_get = db.session.get
+        misses = []
+        def stale_get(model, ident, **kw):
+            if model is PatientSummary and not misses:
+                misses.append(ident)
+                return None
+            return real_get(model, ident, **kw)
+        monkeypatch.setattr(db.session, 'get', stale_get)
+
+        summary.adjust_counts(patient_id, medicines=1)
+        db.session.commit()
+        assert misses == [patient_id]
+        assert real_get(PatientSummary, patient_id).medicine_count == 1
+        assert Medicine.query.filter_by(patient_id=patient_id).count() == 1
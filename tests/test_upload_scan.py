@@ -0,0 +1,81 @@
+import io
+import json
+import os
+import time
+
+from src.extensions import db
+from src.models.user import MedicalFile, PatientSummary
+
+
+def upload(client, name='lab.pdf'):
+    return client.post('/upload_file', data={'file': (io.BytesIO(b'%PDF-1.4 report'), name, 'application/pdf')},
+                       content_type='multipart/form-data')
+
+
+def test_scan_reports_then_quarantines_orphans(client, app, tmp_path, users, login):
+    app.config.update(UPLOAD_SCAN_CHECKPOINT=str(tmp_path / 'scan.json'),
+                      UPLOAD_QUARANTINE_FOLDER=str(tmp_path / 'quarantine'),
+                      UPLOAD_SCAN_PAUSE_SECONDS=0)
+    with app.app_context():
+        [patient_id] = users(('patient1', 'patient'))
+    login(client, 'patient1')
+    kept = upload(client).get_json()['file_id']
+    lost = upload(client).get_json()['file_id']
+
+    folder = os.path.join(app.config['UPLOAD_FOLDER'], f'user_{patient_id}')
+    with app.app_context():
+        os.remove(os.path.join(folder, db.session.get(MedicalFile, lost).storage_filename))
+    stray = os.path.join(folder, 'stray.pdf')
+    recent = os.path.join(folder, 'recent.pdf')
+    for path in (stray, recent):
+        with open(path, 'wb') as fh:
+            fh.write(b'%PDF-1.4 stray')
+    old = time.time() - 2 * 3600
+    os.utime(stray, (old, old))
+
+    runner = app.test_cli_runner()
+    # one file per batch: the first run stops early and the next one resumes from the saved cursor
+    first = runner.invoke(args=['scan-uploads', '--batch-size', '1', '--max-batches', '2']).output
+    assert 'scan paused' in first
+    assert json.loads((tmp_path / 'scan.json').read_text())['phase'] == 'files'
+    rest = runner.invoke(args=['scan-uploads', '--batch-size', '1']).output
+    found = first + rest
+    assert found.count(f'orphaned file user_{patient_id}/stray.pdf') == 1
+    assert f'missing file for row {lost}' in rest
+    assert 'recent.pdf' not in found
+    assert 'scan paused' not in rest
+    assert os.path.exists(stray)
+
+    result = runner.invoke(args=['scan-uploads', '--quarantine']).output
+    assert '1 orphaned files, 1 rows without a file' in result
+    assert not os.path.exists(stray)
+    assert (tmp_path / 'quarantine' / f'user_{patient_id}' / 'stray.pdf').exists()
+    dropped = [json.loads(line) for line in (tmp_path / 'quarantine' / 'missing_rows.jsonl').read_text().splitlines()]
+    assert [row['id'] for row in dropped] == [lost]
+    with app.app_context():
+        assert db.session.get(MedicalFile, lost) is None
+        assert db.session.get(MedicalFile, kept) is not None
+        assert db.session.get(PatientSummary, patient_id).file_count == 1
+
+    assert '0 orphaned files, 0 rows without a file' in runner.invoke(args=['scan-uploads']).output
+
+
+def test_file_batch_seeks_to_cursor(tmp_path, monkeypatch):
+    for n in range(1, 6):
+        folder = tmp_path / f'user_{n}'
+        folder.mkdir()
+        for name in ('a.pdf', 'b.pdf'):
+            (folder / name).write_bytes(b'%PDF')
+    (tmp_path / 'notes.txt').write_text('not a user folder')
+
+    from src import upload_scan
+    names = upload_scan.list_user_dirs(str(tmp_path))
+    assert names == [f'user_{n}' for n in range(1, 6)]
+    checked = []
+    real_isdir = os.path.isdir
+    monkeypatch.setattr(upload_scan.os.path, 'isdir', lambda p: checked.append(os.path.basename(p)) or real_isdir(p))
+
+    batch = upload_scan.file_batch(str(tmp_path), 'user_3/a.pdf', 2, names)
+    assert [relpath for _, relpath in batch] == ['user_3/b.pdf', 'user_4/a.pdf']
+    # folders before the cursor and after the full batch are never touched
+    assert checked == ['user_3', 'user_4']
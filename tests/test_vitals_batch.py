@@ -0,0 +1,85 @@
+from src.models.user import Vitals
+
+
+def test_batch_inserts_valid_readings_and_reports_errors(client, app, users, login):
+    with app.app_context():
+        [patient_id] = users(('patient1', 'patient'))
+
+    login(client, 'patient1')
+    readings = [
+        # readings recorded in the future are rejected
+        {'idempotency_key': 'a1', 'type': 'bp', 'value1': '120', 'value2': '80', 'timestamp': '2999-01-01T08:00:00Z'},
+        {'idempotency_key': 'a2', 'type': 'sugar', 'value1': 'abc'},
+        {'idempotency_key': 'a3', 'type': 'sugar', 'value1': '98'},
+        {'idempotency_key': 'a3', 'type': 'sugar', 'value1': '98'},
+        {'type': 'bp'},
+    ]
+    r = client.post('/api/vitals/batch', json={'readings': readings})
+    assert r.status_code == 200
+    data = r.get_json()
+    assert [res['status'] for res in data['results']] == ['error', 'error', 'created', 'duplicate', 'error']
+    assert data['created'] == 1
+
+    with app.app_context():
+        rows = Vitals.query.filter_by(patient_id=patient_id).all()
+        assert [(v.type, v.value1, v.client_key) for v in rows] == [('sugar', '98', 'a3')]
+        assert data['results'][2]['id'] == rows[0].id == data['results'][3]['id']
+
+
+def test_batch_replay_is_idempotent(client, app, users, login):
+    with app.app_context():
+        [patient_id] = users(('patient1', 'patient'))
+
+    login(client, 'patient1')
+    readings = [
+        {'idempotency_key': f'k{i}', 'type': 'bp', 'value1': str(110 + i), 'value2': '70', 'timestamp': f'2024-05-01T08:{i:02d}:00'}
+        for i in range(20)
+    ]
+    first = client.post('/api/vitals/batch', json=readings).get_json()
+    assert first['created'] == 20
+    second = client.post('/api/vitals/batch', json=readings).get_json()
+    assert second['created'] == 0 and second['duplicates'] == 20
+    assert [r['id'] for r in first['results']] == [r['id'] for r in second['results']]
+
+    with app.app_context():
+        assert Vitals.query.filter_by(patient_id=patient_id).count() == 20
+
+    assert client.post('/api/vitals/batch', json=[]).status_code == 400
+
+
+def test_batch_keyless_readings_and_offsets(client, app, users, login):
+    with app.app_context():
+        [patient_id] = users(('patient1', 'patient'))
+
+    login(client, 'patient1')
+    readings = [
+        {'type': 'sugar', 'value1': '90', 'timestamp': '2024-05-01T08:00:00+02:00'},
+        {'idempotency_key': 'k1', 'type': 'sugar', 'value1': '95', 'timestamp': '2024-05-01T09:30:00Z'},
+        {'type': 'sugar', 'value1': '100', 'timestamp': '2024-05-01T08:00:00-05:00'},
+    ]
+    data = client.post('/api/vitals/batch', json=readings).get_json()
+    assert data['created'] == 3
+    # offsets are converted to UTC before the zone is dropped
+    assert [res['timestamp'] for res in data['results']] == [
+        '2024-05-01T06:00:00', '2024-05-01T09:30:00', '2024-05-01T13:00:00']
+
+    with app.app_context():
+        by_id = {v.id: v.value1 for v in Vitals.query.filter_by(patient_id=patient_id)}
+    # keyless readings get their own ids back, in request order
+    assert [by_id[res['id']] for res in data['results']] == ['90', '95', '100']
+
+    # one reading per type and instant: the same reading under a new key, or sent
+    # twice in one batch, is a duplicate of the stored one
+    data = client.post('/api/vitals/batch', json=[
+        {'idempotency_key': 'k2', 'type': 'sugar', 'value1': '90', 'timestamp': '2024-05-01T06:00:00'},
+        {'type': 'bp', 'value1': '121', 'timestamp': '2024-05-02T08:00:00'},
+        {'type': 'bp', 'value1': '121', 'timestamp': '2024-05-02T08:00:00'},
+    ]).get_json()
+    assert [res['status'] for res in data['results']] == ['duplicate', 'created', 'duplicate']
+    assert data['results'][0]['id'] == vital_id(app, patient_id, '90')
+    assert data['results'][2]['id'] == data['results'][1]['id'] == vital_id(app, patient_id, '121')
+
+
+def vital_id(app, patient_id, value1):
+    with app.app_context():
+        return Vitals.query.filter_by(patient_id=patient_id, value1=value1).one().id